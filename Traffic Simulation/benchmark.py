@@ -0,0 +1,267 @@
+# coding = utf-8
+"""Benchmarks of the simulation, without graphic interface
+
+    python3 benchmark.py memory --vehicles 100000
+    python3 benchmark.py networks --grid 2 4 8 --arterial 4 16 --period 6 3 --duration 120 --output results.json
+    python3 benchmark.py multirate --network arterial --size 4 --spacing 2000 --coarse-steps 5 10
+"""
+
+from simulation import *
+from network import grid_network, arterial_network
+from engine import Engine
+from headless import STEPS_PER_CALL
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import multiprocessing
+import traceback
+import argparse
+import tracemalloc
+import random
+import json
+import sys
+
+# Synthetic networks, built from their size (see network.py)
+NETWORKS = {"grid": grid_network, "arterial": arterial_network}
+
+
+class DictVehicle:
+    """Frozen copy of the attributes of a Vehicle before it used __slots__ (commit d70023f),
+    stored in the __dict__ of each object : baseline of vehicle_memory()"""
+
+    def __init__(self, road, origin_cross, T=1, s0=2, a=1.5, vehicle_type="car", b=1.5):
+        self.id = next(Vehicle.ids)
+        self.road = road
+        self.origin_cross = origin_cross
+        self.destination_cross = None
+        self.next_road = None
+        self.last_road = None
+        self.leader = None
+        self.followers = []
+        self.leadership_color = random_color()
+        self.x = 0
+        self.v = 0
+
+        self.T = T
+        self.s0 = s0
+        self.delta = 4
+        self.b = b
+
+        self.decision = False
+        self.slow_down = 0
+        self.angle = 0
+
+        self.rep = None
+        self.brake_rep = None
+        self.last_a = 0
+        self.blinker_rep = None
+        self.direction = None
+        self.movement = None
+        self.blinker_state = 0
+        self.slot = None
+        self.lane = None
+        self.lane_prev = None
+        self.lane_next = None
+
+        self.veh_type = vehicle_type
+        self.a = a if vehicle_type == "car" else 1
+        self.b_max = Vehicle.VEH_B_MAX[vehicle_type]
+        self.length = Vehicle.VEH_LENGTH[vehicle_type]
+        self.width = 2 if vehicle_type == "car" else 2.5
+        self.v0 = road.speed_limit
+
+def object_memory(vehicle_class, nb_vehicles=100000):
+    """Memory [bytes] allocated per vehicle of vehicle_class (Vehicle or DictVehicle), created alone"""
+    reset()
+    random.seed(0)
+    start = GeneratorCross((0, 0), 6)
+    end = GeneratorCross((10 * nb_vehicles, 0), 6)
+    road = Road(start, end, 50/3.6, id=0)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [vehicle_class(road, start, vehicle_type="car" if i % 10 else "truck") for i in range(nb_vehicles)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del objects
+    reset()
+    return (after - before) / nb_vehicles
+
+def vehicle_memory(nb_vehicles=100000):
+    """Put nb_vehicles vehicles in a queue on a single road, each one following the previous one
+    Return the memory [bytes] allocated per vehicle (object, followers, lane and map bookkeeping)"""
+    reset()
+    random.seed(0)
+    start = GeneratorCross((0, 0), 6)
+    end = GeneratorCross((10 * nb_vehicles, 0), 6)
+    road = Road(start, end, 50/3.6, id=0)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(nb_vehicles):
+        veh = Vehicle(road, start, vehicle_type="car" if i % 10 else "truck")
+        vehicles.append(veh)
+        road.incoming_veh(veh, start, 0)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    reset()
+    return (after - before) / nb_vehicles
+
+def peak_rss():
+    """Peak resident set size [MB] of the process, None if unknown"""
+    try:
+        import resource
+    except ImportError: # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10 # bytes on macOS, kB on Linux
+
+def run_network(network, size, period=6, duration=120, dt=0.01, mode="scalar", seed=0, spacing=200, coarse_steps=1):
+    """Build a synthetic network (see NETWORKS) and simulate it during duration [s]
+    Return the measures of the run"""
+    random.seed(seed)
+    NETWORKS[network](size, spacing=spacing, period=period)
+    engine = Engine(dt, mode, coarse_steps=coarse_steps)
+    total_steps = int(round(duration / dt))
+
+    T = perf_counter()
+    speed_sum, nb_calls = 0, 0
+    while engine.steps < total_steps:
+        engine.next_steps(min(STEPS_PER_CALL, total_steps - engine.steps))
+        deleted_vehicles.clear() # nothing to delete on a canvas
+        speed_sum += engine.average_speed
+        nb_calls += 1
+    wall_time = perf_counter() - T
+    engine.fetch_vehicles() # vehicles left up to date for the caller
+
+    return {"network": network,
+            "size": size,
+            "spacing": spacing,
+            "period": period,
+            "crosses": len(crosses) - len(generators),
+            "generators": len(generators),
+            "roads": len(roads),
+            "duration": engine.t,
+            "dt": engine.dt,
+            "mode": mode,
+            "seed": seed,
+            "coarse_steps": coarse_steps,
+            "steps": engine.steps,
+            "wall_time": wall_time,
+            "steps_per_second": engine.steps / wall_time,
+            "vehicle_steps_per_second": engine.vehicle_steps / wall_time,
+            "real_time_factor": engine.t / wall_time,
+            "real_time": engine.t >= wall_time,
+            "mean_vehicles": engine.vehicle_steps / max(1, engine.steps),
+            "accelerations_per_step": engine.integrations / max(1, engine.steps),
+            "skipped_steps": engine.skipped_steps,
+            "mean_average_speed": speed_sum / max(1, nb_calls), # [km/h]
+            "vehicles_on_map": len(vehicles),
+            "generated_vehicles": engine.generated,
+            "peak_rss_mb": peak_rss(),
+            "phase_times": dict(engine.phase_times)} # [s]
+
+def network_worker(kwargs):
+    """Run of a benchmark process : the measures, or the error if the simulation failed"""
+    try:
+        return run_network(**kwargs)
+    except Exception:
+        return dict(kwargs, error=traceback.format_exc())
+
+def benchmark_networks(grids=(2, 4, 8), arterials=(4, 16), periods=(6, 3), duration=120, dt=0.01, mode="scalar", seed=0, verbose=True):
+    """Simulate every synthetic network of every size with every period, one after another,
+    each one in a new process so that its peak memory is its own
+    Return the list of the measures of the runs"""
+    scenarios = [("grid", size) for size in grids] + [("arterial", size) for size in arterials]
+    results = []
+    for network, size in scenarios:
+        for period in periods:
+            kwargs = {"network": network, "size": size, "period": period, "duration": duration, "dt": dt, "mode": mode, "seed": seed}
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(network_worker, kwargs).result()
+            results.append(result)
+            if verbose:
+                if "error" in result:
+                    print("{} {} period {} s: failed".format(network, size, period), file=sys.stderr)
+                else:
+                    print("{} {} period {} s: {:.0f} steps/s, {:.0f} vehicle steps/s, x{:.2f} real time, {:.0f} MB".format(
+                        network, size, period, result["steps_per_second"], result["vehicle_steps_per_second"],
+                        result["real_time_factor"], result["peak_rss_mb"] or 0), file=sys.stderr)
+    return results
+
+
+def multirate_errors(network, size, spacing=2000, period=6, duration=120, dt=0.01, mode="scalar", seed=0, coarse_steps=(5, 10)):
+    """Simulate a synthetic network with every vehicle integrated on every step, then with each number
+    of coarse_steps (see Engine), from the same seed
+    Return the measures of the runs, with their differences from the first one : largest position
+    difference [m] of the vehicles on the same road in both runs, difference of the mean speed [km/h]"""
+    results = []
+    for steps in (1,) + tuple(coarse_steps):
+        result = run_network(network, size, period, duration, dt, mode, seed, spacing, steps)
+        positions = {veh.id: (veh.road, veh.x) for veh in vehicles}
+        if steps == 1:
+            reference, reference_positions = result, positions
+        else:
+            common = [i for i, (road, x) in positions.items() if i in reference_positions and reference_positions[i][0] is road]
+            result["compared_vehicles"] = len(common)
+            result["max_position_error"] = max([abs(positions[i][1] - reference_positions[i][1]) for i in common], default=0)
+            result["mean_speed_error"] = result["mean_average_speed"] - reference["mean_average_speed"]
+            result["work_reduction"] = reference["accelerations_per_step"] / max(1e-9, result["accelerations_per_step"])
+            result["speedup"] = reference["wall_time"] / result["wall_time"]
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the traffic simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    memory_parser = commands.add_parser("memory", help="memory used by each vehicle on the map")
+    memory_parser.add_argument("--vehicles", type=int, default=100000, help="number of vehicles on the map")
+
+    networks_parser = commands.add_parser("networks", help="simulate synthetic networks and report the measures as JSON")
+    networks_parser.add_argument("--grid", type=int, nargs="*", default=[2, 4, 8], help="sizes of the grids (size x size signalised crosses)")
+    networks_parser.add_argument("--arterial", type=int, nargs="*", default=[4, 16], help="number of crosses of the arterials")
+    networks_parser.add_argument("--period", type=float, nargs="+", default=[6, 3], help="mean times between two generated vehicles [s]")
+    networks_parser.add_argument("--duration", type=float, default=120, help="simulated duration of each run [s]")
+    networks_parser.add_argument("--dt", type=float, default=0.01, help="simulation time step [s]")
+    networks_parser.add_argument("--mode", choices=Engine.MODES, default="scalar", help="vehicle update: one by one or vectorized with NumPy")
+    networks_parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    networks_parser.add_argument("--output", default=None, help="JSON file of the results (standard output by default)")
+
+    multirate_parser = commands.add_parser("multirate", help="accuracy and work of the multi-rate integration against the single-rate one")
+    multirate_parser.add_argument("--network", choices=NETWORKS, default="arterial", help="synthetic network")
+    multirate_parser.add_argument("--size", type=int, default=4, help="size of the network")
+    multirate_parser.add_argument("--spacing", type=float, default=2000, help="distance between two crosses [m]")
+    multirate_parser.add_argument("--period", type=float, default=6, help="mean time between two generated vehicles [s]")
+    multirate_parser.add_argument("--duration", type=float, default=120, help="simulated duration of each run [s]")
+    multirate_parser.add_argument("--dt", type=float, default=0.01, help="simulation time step [s]")
+    multirate_parser.add_argument("--mode", choices=Engine.MODES, default="scalar", help="vehicle update: one by one or vectorized with NumPy")
+    multirate_parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    multirate_parser.add_argument("--coarse-steps", type=int, nargs="+", default=[5, 10], help="numbers of steps during which the free vehicles keep their acceleration")
+
+    args = parser.parse_args(argv)
+    if args.command == "memory":
+        memory = vehicle_memory(args.vehicles)
+        # Same queue, the vehicle objects being replaced by their layout before __slots__
+        before = memory - object_memory(Vehicle, args.vehicles) + object_memory(DictVehicle, args.vehicles)
+        print("Memory per vehicle:   {:.0f} bytes ({} vehicles)".format(memory, args.vehicles))
+        print("Before __slots__:     {:.0f} bytes (see DictVehicle)".format(before))
+    elif args.command == "networks":
+        results = benchmark_networks(args.grid, args.arterial, args.period, args.duration, args.dt, args.mode, args.seed)
+        if args.output == None:
+            print(json.dumps(results, indent=2))
+        else:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+    elif args.command == "multirate":
+        results = multirate_errors(args.network, args.size, args.spacing, args.period, args.duration, args.dt, args.mode, args.seed, args.coarse_steps)
+        print("coarse steps  accelerations/step  wall time  max position error  mean speed error")
+        for result in results:
+            print("{:>12}  {:>18.1f}  {:>7.2f} s  {:>15.4f} m  {:>10.4f} km/h".format(result["coarse_steps"], result["accelerations_per_step"],
+                result["wall_time"], result.get("max_position_error", 0), result.get("mean_speed_error", 0)))
+
+
+if __name__ == "__main__":
+    main()
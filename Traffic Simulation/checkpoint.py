@@ -0,0 +1,251 @@
+# coding = utf-8
+"""Save the complete state of a simulation and restore it exactly, to start several runs from the same state
+
+    python3 headless.py run --map maps/map_data.txt --duration 1800 --save-checkpoint warm.json.gz
+    python3 headless.py run --map maps/map_data.txt --duration 600 --resume warm.json.gz --period 4
+
+A checkpoint holds the dynamic state only (gzip-compressed JSON) : vehicles with their links,
+content of the lanes (stop vehicles included), priorities of the crosses, pending events
+(generations, traffic lights phases), generator timers, random generator state and time.
+The network itself is rebuilt by the caller, the same way as for the saved run
+(load_network, grid_network...) : its parameters (periods, traffic lights...) can be changed.
+"""
+
+from simulation import *
+from engine import Engine
+from scheduler import GENERATION, TRAFFIC_LIGHTS
+from itertools import count
+import random
+import gzip
+import json
+
+VERSION = 1
+
+# Attributes of the vehicles saved as they are
+VEHICLE_FIELDS = ("id", "x", "v", "v0", "last_a", "T", "s0", "a", "b", "b_max", "length", "veh_type",
+                  "decision", "slow_down", "angle", "direction", "leadership_color", "blinker_state")
+
+
+def network_signature():
+    """Description of the network, to check that a checkpoint is restored on the same one"""
+    cross_index = {cross: i for i, cross in enumerate(crosses)}
+    return {"crosses": [list(cross.coords) for cross in crosses],
+            "roads": [[cross_index[road.cross1], cross_index[road.cross2]] for road in roads]}
+
+def save_checkpoint(engine, filename, map_filename=None):
+    """Write the state of the simulation run by engine in filename
+    map_filename : network of the simulation, kept as an indication for the restore"""
+    if len(engine.lanes) != 2 * len(roads):
+        raise ValueError("Only an engine simulating the whole map can be saved")
+    engine.fetch_vehicles()
+
+    cross_index = {cross: i for i, cross in enumerate(crosses)}
+    road_index = {road: i for i, road in enumerate(roads)}
+    vehicle_index = {veh: i for i, veh in enumerate(vehicles)}
+    def ref(veh):
+        """Reference to a vehicle : its index in vehicles, -2r-1 / -2r-2 for the stops of the road r"""
+        if veh == None:
+            return None
+        if veh.veh_type == "stop":
+            return -2 * road_index[veh.road] - (1 if veh is veh.road.stop1 else 2)
+        if veh not in vehicle_index:
+            raise ValueError("Vehicle {} is linked to the map but is not on it".format(veh.id))
+        return vehicle_index[veh]
+    def road_ref(road):
+        return None if road == None else road_index[road]
+    def leader_ref(leader):
+        """Reference to the leader of a free vehicle, "gone" if it left the map since"""
+        return "gone" if leader != None and leader.veh_type != "stop" and leader not in vehicle_index else ref(leader)
+
+    vehicle_states = []
+    for veh in vehicles:
+        state = {field: getattr(veh, field) for field in VEHICLE_FIELDS}
+        state.update({"road": road_index[veh.road],
+                      "origin_cross": cross_index[veh.origin_cross],
+                      "destination_cross": cross_index[veh.destination_cross],
+                      "next_road": road_ref(veh.next_road),
+                      "last_road": road_ref(veh.last_road),
+                      "leader": ref(veh.leader),
+                      "followers": [ref(follower) for follower in veh.followers],
+                      "slot": veh.slot,
+                      "generator": None if veh.generator == None else cross_index[veh.generator],
+                      "entry_t": veh.entry_t,
+                      "free_time": veh.free_time,
+                      "destination": veh.destination})
+        vehicle_states.append(state)
+
+    events = []
+    for tick, kind, counter, action, args in engine.scheduler.queue:
+        if kind == GENERATION:
+            events.append([tick, kind, counter, cross_index[args[0]]])
+        elif kind == TRAFFIC_LIGHTS:
+            events.append([tick, kind, counter, cross_index[args[0]], args[1], args[2]])
+
+    arrays = Vehicle.arrays
+    if arrays != None: # free vehicles of the vectorized engine
+        free_vehicles = [(arrays.objects[s], None if arrays.free_leader[s] < 0 else arrays.objects[arrays.free_leader[s]])
+                         for s in arrays.free.nonzero()[0].tolist()]
+    else:
+        free_vehicles = engine.free_vehicles.items()
+    state = {"version": VERSION,
+             "map": map_filename,
+             "network": network_signature(),
+             "engine": {"tick": engine.tick,
+                        "dt": engine.dt,
+                        "mode": engine.mode,
+                        "steps": engine.steps,
+                        "average_speed": engine.average_speed,
+                        "generated": engine.generated,
+                        "exited": engine.exited,
+                        "vehicle_steps": engine.vehicle_steps,
+                        "integrations": engine.integrations,
+                        "skipped_steps": engine.skipped_steps,
+                        "next_fast_forward": engine.next_fast_forward,
+                        "dormant": [[ref(veh), tick] for veh, tick in engine.dormant.items() if veh in vehicle_index],
+                        "coarse_steps": engine.coarse_steps,
+                        "free_vehicles": [[ref(veh), leader_ref(leader)] for veh, leader in free_vehicles if veh in vehicle_index],
+                        "awake_crosses": [cross_index[cross] for cross in engine.awake_crosses],
+                        "events": events,
+                        "counter": engine.scheduler.counter},
+             "vehicles": vehicle_states,
+             "next_id": list(Vehicle.ids.__reduce__()[1]), # start (and step) of the count
+             "lanes": [[[ref(veh) for veh in road.vehicle_list_12], [ref(veh) for veh in road.vehicle_list_21]] for road in roads],
+             "stops": [[[ref(veh) for veh in stop.followers], stop.slot] for road in roads for stop in (road.stop1, road.stop2)],
+             "priorities": [getattr(cross, "priority", None) for cross in crosses],
+             "generators": [[cross_index[gen], gen.next_period, gen.rand_period, gen.last_t, gen.nb_generated, gen.nb_absorbed] for gen in generators],
+             "slots": None if arrays == None else {"capacity": arrays.capacity, "free_slots": arrays.free_slots},
+             "random": random.getstate()}
+
+    with gzip.open(filename, "wt") as file:
+        json.dump(state, file, separators=(",", ":"))
+
+def load_checkpoint(filename, mode=None, dt=None, coarse_steps=None):
+    """Restore the state saved in filename on the network already built
+    mode, dt, coarse_steps : those of the saved engine by default
+    Return the Engine continuing the saved simulation"""
+    with gzip.open(filename, "rt") as file:
+        state = json.load(file)
+    if state["version"] != VERSION:
+        raise ValueError("Unsupported checkpoint version {}".format(state["version"]))
+    if state["network"] != json.loads(json.dumps(network_signature())):
+        raise ValueError("The network does not match the checkpoint")
+    saved = state["engine"]
+    mode = saved["mode"] if mode == None else mode
+    dt = saved["dt"] if dt == None else dt
+    coarse_steps = saved["coarse_steps"] if coarse_steps == None else coarse_steps
+    if dt != saved["dt"]:
+        raise ValueError("The time step of the checkpoint is {} s".format(saved["dt"]))
+
+    # Empty the map
+    vehicles.clear()
+    deleted_vehicles.clear()
+    for road in roads:
+        for lane in (road.vehicle_list_12, road.vehicle_list_21):
+            while len(lane) > 0:
+                lane.popleft()
+        for stop in (road.stop1, road.stop2):
+            stop.followers = []
+            stop.slot = None
+
+    # Vehicles, created without drawing a color nor a number
+    restored = []
+    for veh_state in state["vehicles"]:
+        veh = Vehicle.__new__(Vehicle)
+        for field in VEHICLE_FIELDS:
+            setattr(veh, field, veh_state[field])
+        veh.road = roads[veh_state["road"]]
+        veh.origin_cross = crosses[veh_state["origin_cross"]]
+        veh.destination_cross = crosses[veh_state["destination_cross"]]
+        veh.next_road = None if veh_state["next_road"] == None else roads[veh_state["next_road"]]
+        veh.last_road = None if veh_state["last_road"] == None else roads[veh_state["last_road"]]
+        veh.movement = None if veh.next_road == None else veh.destination_cross.movement(veh.road, veh.next_road)
+        veh.rep, veh.brake_rep, veh.blinker_rep = None, None, None
+        veh.lane, veh.lane_rank, veh.lane_prev, veh.lane_next = None, None, None, None
+        veh.slot = None
+        # Journey of the vehicle (see journeys.py), missing from the older checkpoints
+        veh.generator = None if veh_state.get("generator") == None else crosses[veh_state["generator"]]
+        veh.entry_t = veh_state.get("entry_t")
+        veh.free_time = veh_state.get("free_time", 0)
+        veh.destination = veh_state.get("destination")
+        restored.append(veh)
+        vehicles.append(veh)
+    def obj(ref):
+        if ref == None:
+            return None
+        if ref < 0:
+            road = roads[(-ref - 1) // 2]
+            return road.stop1 if ref % 2 == 1 else road.stop2
+        return restored[ref]
+
+    for veh, veh_state in zip(restored, state["vehicles"]):
+        veh.leader = obj(veh_state["leader"])
+        veh.followers = [obj(ref) for ref in veh_state["followers"]]
+    for road, (lane_12, lane_21) in zip(roads, state["lanes"]):
+        for ref in lane_12:
+            road.vehicle_list_12.append(obj(ref))
+        for ref in lane_21:
+            road.vehicle_list_21.append(obj(ref))
+    stops = [stop for road in roads for stop in (road.stop1, road.stop2)]
+    for stop, (followers, slot) in zip(stops, state["stops"]):
+        stop.followers = [obj(ref) for ref in followers]
+
+    # The engine schedules its own events on creation : they are replaced by the saved ones
+    engine = Engine(dt, mode, coarse_steps=coarse_steps)
+    engine.tick = saved["tick"]
+    engine.steps = saved["steps"]
+    engine.average_speed = saved["average_speed"]
+    engine.generated = saved["generated"]
+    engine.exited = saved["exited"]
+    engine.vehicle_steps = saved["vehicle_steps"]
+    engine.integrations = saved["integrations"]
+    engine.skipped_steps = saved.get("skipped_steps", 0)
+    engine.next_fast_forward = saved.get("next_fast_forward", 0)
+    if mode == "scalar":
+        engine.dormant = {obj(veh): tick for veh, tick in saved.get("dormant", [])}
+    gone = Vehicle.__new__(Vehicle) # leader that left the map, followed by nobody
+    if coarse_steps == saved["coarse_steps"]:
+        engine.free_vehicles = {obj(veh): gone if leader == "gone" else obj(leader) for veh, leader in saved["free_vehicles"]}
+    engine.awake_crosses = dict.fromkeys(crosses[i] for i in saved["awake_crosses"])
+    engine.scheduler.queue = []
+    for event in saved["events"]:
+        tick, kind, counter, cross = event[0], event[1], event[2], crosses[event[3]]
+        if kind == GENERATION:
+            engine.scheduler.queue.append((tick, kind, counter, engine.generate, (cross,)))
+        else:
+            engine.scheduler.queue.append((tick, kind, counter, engine.change_phase, (cross, event[4], event[5])))
+    engine.scheduler.counter = saved["counter"]
+
+    for cross, priority in zip(crosses, state["priorities"]):
+        if priority != None:
+            cross.priority = priority
+    for i, next_period, rand_period, last_t, nb_generated, nb_absorbed in state["generators"]:
+        gen = crosses[i]
+        gen.next_period, gen.rand_period, gen.last_t = next_period, rand_period, last_t
+        gen.nb_generated, gen.nb_absorbed = nb_generated, nb_absorbed
+
+    # Same slots as in the saved arrays, so that the vehicles are updated in the same order
+    if mode == "vectorized" and state["slots"] != None:
+        from vectorized import VehicleArrays
+        arrays = VehicleArrays(state["slots"]["capacity"])
+        owners = [(stop, slot) for stop, (followers, slot) in zip(stops, state["stops"])]
+        owners += [(veh, veh_state["slot"]) for veh, veh_state in zip(restored, state["vehicles"])]
+        for veh, slot in owners:
+            veh.slot = None
+            if slot != None:
+                veh.slot = slot
+                arrays.objects[slot] = veh
+                arrays.active[slot] = True
+        arrays.free_slots = state["slots"]["free_slots"]
+        Vehicle.arrays = arrays
+        for veh, slot in owners:
+            arrays.write(veh)
+    if mode == "vectorized":
+        for veh, leader in engine.free_vehicles.items():
+            Vehicle.arrays.free[veh.slot] = True
+            Vehicle.arrays.free_leader[veh.slot] = -1 if leader == None else -2 if leader is gone else leader.slot
+        engine.free_vehicles = dict()
+
+    Vehicle.ids = count(*state["next_id"])
+    version, internal, gauss = state["random"]
+    random.setstate((version, tuple(internal), gauss))
+    return engine
@@ -19,3 +19,9 @@ ROAD_OUTLINE_COLOR = "#ffffff"
 PRIORITY_GAP = {"car" : 1.5, "truck": 3, "stop":0}
 TIME_TO_CROSS = {"right": {"car": 0.5, "truck":2, "stop":0}, "other":{"car": 3, "truck":4, "stop":0}}
 RAND_GAP = 5 # Bigger this constant is, more random is the generation of vehicles
+# Multi-rate integration (see Engine) : a vehicle is free when its speed is within FREE_SPEED_GAP*v0 of v0
+# and when the interaction term of the IIDM (desired gap / spacing) stays below FREE_INTERACTION
+FREE_SPEED_GAP = 0.05
+FREE_INTERACTION = 0.5
+# Fast-forward (see Engine) : number of steps before a new attempt when the time could not jump
+FAST_FORWARD_RETRY = 10
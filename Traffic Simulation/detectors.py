@@ -0,0 +1,142 @@
+# coding = utf-8
+"""Virtual loop detectors at given abscissae of the lanes, logging the passage of every vehicle
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --detector 12:1:50 --detector 30:0:120 --detector-log loops/run1
+
+A detector log is a directory holding :
+- detectors.json : record format, and road, lane and abscissa of each detector
+- <detector name>.bin : one fixed-size record (see RECORD) per passage, written as the simulation goes,
+  read by read_detector() or numpy.fromfile(filename, dtype=[("t", "<f8"), ("id", "<i4"), ("type", "i1"), ("v", "<f4"), ("headway", "<f4")])
+
+The vehicles on a lane keep their order : a detector only watches the next vehicle to pass it
+(the first one entered on the lane after the last vehicle passed, see Lane.append()), and checks
+on each step whether it went past its abscissa.
+"""
+
+from simulation import *
+from struct import Struct
+import json
+import os
+
+VERSION = 1
+
+# One record per passage : time [s], Vehicle.id, type (see TYPES), speed [m/s], headway [s] (time since
+# the previous passage, NaN for the first one), little-endian without padding (21 bytes)
+RECORD = Struct("<dibff")
+FIELDS = ("t", "id", "type", "v", "headway")
+TYPES = {"car": 0, "truck": 1}
+
+
+class Detector:
+    """Loop detector at the abscissa x of the lane of road going to destination_cross"""
+
+    __slots__ = ("name", "road", "lane", "x", "passed", "passed_rank", "last_t", "nb_passages", "file")
+
+    def __init__(self, road, destination_cross, x, name=None):
+        if type(road) is not Road:
+            raise NotRoadError
+        if type(x) not in (int,float) or not 0 <= x < road.length:
+            raise ValueError("x must be between 0 and the length of the road ({} m)".format(road.length))
+        self.road = road
+        self.lane = road.lane(destination_cross)
+        self.x = x
+        self.name = name if name != None else "road{}_lane{}_{:g}m".format(road.id, int(self.lane is road.vehicle_list_12), x)
+        self.passed = None # Last vehicle which went past the detector
+        self.passed_rank = -1 # Its order of entry on the lane (Vehicle.lane_rank)
+        self.last_t = None # [s] Time of the last passage
+        self.nb_passages = 0
+        self.file = None
+
+    def upcoming(self):
+        """Return the next vehicle to pass the detector, None if there is none on the lane
+        It is the first vehicle entered on the lane after the last vehicle passed : behind it if it is
+        still there with the same rank, otherwise the vehicles ahead of it left the lane before it
+        (the ones passed but still on the lane, if it was taken out of the middle, being skipped)"""
+        passed = self.passed
+        if passed != None and passed.lane is self.lane and passed.lane_rank == self.passed_rank:
+            veh = passed.lane_next
+        else:
+            veh = self.lane.first
+        while veh != None and (veh.veh_type == "stop" or veh.lane_rank <= self.passed_rank):
+            veh = veh.lane_next
+        return veh
+
+    def check(self, t, dt):
+        """Log the vehicles which went past the detector during the step ending at t [s]
+        The time of a passage is interpolated at the speed of the vehicle"""
+        veh = self.upcoming()
+        while veh != None:
+            veh.fetch()
+            if veh.x < self.x:
+                break
+            passage_t = t - min(dt, (veh.x - self.x) / veh.v) if veh.v > 0 else t
+            headway = passage_t - self.last_t if self.last_t != None else float("nan")
+            self.file.write(RECORD.pack(passage_t, veh.id, TYPES[veh.veh_type], veh.v, headway))
+            self.passed = veh
+            self.passed_rank = veh.lane_rank
+            self.last_t = passage_t
+            self.nb_passages += 1
+            veh = veh.lane_next
+            while veh != None and veh.veh_type == "stop":
+                veh = veh.lane_next
+
+
+class DetectorLog:
+    """Detectors watched by an engine (see Engine.detectors), each one streaming its passages to its file"""
+
+    def __init__(self, directory, detectors):
+        """directory : created if needed, existing logs are overwritten
+        detectors : list of Detector, with distinct names"""
+        names = [detector.name for detector in detectors]
+        if len(set(names)) != len(names):
+            raise ValueError("The detectors must have distinct names")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.detectors = detectors
+        for detector in detectors:
+            detector.file = open(os.path.join(directory, detector.name + ".bin"), "wb")
+
+    def check(self, engine):
+        """Log the passages of the step just computed by engine (called before the vehicles change road)"""
+        t = round((engine.tick + 1) * engine.dt, 9)
+        for detector in self.detectors:
+            detector.check(t, engine.dt)
+
+    def next_passage(self, engine):
+        """Earliest tick at which a vehicle can reach a detector, if every vehicle drives at most
+        at its desired speed (see Engine.fast_forward())"""
+        dt = engine.dt
+        tick = None
+        for detector in self.detectors:
+            veh = detector.upcoming()
+            if veh != None:
+                veh.fetch()
+                passage = engine.tick + max(0, int((detector.x - veh.x) / (veh.v0*dt + 0.5*veh.a*dt*dt)) - 1)
+                tick = passage if tick == None else min(tick, passage)
+        return tick
+
+    def close(self):
+        """Close the files and write the description of the detectors"""
+        for detector in self.detectors:
+            detector.file.close()
+        meta = {"version": VERSION,
+                "record": RECORD.format,
+                "fields": FIELDS,
+                "types": TYPES,
+                "detectors": [{"name": detector.name, "road": detector.road.id,
+                               "lane": int(detector.lane is detector.road.vehicle_list_12),
+                               "x": detector.x, "passages": detector.nb_passages} for detector in self.detectors]}
+        with open(os.path.join(self.directory, "detectors.json"), "w") as file:
+            json.dump(meta, file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def read_detector(directory, name):
+    """Return the passages logged by the detector name in directory, as a list of (t, id, type, v, headway)"""
+    with open(os.path.join(directory, name + ".bin"), "rb") as file:
+        return list(RECORD.iter_unpack(file.read()))
@@ -0,0 +1,444 @@
+# coding = utf-8
+"""Simulation engine : advance the simulated objects, independently from the graphic interface"""
+
+from simulation import *
+from scheduler import Scheduler, GENERATION, TRAFFIC_LIGHTS
+from time import perf_counter
+from math import ceil
+
+
+class Engine:
+    """Discretized time loop over the generators, crosses, vehicles and roads
+    Time is an integer number of ticks of dt seconds : vehicle generations and
+    traffic lights phase changes are scheduled events, only handled when due.
+    Crosses are asleep unless a vehicle is in their decision zone or their
+    traffic lights just changed : only the awake ones run get_intentions()
+    Multi-rate integration : the acceleration of the free vehicles (see Vehicle.is_free()) is
+    only computed every coarse_steps steps, and kept in between
+    Fast-forward : a vehicle in free flow (no leader, see wake_tick()) is only integrated until it
+    approaches its cross. When every vehicle on the map is so and no cross is awake, the time jumps
+    to the next wake-up or scheduled event
+    In vectorized mode, the Vehicle objects only get their position and speed when they are read :
+    by the steps (see fetch_approaches()), and by the consumers of the whole map (see fetch_vehicles())"""
+
+    MODES = ("scalar", "vectorized")
+    # Phases of a step : vehicle generations, traffic lights changes, intersection management,
+    # vehicle update (IIDM) and road changes
+    PHASES = ("generation", "traffic_lights", "intentions", "vehicles", "transfers")
+
+    def __init__(self, dt=0.01, mode="scalar", lanes=None, coarse_steps=1):
+        """dt [s] : simulation time step
+        mode : "scalar" to update the vehicles one by one with Vehicle.acceleration_IIDM(),
+        "vectorized" to update all of them at once with NumPy (see vectorized.py)
+        lanes : (road, destination cross) couples handled by this engine, every lane of the map
+        by default. The crosses at the end of these lanes and the generators feeding them are
+        handled too : the rest of the map is left to other engines (see partition.py)
+        coarse_steps : number of steps during which the acceleration of a free vehicle is kept
+        (1 : computed on every step for every vehicle)"""
+        if type(dt) not in (int,float) or dt <= 0:
+            raise ValueError("dt must be a positive int/float")
+        if mode not in Engine.MODES:
+            raise ValueError("mode must be one of {}".format(Engine.MODES))
+        if type(coarse_steps) is not int or coarse_steps < 1:
+            raise ValueError("coarse_steps must be a positive int")
+
+        self.tick = 0
+        self.dt = dt
+        self.steps = 0 # Number of steps computed since the beginning
+        self.delay = 0 # [s] Computation time of the last call to next_steps
+        self.average_speed = 0 # [km/h] Average speed on the map after the last step
+        self.generated = 0 # Number of vehicles that entered the map
+        self.exited = 0 # Number of vehicles that left the map
+        self.vehicle_steps = 0 # Number of vehicle updates since the beginning
+        self.integrations = 0 # Number of accelerations computed since the beginning
+        self.coarse_steps = coarse_steps
+        self.free_vehicles = dict() # {free vehicle: its leader} since the last multiple of coarse_steps
+        self.dormant = dict() # {vehicle moving at constant speed: tick until which it does}
+        self.skipped_steps = 0 # Number of steps jumped over by fast_forward()
+        self.next_fast_forward = 0 # Tick of the next attempt of fast_forward()
+        self.phase_times = dict.fromkeys(Engine.PHASES, 0.0) # [s] Computation time of each phase since the beginning
+        self.profiler = None # Profiler receiving the phase times of each call to next_steps (see profiler.py)
+        self.recorder = None # TrajectoryRecorder sampling the vehicles (see recorder.py)
+        self.indicators = None # RoadIndicators aggregating the traffic of each lane (see indicators.py)
+        self.journeys = None # JourneyTimes of the vehicles leaving the map (see journeys.py)
+        self.detectors = None # DetectorLog of the loop detectors placed on the lanes (see detectors.py)
+
+        if lanes == None:
+            lanes = [(road, cross) for road in roads for cross in (road.cross1, road.cross2)]
+        self.lanes = lanes
+        local_crosses = set(cross for road, cross in lanes)
+        local_lanes = set(lanes)
+        self.local_crosses = local_crosses
+
+        # Ordered set of the crosses to evaluate on the next step
+        self.awake_crosses = dict.fromkeys(cross for cross in crosses if cross in local_crosses)
+        self.scheduler = Scheduler()
+        for gen in generators:
+            road = gen.roads[0]
+            if (road, road.cross2 if road.cross1 is gen else road.cross1) in local_lanes:
+                self.schedule_generation(gen)
+        for cross in self.awake_crosses:
+            if cross.has_traffic_lights():
+                for i in range(len(cross.traffic_lights[0])):
+                    self.schedule_phase(cross, i, 0)
+
+        self.mode = mode
+        if Vehicle.arrays is not None: # vehicles left by a previous engine
+            Vehicle.arrays.fetch_all()
+        Vehicle.arrays = None
+        if mode == "vectorized":
+            from vectorized import VehicleArrays
+            Vehicle.arrays = VehicleArrays()
+            for road in roads:
+                Vehicle.arrays.write(road.stop1)
+                Vehicle.arrays.write(road.stop2)
+            for veh in vehicles:
+                Vehicle.arrays.write(veh)
+
+    @property
+    def t(self):
+        """Current time [s]"""
+        return round(self.tick * self.dt, 9)
+
+    def ticks(self, time):
+        """Number of ticks to reach time [s], rounded up"""
+        return ceil(round(time / self.dt, 6))
+
+    def schedule_generation(self, gen):
+        """Schedule the next vehicle generation of gen"""
+        tick = max(self.tick, self.ticks(gen.next_generation_time()))
+        self.scheduler.schedule(tick, GENERATION, self.generate, gen)
+
+    def generate(self, gen):
+        """Generate a vehicle, or try again on the next tick if the road is congested"""
+        T = perf_counter()
+        if self.mode == "vectorized": # position of the vehicle ahead
+            veh = gen.roads[0].last_vehicle(gen)
+            if veh != None:
+                veh.fetch()
+        veh = gen.spawn(self.t)
+        if veh != None:
+            if veh.in_decision_zone(): # short road
+                self.awake_crosses[veh.destination_cross] = None
+            self.generated += 1
+            self.schedule_generation(gen)
+        else:
+            self.scheduler.schedule(self.tick + 1, GENERATION, self.generate, gen)
+        self.phase_times["generation"] += perf_counter() - T
+
+    def schedule_phase(self, cross, i, cycle):
+        """Schedule the phase i of the traffic lights of cross, during the cycle-th cycle"""
+        time = cycle * cross.traffic_lights_cycle() + cross.traffic_lights[0][i]
+        self.scheduler.schedule(self.ticks(time), TRAFFIC_LIGHTS, self.change_phase, cross, i, cycle)
+
+    def change_phase(self, cross, i, cycle):
+        """Switch the traffic lights of cross to the phase i and schedule it for the next cycle"""
+        T = perf_counter()
+        if self.mode == "vectorized": # speeds of the vehicles arriving on the cross
+            for road in cross.roads:
+                for veh in road.lane(cross):
+                    veh.fetch()
+        cross.set_phase(i)
+        self.awake_crosses[cross] = None
+        self.schedule_phase(cross, i, cycle + 1)
+        self.phase_times["traffic_lights"] += perf_counter() - T
+
+    def next_steps(self, steps):
+        """Update all the simulation :
+        - vehicle acceleration, velocity and position
+        - vehicle crossing order for each cross according to the priority
+        - traffic light state """
+        T = perf_counter()
+        dt = self.dt
+        phase_times = self.phase_times
+        if self.profiler != None:
+            previous_times = dict(phase_times)
+
+        end = self.steps + steps
+        while self.steps < end:
+            # Jump over the steps where nothing but constant speed motions happens
+            if len(self.awake_crosses) == 0 and self.tick >= self.next_fast_forward:
+                if self.fast_forward(end - self.steps):
+                    continue
+                self.next_fast_forward = self.tick + FAST_FORWARD_RETRY
+
+            # Generate vehicles and update the traffic lights (timed by generate() and change_phase())
+            indicators = self.indicators
+            if indicators != None:
+                indicators.tick = self.tick
+            self.scheduler.run(self.tick)
+
+            t1 = perf_counter()
+            awake_crosses = self.awake_crosses
+            self.awake_crosses = dict()
+            if self.mode == "vectorized":
+                self.fetch_approaches(awake_crosses)
+            for cross in awake_crosses:
+                cross.get_intentions()
+
+            # Update acceleration, speed and position of each vehicle
+            t2 = perf_counter()
+            if self.mode == "vectorized":
+                average_speed = self.update_vehicles_vectorized(dt)
+            else:
+                average_speed = self.update_vehicles(dt)
+
+            if len(vehicles) > 0:
+                average_speed = (average_speed / len(vehicles)) * 3.6
+            self.average_speed = average_speed
+            self.vehicle_steps += len(vehicles)
+
+            # Check if the vehicles must change road
+            t3 = perf_counter()
+            if self.detectors != None:
+                self.detectors.check(self)
+            if indicators != None: # the vehicles changing road have moved during the step
+                indicators.tick = self.tick + 1
+            if self.journeys != None:
+                self.journeys.tick = self.tick + 1
+            nb_deleted = len(deleted_vehicles)
+            local_crosses = self.local_crosses
+            for road, cross in self.lanes:
+                veh = road.first_vehicle(cross)
+                road.outgoing_veh(veh)
+                # The vehicles woke up their cross before changing road : wake up the next one
+                if veh != None and veh.road is not road and veh.destination_cross in local_crosses and veh.in_decision_zone():
+                    self.awake_crosses[veh.destination_cross] = None
+            self.exited += len(deleted_vehicles) - nb_deleted
+            t4 = perf_counter()
+
+            phase_times["intentions"] += t2 - t1
+            phase_times["vehicles"] += t3 - t2
+            phase_times["transfers"] += t4 - t3
+
+            self.tick += 1
+            self.steps += 1
+            if self.recorder != None and self.tick >= self.recorder.next_tick:
+                self.recorder.sample(self)
+            if indicators != None and self.tick >= indicators.next_tick:
+                indicators.sample(self)
+
+        self.delay = perf_counter() - T
+        if self.profiler != None:
+            for phase in Engine.PHASES:
+                self.profiler.add(phase, phase_times[phase] - previous_times[phase])
+            self.profiler.add("simulation", self.delay)
+
+    def fetch_vehicles(self):
+        """Bring the position, speed and acceleration of every Vehicle object up to date (vectorized mode),
+        before reading them out of the steps : recorder, snapshot, checkpoint..."""
+        if Vehicle.arrays is not None:
+            Vehicle.arrays.fetch_all()
+
+    def fetch_approaches(self, crosses):
+        """Bring up to date the vehicles whose position and speed are read by Cross.get_intentions() on crosses :
+        the first vehicle of each lane arriving on them, and its followers (the vehicle behind a stop is one of them)"""
+        for cross in crosses:
+            for road in cross.roads:
+                veh = road.first_vehicle(cross)
+                if veh != None:
+                    veh.fetch()
+                    for follower in veh.followers:
+                        follower.fetch()
+                    if veh.lane_next != None:
+                        veh.lane_next.fetch()
+
+    def wake_tick(self, veh):
+        """Tick until which veh drives in free flow : without leader nor slow down, at most at its
+        desired speed (the IIDM only depends on its speed, and gives exactly 0 at the desired speed),
+        before it enters the turning or decision zone of its cross. The current tick if it cannot"""
+        v, v0 = veh.v, veh.v0
+        if veh.leader != None or veh.slow_down != 0 or v <= 0 or v > v0:
+            return self.tick
+        dt = self.dt
+        zone = (v0*v0)/(2*veh.b_max) + max(30, v0*PRIORITY_GAP[veh.veh_type])
+        # One step of margin for the rounding of the positions
+        return self.tick + max(0, int((veh.road.length - veh.x - zone) / (v0*dt + 0.5*veh.a*dt*dt)) - 1)
+
+    def fast_forward(self, max_steps):
+        """If every vehicle on the map drives in free flow (see wake_tick()), jump to the next
+        wake-up, scheduled event, recorded frame, end of a window of the indicators or passage on a detector,
+        at most max_steps steps later
+        The vehicles are integrated with exactly the same operations as during the skipped steps,
+        without anything else to do : no cross to wake up, no road to change
+        Return the number of steps skipped"""
+        if self.mode == "scalar" and len(self.dormant) < len(vehicles):
+            return 0
+        target = self.tick + max_steps
+        next_event = self.scheduler.next_tick()
+        if next_event != None:
+            target = min(target, next_event)
+        if self.recorder != None:
+            target = min(target, max(self.tick + 1, self.recorder.next_tick))
+        if self.indicators != None: # the queue samples can be skipped, not the end of a window
+            target = min(target, max(self.tick + 1, self.indicators.window_end))
+        if self.detectors != None: # the detectors are not checked during the skipped steps
+            passage = self.detectors.next_passage(self)
+            if passage != None:
+                target = min(target, passage)
+        self.fetch_vehicles()
+        for veh in vehicles:
+            target = min(target, self.wake_tick(veh))
+            if target <= self.tick + 1:
+                return 0
+
+        n = target - self.tick
+        dt = self.dt
+        if self.mode == "vectorized":
+            K = self.coarse_steps
+            horizons = [K*dt if K > 1 and tick % K == 0 else None for tick in range(self.tick, target)]
+            self.integrations += Vehicle.arrays.advance(dt, horizons)
+        else:
+            for veh in vehicles:
+                x, v = veh.x, veh.v
+                remaining = n
+                if v == veh.v0: # the IIDM gives exactly 0
+                    veh.last_a = 0
+                    step = v*dt
+                while remaining > 0 and v != veh.v0:
+                    self.integrations += 1
+                    remaining -= 1
+                    a = veh.acceleration_IIDM()
+                    step = v*dt + max(0, 0.5*a*dt*dt)
+                    x += step
+                    if max(0, v + a*dt) == v: # steady speed, to the rounding : same step from now on
+                        break
+                    v = max(0, v + a*dt)
+                    veh.v = v
+                for i in range(remaining):
+                    x += step
+                veh.x = x
+
+        speed_sum = 0
+        for veh in vehicles:
+            speed_sum += veh.v
+        self.average_speed = (speed_sum / len(vehicles)) * 3.6 if len(vehicles) > 0 else 0
+        self.vehicle_steps += n * len(vehicles)
+        self.tick += n
+        self.steps += n
+        self.skipped_steps += n
+        if self.recorder != None and self.tick >= self.recorder.next_tick:
+            self.recorder.sample(self)
+        if self.indicators != None and self.tick >= self.indicators.next_tick:
+            self.indicators.sample(self)
+        return n
+
+    def update_vehicles(self, dt):
+        """Update acceleration, speed and position of each vehicle, one by one
+        Return the sum of the speeds"""
+        average_speed = 0
+        awake_crosses = self.awake_crosses
+        free_vehicles = self.free_vehicles
+        dormant = self.dormant
+        tick = self.tick
+        if self.coarse_steps > 1 and self.tick % self.coarse_steps == 0:
+            horizon = self.coarse_steps * dt
+            free_vehicles.clear()
+            for veh in vehicles:
+                if veh not in dormant and veh.is_free(horizon):
+                    veh.acceleration_IIDM()
+                    free_vehicles[veh] = veh.leader
+            self.integrations += len(free_vehicles)
+
+        for veh in vehicles:
+            # Vehicle in free flow (see wake_tick()) : only integrated, nothing else can happen to it
+            if veh in dormant:
+                if tick < dormant[veh] and veh.leader is None and veh.slow_down == 0 and veh.v <= veh.v0:
+                    if veh.v == veh.v0: # the IIDM gives exactly 0
+                        veh.x += veh.v*dt
+                    else:
+                        self.integrations += 1
+                        a = veh.acceleration_IIDM()
+                        veh.x += veh.v*dt + max(0, 0.5*a*dt*dt)
+                        veh.v = max(0, veh.v + a*dt)
+                    average_speed += veh.v
+                    continue
+                del dormant[veh]
+
+            # Free vehicle keeping its acceleration, unless its leader or desired speed changed since
+            if veh in free_vehicles and free_vehicles[veh] is veh.leader and veh.slow_down == 0:
+                a = veh.last_a
+                veh.x += veh.v*dt + max(0, 0.5*a*dt*dt)
+                veh.v = max(0, veh.v + a*dt)
+                average_speed += veh.v
+                continue
+
+            self.integrations += 1
+            try:
+                a = veh.acceleration_IIDM()
+                veh.x += veh.v*dt + max(0, 0.5*a*dt*dt)
+                veh.v = max(0, veh.v + a*dt)
+                average_speed += veh.v
+
+                if veh.slow_down > 1:
+                    veh.slow_down -= 1
+                elif veh.slow_down == 1:
+                    veh.slow_down = 0
+                    veh.v0 = veh.road.speed_limit
+
+                # Same as veh.in_decision_zone(), without the calls
+                if (veh.road.length - veh.x) <= (veh.v*veh.v)/(2*veh.b_max) + veh.v0*PRIORITY_GAP[veh.veh_type]:
+                    awake_crosses[veh.destination_cross] = None
+
+                if (veh.road.length - veh.x) <= ((veh.v*veh.v)/(2*veh.b_max) + 30) and veh.slow_down == 0 :
+                    veh.turn_speed()
+
+                if veh.leader != None and veh.leader.veh_type != "stop" and veh.leader.road == veh.road and veh.destination_cross != veh.leader.destination_cross:
+                    veh.decision = False
+                    veh.find_leader()
+                elif veh.leader is None:
+                    wake = self.wake_tick(veh)
+                    if wake > tick + 1:
+                        dormant[veh] = wake
+
+            except:
+                next_road_id = None if veh.next_road == None else veh.next_road.id
+                leader_index = None if veh.leader == None or veh.leader.veh_type == "stop" else vehicles.index(veh.leader)
+
+                print("ERROR DURING THE SIMULATION, while working on {}, going from road {} to {}, following {} on {}, spacing: {}"
+                .format(vehicles.index(veh), veh.road.id, next_road_id, leader_index, veh.leader.road.id, veh.spacing_with_leader()))
+                raise
+        return average_speed
+
+    def update_vehicles_vectorized(self, dt):
+        """Same as update_vehicles(), with the IIDM computed for all the vehicles at once
+        Only the vehicles with something to do (slowed down, close to the cross,
+        leader going elsewhere) are then handled one by one
+        Return the sum of the speeds"""
+        arrays = Vehicle.arrays
+        if self.coarse_steps > 1 and self.tick % self.coarse_steps == 0:
+            idx, computed = arrays.integrate(dt, self.coarse_steps * dt)
+        else:
+            idx, computed = arrays.integrate(dt)
+        self.integrations += computed
+
+        # Vehicles slowed down by the user
+        for s in idx[arrays.slow_down[idx] > 0].tolist():
+            veh = arrays.objects[s]
+            if veh.slow_down > 1:
+                veh.slow_down -= 1
+            elif veh.slow_down == 1:
+                veh.slow_down = 0
+                veh.v0 = veh.road.speed_limit
+            veh.sync()
+
+        # Crosses with a vehicle in their decision zone
+        for s in arrays.in_decision_zone(idx):
+            self.awake_crosses[arrays.objects[s].destination_cross] = None
+
+        # Vehicles close enough from the cross to slow down before turning
+        for s in arrays.turning(idx):
+            veh = arrays.objects[s]
+            veh.turn_speed()
+            arrays.v0[s] = veh.v0
+
+        # Vehicles whose leader is on the same road but going to another cross
+        for s in arrays.leader_going_elsewhere(idx):
+            veh = arrays.objects[s]
+            veh.decision = False
+            veh.find_leader()
+
+        # Position of the vehicles which may change road (the other ones are only read when needed)
+        arrays.sync_objects(arrays.leaving(idx))
+
+        return float(arrays.v[idx].sum())
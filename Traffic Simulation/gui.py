@@ -1,11 +1,16 @@
 import tkinter as tk
 from functions import get_color_from_gradient, random_color
-from math import cos, sin, atan, sqrt
+from profiler import format_summary
+from math import cos, sin, atan, sqrt, floor
+from bisect import bisect_left, bisect_right
 from constants import *
 
 W, H = 4000, 2500
 marge = 5000
 dx, dy = 20, 20 # Elementary move for the canvas
+view_margin = 50 # [px] Vehicles out of the visible part of the map, but closer than this, are still drawn
+lod_scale = 1 # Below this zoom, the vehicles are not drawn : the roads are colored by the speed of their vehicles
+grid_cell = 50 # [m] Size of the cells of the spatial index of the roads and crosses
 
 
 class Map(tk.Canvas):
@@ -20,6 +25,20 @@ class Map(tk.Canvas):
         # Keep track of the current scale to make correct operations when zoomed in or out
         self.current_scale = 1
 
+        # Last state drawn for each vehicle : {Vehicle.rep: (points, color, brake color, blinker points, blinker shown)},
+        # None when its items are hidden because it is out of the viewport
+        self.drawn = dict()
+        self.drawn_viewport = None # Viewport of the last draw_vehicle()
+        self.vehicles_hidden = False # True when every vehicle is hidden by draw_road_heat()
+        self.heat = dict() # {Road.rep: color} of the roads colored by draw_road_heat()
+
+        # Hit-testing without scanning the canvas nor the simulated objects
+        self.objects = dict() # {canvas item: cross, road or vehicle drawn by it}
+        self.grid = dict() # {(i, j): crosses and roads meeting the cell [i*grid_cell, (i+1)*grid_cell[ x [j*grid_cell, (j+1)*grid_cell[}
+        # {(road, True if going to road.cross2): (positions, vehicles, half length of the longest one)} of the vehicles
+        # drawn on the lane by the last draw_vehicle(), sorted by position
+        self.lanes = dict()
+
     def scroll_start(self, event):
         # Save the current position of the map
         self.scan_mark(event.x, event.y)
@@ -55,6 +74,8 @@ class Map(tk.Canvas):
         for cross in cross_list:
             (x,y) = cross.coords
             cross.rep = self.create_oval(x-3, y-3, x+3, y+3, fill=ROAD_COLOR, outline=ROAD_COLOR, tag="cross")
+            self.objects[cross.rep] = cross
+            self.index(cross, x-3, y-3, x+3, y+3)
 
     def draw_road(self, road_list):
         """Place the roads"""
@@ -67,6 +88,46 @@ class Map(tk.Canvas):
             dxb = -l*cos(ang)
             dyb = -l*sin(ang)
             road.rep = self.create_polygon(x+dx, y+dy, x-dx, y-dy, x+dxb-dx, y+dyb-dy, x+dxb+dx, y+dyb+dy, fill=ROAD_COLOR, outline=ROAD_OUTLINE_COLOR, width = 2, tag="road")
+            self.objects[road.rep] = road
+            xs, ys = (x+dx, x-dx, x+dxb-dx, x+dxb+dx), (y+dy, y-dy, y+dyb-dy, y+dyb+dy)
+            self.index(road, min(xs), min(ys), max(xs), max(ys))
+
+    def index(self, obj, x_min, y_min, x_max, y_max):
+        """Add obj to the cells of the spatial index meeting its bounding box [m]"""
+        for i in range(floor(x_min / grid_cell), floor(x_max / grid_cell) + 1):
+            for j in range(floor(y_min / grid_cell), floor(y_max / grid_cell) + 1):
+                self.grid.setdefault((i, j), []).append(obj)
+
+    def find_at(self, x, y):
+        """Return the crosses, roads and vehicles drawn at the point (x, y) of the canvas
+        Only the roads and crosses of its cell of the spatial index, and the vehicles of the lane
+        under the point close enough to it (found by bisection) are tested"""
+        e = self.current_scale
+        x, y = x/e, y/e
+        found = []
+        for obj in self.grid.get((floor(x / grid_cell), floor(y / grid_cell)), ()):
+            if not hasattr(obj, "cross1"): # cross
+                x0, y0 = obj.coords
+                if (x-x0)**2 + (y-y0)**2 <= 9:
+                    found.append(obj)
+                continue
+            # Coordinates along the road from cross1 and across it
+            x1, y1 = obj.cross1.coords
+            along = (x-x1)*obj.cos_angle + (y-y1)*obj.sin_angle
+            across = (y-y1)*obj.cos_angle - (x-x1)*obj.sin_angle
+            if not (0 <= along <= obj.length and abs(across) <= obj.width/2):
+                continue
+            found.append(obj)
+            # The vehicles going to cross2 are on the positive side (see draw_vehicle())
+            lane = across > 0
+            position = along if lane else obj.length - along
+            side = abs(across) - obj.width/4
+            positions, lane_vehicles, reach = self.lanes.get((obj, lane), ((), (), 0))
+            for i in range(bisect_left(positions, position - reach), bisect_right(positions, position + reach)):
+                veh = lane_vehicles[i]
+                if abs(position - veh.x) <= veh.length/2 and abs(side) <= veh.width/2:
+                    found.append(veh)
+        return found
 
     def draw_stop(self, road_list):
         """Create the representation of a traffic light"""
@@ -104,12 +165,35 @@ class Map(tk.Canvas):
 
 
 
-    def draw_vehicle(self, vehicle_list):
-        """Draw the vehicles at the correct position"""
+    def viewport(self):
+        """Return the part of the map shown by the canvas (left, top, right, bottom), widened by view_margin"""
+        width, height = self.winfo_width(), self.winfo_height()
+        if width <= 1: # not displayed yet
+            width, height = int(self.cget("width")), int(self.cget("height"))
+        return (self.canvasx(0) - view_margin, self.canvasy(0) - view_margin,
+                self.canvasx(width) + view_margin, self.canvasy(height) + view_margin)
+
+    def draw_vehicle(self, vehicle_list, blink=True):
+        """Draw the vehicles at the correct position
+        Only the vehicles in the viewport are drawn, the others are hidden. The items of a vehicle are
+        only updated if its position (to the pixel), its colors or its blinker changed since the last call
+        blink : advance the blinkers (False to only redraw after a move of the map)
+        Below the zoom lod_scale, the roads are colored instead (see draw_road_heat())"""
+        left, top, right, bottom = self.drawn_viewport = self.viewport()
+        if self.current_scale < lod_scale:
+            self.draw_road_heat(vehicle_list)
+            return
+        if len(self.heat) > 0:
+            for rep in self.heat:
+                self.itemconfig(rep, fill=ROAD_COLOR)
+            self.heat = dict()
+        self.vehicles_hidden = False
+        e = self.current_scale
+        drawn = self.drawn
+        self.lanes = lanes = dict()
         for veh in vehicle_list:
             orient = 1 if veh.origin_cross == veh.road.cross1 else -1
             cos_angle, sin_angle = orient*veh.road.cos_angle, orient*veh.road.sin_angle
-            e = self.current_scale
             road_width = veh.road.width
             (x0,y0) = veh.origin_cross.coords
             (l, w) = (veh.length, veh.width)
@@ -119,6 +203,24 @@ class Map(tk.Canvas):
             x = x*e
             y = y*e
 
+            # Blinking : shown during 7 calls, hidden during 8
+            blinker_shown = veh.blinker_state < 7
+            if blink and veh.rep != None:
+                veh.blinker_state = veh.blinker_state + 1 if veh.blinker_state < 14 else 0
+
+            if not (left <= x <= right and top <= y <= bottom):
+                # Out of the viewport : hide it once
+                if drawn.get(veh.rep) != None:
+                    for item in (veh.rep, veh.brake_rep, veh.blinker_rep):
+                        self.itemconfig(item, state="hidden")
+                    drawn[veh.rep] = None
+                continue
+            lane = lanes.get((veh.road, orient == 1))
+            if lane == None:
+                lanes[(veh.road, orient == 1)] = [veh]
+            else:
+                lane.append(veh)
+
             dx = sin_angle*w/2 *e
             dy = - cos_angle*w/2 *e
             dxb = - l*cos_angle *e
@@ -128,6 +230,7 @@ class Map(tk.Canvas):
             dyb_brake = - (l-0.4)*sin_angle *e
 
             points_car = (x+dx, y+dy, x-dx, y-dy, x+dxb-dx, y+dyb-dy, x+dxb+dx, y+dyb+dy)
+            points_car = tuple(round(p) for p in points_car) # the canvas draws to the pixel
             points_brake = (x+dxb-dx, y+dyb-dy, x+dxb+dx, y+dyb+dy, x+dxb_brake+dx, y+dyb_brake+dy, x+dxb_brake-dx, y+dyb_brake-dy)
 
             # Update the blinker position
@@ -138,40 +241,88 @@ class Map(tk.Canvas):
                     points_blinker = (x+dx-rad, y+dy-rad, x+dx+rad, y+dy+rad)
                 elif veh.direction == "right":
                     points_blinker = (x-dx-rad, y-dy-rad, x-dx+rad, y-dy+rad)
-                else:
-                    points_blinker = (-100,-100,-100,-100)
+                points_blinker = tuple(round(p) for p in points_blinker)
 
             # Get a color according to the speed
             color = get_color_from_gradient(veh.v/veh.road.speed_limit)
+            brake_color = "red" if veh.last_a <= -.5 else color
 
             if veh.rep == None and veh.brake_rep == None and veh.blinker_rep == None:
                 veh.rep = self.create_polygon(points_car, fill=color, tag="vehicle")
                 veh.brake_rep = self.create_polygon(points_brake, fill=color, tag="brake")
-                veh.blinker_rep = self.create_oval(points_blinker, fill="orange", outline="orange")
-            else:
+                veh.blinker_rep = self.create_oval(points_blinker, fill="orange", outline="orange", tag="blinker")
+                self.objects[veh.rep] = self.objects[veh.brake_rep] = self.objects[veh.blinker_rep] = veh
+                drawn[veh.rep] = (points_car, color, color, points_blinker, True)
+                continue
+
+            last = drawn.get(veh.rep)
+            if last == None:
+                # Back in the viewport : everything is drawn again
+                self.itemconfig(veh.rep, state="normal")
+                self.itemconfig(veh.brake_rep, state="normal")
+                last = (None, None, None, None, None)
+            if points_car != last[0]:
                 self.coords(veh.rep, points_car)
                 self.coords(veh.brake_rep, points_brake)
-                self.coords(veh.blinker_rep, points_blinker)
+            if color != last[1]:
                 self.itemconfig(veh.rep, fill=color)
-                if veh.last_a <= -.5:
-                    self.itemconfig(veh.brake_rep, fill="red")
-                else:
-                    self.itemconfig(veh.brake_rep, fill=color)
-
-                if veh.blinker_state == 0:
-                    self.itemconfig(veh.blinker_rep, state="normal")
-                elif veh.blinker_state == 7:
-                    self.itemconfig(veh.blinker_rep, state="hidden")
-                elif veh.blinker_state >= 14 :
-                    veh.blinker_state = -1
-                veh.blinker_state += 1
+            if brake_color != last[2]:
+                self.itemconfig(veh.brake_rep, fill=brake_color)
+            if points_blinker != last[3]:
+                self.coords(veh.blinker_rep, points_blinker)
+            if blinker_shown != last[4]:
+                self.itemconfig(veh.blinker_rep, state="normal" if blinker_shown else "hidden")
+            drawn[veh.rep] = (points_car, color, brake_color, points_blinker, blinker_shown)
+
+        for key, lane in lanes.items():
+            lane.sort(key=lambda veh: veh.x)
+            lanes[key] = ([veh.x for veh in lane], lane, max(veh.length for veh in lane)/2)
+
+    def draw_road_heat(self, vehicle_list):
+        """Color each road according to the average speed of its vehicles, the empty ones in ROAD_COLOR,
+        all the vehicles being hidden : the level of detail of the zoomed out map"""
+        self.lanes = dict()
+        if not self.vehicles_hidden:
+            for tag in ("vehicle", "brake", "blinker"):
+                self.itemconfig(tag, state="hidden")
+            for rep in self.drawn:
+                self.drawn[rep] = None
+            self.vehicles_hidden = True
+
+        speeds = dict() # {road: [sum of the speeds, number of vehicles]}
+        for veh in vehicle_list:
+            speed = speeds.get(veh.road)
+            if speed == None:
+                speeds[veh.road] = [veh.v, 1]
+            else:
+                speed[0] += veh.v
+                speed[1] += 1
+        heat = {road.rep: get_color_from_gradient(min(1, speed_sum / n / road.speed_limit)) for road, (speed_sum, n) in speeds.items()}
+
+        for rep, color in heat.items():
+            if self.heat.get(rep) != color:
+                self.itemconfig(rep, fill=color)
+        for rep in self.heat:
+            if rep not in heat:
+                self.itemconfig(rep, fill=ROAD_COLOR)
+        self.heat = heat
+
+    def delete_vehicle(self, veh):
+        """Delete the items of a vehicle that left the map"""
+        self.drawn.pop(veh.rep, None)
+        for item in (veh.rep, veh.brake_rep, veh.blinker_rep):
+            self.objects.pop(item, None)
+        self.delete(veh.rep)
+        self.delete(veh.brake_rep)
+        self.delete(veh.blinker_rep)
 
     def draw_leadership(self, vehicle_list):
         """Draw an arrow between a vehicle and its leader"""
         map.delete("leadership") # clean everything
         for veh in vehicle_list:
             if veh.leader != None:
-                if veh.leader.rep != None:
+                # only between vehicles of the viewport (see draw_vehicle())
+                if self.drawn.get(veh.leader.rep) != None and self.drawn.get(veh.rep) != None:
                     # get the coordinates of the vehicle and its leader
                     leader_coords = self.coords(veh.leader.rep)
                     follower_coords = self.coords(veh.rep)
@@ -273,6 +424,32 @@ class Controls(tk.Frame):
         self.leadership_true.pack(side=tk.LEFT)
         self.leadership_false.pack(side=tk.LEFT)
 
+        # Profiler section : computation time of the simulation and of the drawings
+        self.profiler = tk.LabelFrame(self, text="Profiler", padx=10, pady=10)
+        self.profiler.grid(row=4,column=0, sticky="new")
+        self.profile_str = tk.StringVar()
+        self.profile_str.set("")
+        tk.Label(master = self.profiler, textvariable = self.profile_str, font="TkFixedFont", justify=tk.LEFT).pack(anchor="w")
+
+    def add_replay(self, duration, resolution):
+        """Add the section of the replay of a recording (see replay.py) :
+        position in the recording and multiplier of the simulation speed
+        duration [s] : time of the last frame, resolution [s] : time between two frames"""
+        self.replay = tk.LabelFrame(self, text="Replay", padx=10, pady=10)
+        self.replay.grid(row=5,column=0, sticky="new")
+        self.replay_time = tk.DoubleVar()
+        self.replay_time.set(0)
+        tk.Scale(self.replay, label="Time [s]", variable=self.replay_time, from_=0, to=duration, resolution=resolution, orient=tk.HORIZONTAL, length=200).pack(fill="both", expand="yes")
+        tk.Label(master = self.replay, text = "Speed x").pack(side = tk.LEFT)
+        self.replay_factor = tk.IntVar()
+        self.replay_factor.set(1)
+        for factor in (1, 10, 100):
+            tk.Radiobutton(self.replay, text=str(factor), variable=self.replay_factor, value=factor).pack(side=tk.LEFT)
+
+    def show_profile(self, summary):
+        """Display a Profiler summary (see profiler.py)"""
+        self.profile_str.set(format_summary(summary))
+
     def change_speed(self, value):
         """Function to update the simulation speed with the keyboard"""
         speed = int(self.speed.get() + value)
@@ -0,0 +1,262 @@
+# coding = utf-8
+"""Run the simulation without graphic interface, as fast as possible
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --dt 0.01
+"""
+
+from simulation import *
+from network import load_network
+from engine import Engine
+from profiler import Profiler, format_summary
+from time import perf_counter
+import argparse
+import random
+import os
+
+STEPS_PER_CALL = 100 # Number of steps between two progress reports
+
+
+def run(map_filename="maps/map_data.txt", duration=3600, dt=0.01, period=6, seed=None, mode="scalar", quiet=False, profiler=None,
+        record=None, record_rate=10, resume=None, checkpoint=None, coarse_steps=1, kpi_window=None, kpi_output=None,
+        detectors=None, detector_log=None, journeys=None, od=None, routes=1, route_workers=None):
+    """Load the network and simulate it during duration [s]
+    seed : seed of the random generator, to reproduce a run
+    mode : "scalar" or "vectorized" engine (see Engine)
+    profiler : Profiler receiving the phase times of every STEPS_PER_CALL steps
+    record : directory where the trajectories are recorded, record_rate [Hz] times per second (see recorder.py)
+    resume : checkpoint from which the simulation continues, the seed (if any) being applied after the restore
+    checkpoint : file where the final state is saved (see checkpoint.py)
+    coarse_steps : number of steps during which the free vehicles keep their acceleration (see Engine)
+    kpi_window [s] : duration of the windows of the indicators of each lane (see indicators.py),
+    written in the CSV file kpi_output if given
+    detectors : (Road.id, lane, x) of the loop detectors logging their passages in the directory detector_log,
+    lane being 1 for the vehicles going to road.cross2 and 0 for the others (see detectors.py)
+    od : file of the origin-destination matrix, the vehicles following the routes of a RouteTable of routes
+    alternatives computed by route_workers processes, instead of the dispatch matrices (see routing.py)
+    journeys : JSON file where the travel times and delays of each origin-destination pair are written (see journeys.py)
+    Return the engine and the key performance indicators of the run"""
+    random.seed(seed)
+    load_network(map_filename, period=period)
+    if od != None:
+        from routing import RouteTable, read_od, set_demand
+        from network import CACHE_DIRECTORY
+        cache_directory = os.path.join(os.path.dirname(os.path.abspath(map_filename)), CACHE_DIRECTORY)
+        set_demand(read_od(od), RouteTable(routes, route_workers, cache_directory))
+    if resume != None:
+        from checkpoint import load_checkpoint
+        engine = load_checkpoint(resume, mode, dt, coarse_steps)
+        if seed != None:
+            random.seed(seed)
+    else:
+        engine = Engine(dt, mode, coarse_steps=coarse_steps)
+    engine.profiler = profiler
+    if record != None:
+        from recorder import TrajectoryRecorder
+        engine.recorder = TrajectoryRecorder(record, dt, record_rate, map_filename=map_filename)
+    if kpi_window != None:
+        from indicators import RoadIndicators
+        engine.indicators = RoadIndicators(engine, kpi_window)
+    if journeys != None:
+        from journeys import JourneyTimes
+        engine.journeys = JourneyTimes(engine)
+    if detectors:
+        from detectors import Detector, DetectorLog
+        if detector_log == None:
+            raise ValueError("The detectors need a detector_log directory")
+        engine.detectors = DetectorLog(detector_log, [Detector(roads[road_id], roads[road_id].cross2 if lane else roads[road_id].cross1, x)
+                                                      for road_id, lane, x in detectors])
+    total_steps = engine.steps + int(round(duration / dt))
+
+    T = perf_counter()
+    speed_sum, nb_calls = 0, 0
+    try:
+        while engine.steps < total_steps:
+            engine.next_steps(min(STEPS_PER_CALL, total_steps - engine.steps))
+            deleted_vehicles.clear() # nothing to delete on a canvas
+            speed_sum += engine.average_speed
+            nb_calls += 1
+            if not quiet:
+                print("t = {} s, {} vehicles".format(engine.t, len(vehicles)), end="\r")
+    finally:
+        if engine.recorder != None:
+            engine.recorder.close()
+        if engine.detectors != None:
+            engine.detectors.close()
+    wall_time = perf_counter() - T
+    engine.fetch_vehicles() # vehicles left up to date for the caller
+    if engine.journeys != None:
+        engine.journeys.detach()
+        engine.journeys.write(journeys)
+    if engine.indicators != None:
+        engine.indicators.close(engine.tick) # last window, shorter if the duration is not a multiple
+        engine.indicators.detach()
+        if kpi_output != None:
+            engine.indicators.write(kpi_output)
+    if checkpoint != None:
+        from checkpoint import save_checkpoint
+        save_checkpoint(engine, checkpoint, map_filename)
+    hours = max(engine.t, engine.dt) / 3600
+
+    kpis = {"simulated_time": engine.t,
+            "steps": engine.steps,
+            "wall_time": wall_time,
+            "steps_per_second": engine.steps / wall_time if wall_time > 0 else float("inf"),
+            "real_time_factor": engine.t / wall_time if wall_time > 0 else float("inf"),
+            "vehicles_on_map": len(vehicles),
+            "generated_vehicles": engine.generated,
+            "exited_vehicles": engine.exited,
+            "accelerations_per_step": engine.integrations / max(1, engine.steps),
+            "skipped_steps": engine.skipped_steps,
+            "final_average_speed": engine.average_speed,
+            "mean_average_speed": speed_sum / max(1, nb_calls),
+            # Flows [veh/h] in and out of the map at each generator
+            "generated_flows": [gen.nb_generated / hours for gen in generators],
+            "absorbed_flows": [gen.nb_absorbed / hours for gen in generators]}
+    if engine.detectors != None:
+        kpis["detector_passages"] = {detector.name: detector.nb_passages for detector in engine.detectors.detectors}
+    if engine.journeys != None:
+        # Travel time percentiles [s] of every origin-destination pair
+        kpis["journeys"] = {(generators.index(origin), generators.index(destination)): travel.summary()
+                            for (origin, destination), (travel, delay) in engine.journeys.pairs.items()}
+    if engine.indicators != None:
+        kpis["lane_windows"] = len(engine.indicators.windows)
+    return engine, kpis
+
+def print_kpis(kpis):
+    """Print the key performance indicators of a run"""
+    print()
+    print("Simulated time:       {:.2f} s".format(kpis["simulated_time"]))
+    print("Steps:                {}".format(kpis["steps"]))
+    print("Wall time:            {:.2f} s".format(kpis["wall_time"]))
+    print("Steps/sec:            {:.1f}".format(kpis["steps_per_second"]))
+    print("Real time factor:     x{:.1f}".format(kpis["real_time_factor"]))
+    print("Vehicles on the map:  {}".format(kpis["vehicles_on_map"]))
+    print("Generated vehicles:   {}".format(kpis["generated_vehicles"]))
+    print("Exited vehicles:      {}".format(kpis["exited_vehicles"]))
+    if "accelerations_per_step" in kpis:
+        print("Accelerations/step:   {:.1f}".format(kpis["accelerations_per_step"]))
+    if "skipped_steps" in kpis:
+        print("Fast-forwarded steps: {}".format(kpis["skipped_steps"]))
+    print("Final average speed:  {:.2f} km/h".format(kpis["final_average_speed"]))
+    print("Mean average speed:   {:.2f} km/h".format(kpis["mean_average_speed"]))
+    if "lane_windows" in kpis:
+        print("Lane indicators:      {} windows x lanes".format(kpis["lane_windows"]))
+    if "journeys" in kpis:
+        print("Travel times [s]:     count    mean     p50     p90     p99")
+        for (origin, destination), summary in sorted(kpis["journeys"].items()):
+            print("  #{:<3} -> #{:<3}    {:7} {:7.1f} {:7.1f} {:7.1f} {:7.1f}".format(origin, destination,
+                summary["count"], summary["mean"], summary["p50"], summary["p90"], summary["p99"]))
+    if "detector_passages" in kpis:
+        print("Detector passages:")
+        for name, nb in kpis["detector_passages"].items():
+            print("  {:<24} {:6}".format(name, nb))
+    if "regions" in kpis:
+        print("Regions:              {} ({} boundary roads)".format(kpis["regions"], kpis["boundary_roads"]))
+    print("Generator flows (in / out) [veh/h]:")
+    for i in range(len(kpis["generated_flows"])):
+        print("  #{:<3} {:8.1f} / {:8.1f}".format(i, kpis["generated_flows"][i], kpis["absorbed_flows"][i]))
+
+
+def detector_type(text):
+    """Parse ROAD:LANE:X into (Road.id, lane, x)"""
+    try:
+        road_id, lane, x = text.split(":")
+        road_id, lane, x = int(road_id), int(lane), float(x)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected ROAD:LANE:X, got {}".format(text))
+    if lane not in (0, 1):
+        raise argparse.ArgumentTypeError("LANE must be 0 or 1")
+    return road_id, lane, x
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Traffic simulation without graphic interface")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="simulate a map and print the KPIs")
+    run_parser.add_argument("--map", default="maps/map_data.txt", help="map_creator data file")
+    run_parser.add_argument("--duration", type=float, default=3600, help="simulated duration [s]")
+    run_parser.add_argument("--dt", type=float, default=0.01, help="simulation time step [s]")
+    run_parser.add_argument("--period", type=float, default=6, help="mean time between two generated vehicles [s]")
+    run_parser.add_argument("--seed", type=int, default=None, help="seed of the random generator")
+    run_parser.add_argument("--mode", choices=Engine.MODES, default="scalar", help="vehicle update: one by one or vectorized with NumPy")
+    run_parser.add_argument("--coarse-steps", type=int, default=1, help="number of steps during which the free vehicles keep their acceleration")
+    run_parser.add_argument("--quiet", action="store_true", help="do not print the progress")
+    run_parser.add_argument("--record", default=None, help="directory where the trajectories are recorded")
+    run_parser.add_argument("--record-rate", type=float, default=10, help="number of recorded frames per simulated second")
+    run_parser.add_argument("--profile", action="store_true", help="print the percentiles of the time of each phase of the steps")
+    run_parser.add_argument("--resume", default=None, help="checkpoint from which the simulation continues")
+    run_parser.add_argument("--save-checkpoint", default=None, help="file where the final state of the simulation is saved")
+    run_parser.add_argument("--kpi-window", type=float, default=None, help="duration of the windows of the indicators of each lane [s]")
+    run_parser.add_argument("--kpi-output", default=None, help="CSV file where the indicators of each lane and window are written")
+    run_parser.add_argument("--detector", action="append", type=detector_type, default=[], metavar="ROAD:LANE:X",
+                            help="loop detector at the abscissa X [m] of a road, on the lane going to cross2 (LANE=1) or cross1 (LANE=0)")
+    run_parser.add_argument("--detector-log", default=None, help="directory where the passages on the detectors are logged")
+    run_parser.add_argument("--journeys", default=None, help="JSON file where the travel time and delay histograms of each origin-destination pair are written")
+    run_parser.add_argument("--od", default=None, help="file of the origin-destination matrix (one line per generator): the vehicles follow routes to their destination")
+    run_parser.add_argument("--routes", type=int, default=1, help="number of alternative routes toward each destination, chosen by travel time")
+    run_parser.add_argument("--route-workers", type=int, default=None, help="number of processes building the routing table (default: number of cores)")
+    run_parser.add_argument("--regions", type=int, default=1, help="split the map in regions simulated on as many processes")
+
+    replicate_parser = commands.add_parser("replicate", help="simulate seeded replications on several processes")
+    replicate_parser.add_argument("--map", default="maps/map_data.txt", help="map_creator data file")
+    replicate_parser.add_argument("--duration", type=float, default=600, help="simulated duration of each run [s]")
+    replicate_parser.add_argument("--dt", type=float, default=0.01, help="simulation time step [s]")
+    replicate_parser.add_argument("--period", type=float, default=6, help="mean time between two generated vehicles [s]")
+    replicate_parser.add_argument("--mode", choices=Engine.MODES, default="scalar", help="vehicle update: one by one or vectorized with NumPy")
+    replicate_parser.add_argument("--runs", type=int, default=32, help="maximum number of runs")
+    replicate_parser.add_argument("--min-runs", type=int, default=4, help="minimum number of runs before stopping early")
+    replicate_parser.add_argument("--tolerance", type=float, default=None, help="stop when the half width of the interval of the mean speed is below this fraction of the mean")
+    replicate_parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the intervals")
+    replicate_parser.add_argument("--workers", type=int, default=None, help="number of processes (default: number of cores)")
+    replicate_parser.add_argument("--first-seed", type=int, default=0, help="seed of the first run, the next ones are incremented")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        if args.regions > 1 and args.profile:
+            parser.error("--profile cannot be used with --regions")
+        if args.regions > 1 and args.record != None:
+            parser.error("--record cannot be used with --regions")
+        if args.regions > 1 and args.resume != None:
+            parser.error("--resume cannot be used with --regions")
+        if args.regions > 1 and args.save_checkpoint != None:
+            parser.error("--save-checkpoint cannot be used with --regions")
+        if args.regions > 1 and args.coarse_steps != 1:
+            parser.error("--coarse-steps cannot be used with --regions")
+        if args.regions > 1 and args.kpi_window != None:
+            parser.error("--kpi-window cannot be used with --regions")
+        if args.regions > 1 and args.od != None:
+            parser.error("--od cannot be used with --regions")
+        if args.regions > 1 and args.journeys != None:
+            parser.error("--journeys cannot be used with --regions")
+        if args.regions > 1 and len(args.detector) > 0:
+            parser.error("--detector cannot be used with --regions")
+        if len(args.detector) > 0 and args.detector_log == None:
+            parser.error("--detector needs --detector-log")
+        if args.kpi_output != None and args.kpi_window == None:
+            args.kpi_window = 300
+        if args.regions > 1:
+            from partition import run_partitioned
+            cross_regions, kpis = run_partitioned(args.map, args.duration, args.dt, args.period, args.seed, args.mode, args.regions)
+        else:
+            profiler = Profiler() if args.profile else None
+            engine, kpis = run(args.map, args.duration, args.dt, args.period, args.seed, args.mode, args.quiet, profiler,
+                               args.record, args.record_rate, args.resume, args.save_checkpoint, args.coarse_steps,
+                               args.kpi_window, args.kpi_output, args.detector, args.detector_log, args.journeys,
+                               args.od, args.routes, args.route_workers)
+        print_kpis(kpis)
+        if args.profile:
+            print("Time of each phase, every {} steps:".format(STEPS_PER_CALL))
+            print(format_summary(profiler.summary()))
+    elif args.command == "replicate":
+        from replications import replicate, print_summary
+        results, summary, failed = replicate(args.map, args.duration, args.dt, args.period, args.mode, args.runs,
+            args.min_runs, args.tolerance, args.confidence, args.workers, args.first_seed)
+        if summary != None:
+            print_summary(summary, len(results), args.confidence)
+        if len(failed) > 0:
+            print("Failed runs (seeds): {}".format(failed))
+
+
+if __name__ == "__main__":
+    main()
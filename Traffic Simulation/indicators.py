@@ -0,0 +1,193 @@
+# coding = utf-8
+"""Traffic indicators of each lane (road and direction), aggregated in fixed time windows
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --kpi-window 300 --kpi-output roads.csv
+
+The counters of a lane are updated when a vehicle enters or leaves it (see Road.incoming_veh()
+and Road.outgoing_veh()), never on each step : the total time spent, distance travelled and road
+surface covered by the vehicles (Edie's generalized definitions) only need the time and position
+of these events, and the positions of the vehicles still on the lane when a window closes.
+The queues at the stop lines are sampled every QUEUE_PERIOD seconds.
+"""
+
+from simulation import *
+import csv
+
+QUEUE_PERIOD = 1 # [s] Time between two samples of the queues
+QUEUE_SPEED = 5 / 3.6 # [m/s] Speed below which a vehicle is queued
+QUEUE_GAP = 15 # [m] Largest gap between a queued vehicle and the stop line or the queued vehicle ahead
+
+# Indicators of a window, for each lane
+COLUMNS = ("t_start", # [s] Beginning of the window
+           "t_end", # [s] End of the window
+           "road", # Road.id
+           "lane", # 1 if the vehicles go to road.cross2, 0 if they go to road.cross1
+           "inflow", # [veh/h] Vehicles entering the lane
+           "flow", # [veh/h] Vehicles leaving the lane at the stop line
+           "density", # [veh/km] Mean number of vehicles on the lane per km
+           "speed", # [km/h] Space-mean speed (distance travelled / time spent), None without vehicle
+           "occupancy", # Mean fraction of the lane covered by vehicles
+           "queue", # [veh] Mean number of queued vehicles at the stop line
+           "max_queue") # [m] Longest queue sampled
+
+
+class LaneIndicators:
+    """Counters of the vehicles of one lane since the beginning of the current window
+    The time spent (vehicle ticks), distance travelled (vehicle metres) and surface covered (metre ticks)
+    are sums of (end - start) over the vehicles : the starts are subtracted when a vehicle enters the lane
+    (or when the window opens), the ends are added when it leaves (or when the window closes)"""
+
+    __slots__ = ("owner", "road", "lane", "length", "nb", "length_sum", "entered", "exited", "time", "distance", "covered",
+                 "queue_sum", "max_queue", "queue", "last")
+
+    def __init__(self, owner, road, lane):
+        """Counters of lane, a Lane of road, starting with the vehicles already on it
+        owner : RoadIndicators giving the tick of the events"""
+        self.owner = owner
+        self.road = road
+        self.lane = lane
+        self.length = road.length
+        self.nb = 0 # Number of vehicles on the lane, stops excluded
+        self.length_sum = 0 # [m] Sum of their lengths
+        for veh in lane:
+            if veh.veh_type != "stop":
+                self.nb += 1
+                self.length_sum += veh.length
+        self.queue = 0 # [veh] Queue of the last sample
+        self.last = None # Indicators of the last closed window, {column: value}
+        self.open(owner.start, self.positions())
+
+    def open(self, tick, positions):
+        """Start a window at tick, the vehicles on the lane being at positions (sum of their x)"""
+        self.entered, self.exited = 0, 0
+        self.time = -self.nb * tick
+        self.distance = -positions
+        self.covered = -self.length_sum * tick
+        self.queue_sum, self.max_queue = 0, 0
+
+    def positions(self):
+        """Sum of the positions [m] of the vehicles on the lane"""
+        positions = 0
+        for veh in self.lane:
+            if veh.veh_type != "stop":
+                veh.fetch()
+                positions += veh.x
+        return positions
+
+    def enter(self, veh):
+        """veh enters the lane"""
+        tick = self.owner.tick
+        self.nb += 1
+        self.length_sum += veh.length
+        self.entered += 1
+        self.time -= tick
+        self.distance -= veh.x
+        self.covered -= veh.length * tick
+
+    def leave(self, veh):
+        """veh leaves the lane, at veh.x past its end"""
+        tick = self.owner.tick
+        self.nb -= 1
+        self.length_sum -= veh.length
+        self.exited += 1
+        self.time += tick
+        self.distance += veh.x
+        self.covered += veh.length * tick
+
+    def sample_queue(self):
+        """Measure the queue at the stop line : the vehicles slower than QUEUE_SPEED from the first one,
+        each one less than QUEUE_GAP behind the stop line or the previous one"""
+        nb, back = 0, self.length
+        for veh in self.lane:
+            if veh.veh_type == "stop":
+                continue
+            veh.fetch()
+            if veh.v >= QUEUE_SPEED or back - veh.x > QUEUE_GAP:
+                break
+            nb += 1
+            back = veh.x - veh.length
+        self.queue = nb
+        self.queue_sum += nb
+        if nb > 0:
+            self.max_queue = max(self.max_queue, self.length - back)
+
+    def close(self, start, tick, dt, samples):
+        """Close the window [start, tick] of samples queue samples and open the next one
+        Return the indicators of the window"""
+        positions = self.positions()
+        time = (self.time + self.nb * tick) * dt # [veh.s]
+        distance = self.distance + positions # [veh.m]
+        covered = (self.covered + self.length_sum * tick) * dt # [m.s]
+        duration = (tick - start) * dt
+        self.last = {"t_start": round(start * dt, 9),
+                     "t_end": round(tick * dt, 9),
+                     "road": self.road.id,
+                     "lane": int(self.lane is self.road.vehicle_list_12),
+                     "inflow": self.entered / duration * 3600,
+                     "flow": self.exited / duration * 3600,
+                     "density": time / (self.length * duration) * 1000,
+                     "speed": distance / time * 3.6 if time > 0 else None,
+                     "occupancy": covered / (self.length * duration),
+                     "queue": self.queue_sum / max(1, samples),
+                     "max_queue": self.max_queue}
+        self.open(tick, positions)
+        return self.last
+
+
+class RoadIndicators:
+    """Indicators of every lane simulated by an engine (see Engine.indicators), over windows of window seconds"""
+
+    def __init__(self, engine, window=300):
+        """engine : Engine whose lanes are measured from its current tick
+        window [s] : duration of the aggregation windows"""
+        if type(window) not in (int,float) or window <= 0:
+            raise ValueError("window must be a positive int/float")
+        self.dt = engine.dt
+        self.every = max(1, int(round(QUEUE_PERIOD / engine.dt))) # Number of ticks between two queue samples
+        self.window_ticks = max(self.every, int(round(window / engine.dt)))
+        self.tick = engine.tick # Tick of the entries and exits, set by the engine
+        self.start = engine.tick # Tick of the beginning of the current window
+        self.window_end = self.start + self.window_ticks
+        self.next_tick = self.start + self.every # Tick of the next queue sample
+        self.lanes = dict() # {(road, destination cross): LaneIndicators}
+        for road, cross in engine.lanes:
+            lane = road.lane(cross)
+            lane.indicators = self.lanes[(road, cross)] = LaneIndicators(self, road, lane)
+        self.windows = [] # Indicators of every closed window and lane, in order
+
+    def latest(self, road, destination_cross):
+        """Return the indicators of the last closed window of the lane of road going to destination_cross,
+        None before the end of the first window"""
+        return self.lanes[(road, destination_cross)].last
+
+    def sample(self, engine):
+        """Sample the queues and close the window if it is over (called by the engine when next_tick is reached)
+        The samples skipped by Engine.fast_forward() are empty queues : the vehicles in free flow
+        are farther than QUEUE_GAP from their cross"""
+        for lane in self.lanes.values():
+            lane.sample_queue()
+        if engine.tick >= self.window_end:
+            self.close(engine.tick)
+        self.next_tick = min(self.window_end, (engine.tick // self.every + 1) * self.every)
+
+    def close(self, tick):
+        """Close the current window at tick, if it is not empty"""
+        if tick <= self.start:
+            return
+        samples = (tick - self.start) // self.every
+        for lane in self.lanes.values():
+            self.windows.append(lane.close(self.start, tick, self.dt, samples))
+        self.start = tick
+        self.window_end = tick + self.window_ticks
+
+    def detach(self):
+        """Stop counting on the lanes"""
+        for lane in self.lanes.values():
+            lane.lane.indicators = None
+
+    def write(self, filename):
+        """Write the indicators of the closed windows in the CSV file filename, one line per window and lane"""
+        with open(filename, "w", newline="") as file:
+            writer = csv.DictWriter(file, COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.windows)
@@ -0,0 +1,142 @@
+# coding = utf-8
+"""Travel times and delays of the vehicles between each pair of generators (origin-destination)
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --journeys journeys.json
+
+Each vehicle carries its origin generator, its entry time and the free-flow time of the roads it took
+(length / speed limit, see Road.incoming_veh()). When it leaves the map (see Vehicle.destroy()),
+its travel time and its delay (travel time - free-flow time) are added to the histograms of its
+origin-destination pair : no record is kept per vehicle, and the memory of a pair is fixed.
+"""
+
+from simulation import *
+import json
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Histogram:
+    """Counts of positive values in logarithmic buckets (HDR histogram) : the values are integers of
+    unit, counted exactly below 2**sub_bits units, then in buckets of relative width 2**(1 - sub_bits)
+    Memory is fixed by highest, the values above it being counted in the last bucket"""
+
+    def __init__(self, unit=0.01, highest=86400, sub_bits=7):
+        """unit : resolution of the values
+        highest : highest value counted exactly
+        sub_bits : precision, the relative error being below 2**(1 - sub_bits) (1.6 % for 7)"""
+        if type(sub_bits) is not int or sub_bits < 1:
+            raise ValueError("sub_bits must be a positive int")
+        self.unit = unit
+        self.sub_bits = sub_bits
+        self.sub = 1 << sub_bits
+        self.half = self.sub >> 1
+        self.counts = [0] * (self.index(int(highest / unit)) + 1)
+        self.total = 0
+        self.sum = 0 # Sum of the values, for the mean
+        self.min = None
+        self.max = None
+
+    def index(self, n):
+        """Bucket of the integer n >= 0"""
+        if n < self.sub:
+            return n
+        shift = n.bit_length() - self.sub_bits
+        return self.sub + (shift - 1) * self.half + (n >> shift) - self.half
+
+    def value(self, i):
+        """Middle value of the bucket i"""
+        if i < self.sub:
+            return i * self.unit
+        shift = (i - self.sub) // self.half + 1
+        low = (self.half + (i - self.sub) % self.half) << shift
+        return (low + (1 << shift) / 2) * self.unit
+
+    def add(self, value):
+        """Count value (negative values are counted as 0)"""
+        value = max(0, value)
+        self.counts[min(len(self.counts) - 1, self.index(int(value / self.unit)))] += 1
+        self.total += 1
+        self.sum += value
+        self.min = value if self.min == None else min(self.min, value)
+        self.max = value if self.max == None else max(self.max, value)
+
+    def percentile(self, p):
+        """p-th percentile (nearest rank), None without value"""
+        if not 0 <= p <= 100:
+            raise ValueError("p must be between 0 and 100")
+        if self.total == 0:
+            return None
+        rank = max(1, -(-p * self.total // 100)) # ceil(p/100 * n)
+        cumulated = 0
+        for i, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= rank:
+                if i == len(self.counts) - 1: # values above highest
+                    return self.max
+                return min(self.max, max(self.min, self.value(i)))
+
+    def summary(self, percentiles=PERCENTILES):
+        """Return {"count": .., "mean": .., "min": .., "p50": .., ..., "max": ..}"""
+        summary = {"count": self.total, "mean": self.sum / self.total if self.total > 0 else None, "min": self.min}
+        for p in percentiles:
+            summary["p{}".format(p)] = self.percentile(p)
+        summary["max"] = self.max
+        return summary
+
+    def buckets(self):
+        """Non-empty buckets, {middle value: count}"""
+        return {self.value(i): count for i, count in enumerate(self.counts) if count > 0}
+
+
+class JourneyTimes:
+    """Histograms of the travel time and delay [s] of the vehicles of each origin-destination pair,
+    fed by Vehicle.destroy() with the tick set by the engine (see Engine.journeys)"""
+
+    def __init__(self, engine, unit=0.1, highest=86400, sub_bits=7):
+        """engine : Engine whose vehicles are measured when they leave the map
+        unit, highest, sub_bits : parameters of the histograms (see Histogram)"""
+        self.dt = engine.dt
+        self.tick = engine.tick # Tick of the exits, set by the engine
+        self.parameters = (unit, highest, sub_bits)
+        self.pairs = dict() # {(origin, destination generator): (travel time Histogram, delay Histogram)}
+        self.generator_index = {gen: i for i, gen in enumerate(generators)}
+        Vehicle.journeys = self
+
+    def arrive(self, veh):
+        """Count the journey of veh, which reached its destination generator"""
+        histograms = self.pairs.get((veh.generator, veh.destination_cross))
+        if histograms == None:
+            histograms = self.pairs[(veh.generator, veh.destination_cross)] = (Histogram(*self.parameters), Histogram(*self.parameters))
+        travel_time = self.tick * self.dt - veh.entry_t
+        histograms[0].add(travel_time)
+        histograms[1].add(travel_time - veh.free_time)
+
+    def percentiles(self, origin, destination, percentiles=PERCENTILES):
+        """Return the summaries of the travel times and delays between the generators origin and destination,
+        ({"count": 0, ...}, {"count": 0, ...}) if no vehicle made this journey yet"""
+        histograms = self.pairs.get((origin, destination), (Histogram(*self.parameters), Histogram(*self.parameters)))
+        return histograms[0].summary(percentiles), histograms[1].summary(percentiles)
+
+    def detach(self):
+        """Stop counting the journeys"""
+        if Vehicle.journeys is self:
+            Vehicle.journeys = None
+
+    def dump(self):
+        """Return the summaries and non-empty buckets of every pair, the generators being given by their index"""
+        pairs = []
+        for (origin, destination), (travel, delay) in self.pairs.items():
+            pairs.append({"origin": self.generator_index[origin],
+                          "destination": self.generator_index[destination],
+                          "travel_time": travel.summary(),
+                          "delay": delay.summary(),
+                          "travel_time_buckets": sorted(travel.buckets().items()),
+                          "delay_buckets": sorted(delay.buckets().items())})
+        pairs.sort(key=lambda pair: (pair["origin"], pair["destination"]))
+        unit, highest, sub_bits = self.parameters
+        return {"unit": unit, "highest": highest, "sub_bits": sub_bits, "pairs": pairs}
+
+    def write(self, filename):
+        """Write dump() in the JSON file filename"""
+        with open(filename, "w") as file:
+            json.dump(self.dump(), file, indent=2)
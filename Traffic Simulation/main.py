@@ -1,171 +1,109 @@
 # coding = utf-8
+"""Graphic interface of the simulation, run by a separate process (see worker.py)
+
+The interface only draws the latest snapshot of the map sent by the simulation :
+it stays responsive whatever the load of the simulation, which uses its own core.
+"""
+
 from simulation import *
+from network import load_network
+from worker import SimulationProcess
+from snapshot import ShownMap, ShownVehicle
+from profiler import Profiler
+from time import perf_counter
+
 # Change next line with the map you want to use
-from maps.map_from_data import *
-from time import *
-from math import exp
-import decimal
-
-# Discretize time
-decimal.getcontext().prec = 8 # Set the precision for the decimal module
-t = decimal.Decimal(0)
-dt_s = decimal.Decimal(1)/decimal.Decimal(100)
+map_filename = "maps/map_data.txt"
+dt_s = 0.01 # [s] Time step of the simulation
 dt_g = 100 # [ms] # Time interval for graphic update()
+profile_period = 10 # Number of graphic updates between two refreshes of the profiler section
 
-delay = 0
-average_speed = 0
+frames = 0
+shown = ShownMap()
+shown_snapshot = None # Snapshot on the canvas
+simulation_profile = dict() # Latest summary of the profiler of the simulation
+profiler = Profiler() # Drawing times
+controls_sent = None # (play, speed) last sent to the simulation
 
-# file = open("results.txt", "w")
+def timed(phase, function, *args):
+    """Call function(*args) and record its computation time in the profiler"""
+    T = perf_counter()
+    function(*args)
+    profiler.add(phase, perf_counter() - T)
 
-def next_steps(dt_d, steps):
-    """Update all the simulation :
-    - vehicle acceleration, velocity and position
-    - vehicle crossing order for each cross according to the priority
-    - traffic light state """
+def show(snapshot):
+    """Draw a snapshot of the simulation"""
     T = perf_counter()
-    global t
-    global average_speed
-    dt = float(dt_d)
-
-    # if t == 0 or t == 2 or t == 4 :
-    #     veh = Vehicle(roads[0], crosses[0])
-    #     vehicles.append(veh)
-    #     roads[0].incoming_veh(veh, crosses[0])
-
-    for i in range(steps):
-        # file.write("{}\t".format(t))
-        average_speed = 0
-        # Generate vehicles
-        for gen in generators:
-            gen.generate(t)
-
-        for cross in crosses:
-            cross.updateTrafficLights(t)
-            cross.get_intentions()
-
-        # Update acceleration, speed and position of each vehicle
-        for veh in vehicles:
-            try:
-                a = veh.acceleration_IIDM()
-                veh.x += veh.v*dt + max(0, 0.5*a*dt*dt)
-                veh.v = max(0, veh.v + a*dt)
-                average_speed += veh.v
-
-                # file.write("{} {} {} ".format(a, veh.v, veh.x))
-
-                if veh.slow_down > 1:
-                    veh.slow_down -= 1
-                elif veh.slow_down == 1:
-                    veh.slow_down = 0
-                    veh.v0 = veh.road.speed_limit
-
-                if (veh.road.length - veh.x) <= ((veh.v*veh.v)/(2*veh.b_max) + 30) and veh.slow_down == 0 :
-                    veh.turn_speed()
-
-                if veh.leader != None and veh.leader.veh_type != "stop" and veh.leader.road == veh.road and veh.destination_cross != veh.leader.destination_cross:
-                    veh.decision = False
-                    veh.find_leader()
-
-            except:
-                next_road_id = None if veh.next_road == None else veh.next_road.id
-                leader_index = None if veh.leader == None or veh.leader.veh_type == "stop" else vehicles.index(veh.leader)
-
-                print("ERROR DURING THE SIMULATION, while working on {}, going from road {} to {}, following {} on {}, spacing: {}"
-                .format(vehicles.index(veh), veh.road.id, next_road_id, leader_index, veh.leader.road.id, veh.spacing_with_leader()))
-                raise
-
-        # file.write("\n")
-
-        if len(vehicles) > 0:
-            average_speed = (average_speed / len(vehicles)) * 3.6
-
-        # Check if the vehicles must change road
-        for road in roads:
-            road.outgoing_veh(road.first_vehicle(road.cross1))
-            road.outgoing_veh(road.first_vehicle(road.cross2))
-
-        for veh in deleted_vehicles:
-            # Delete the vehicles that left the map
-            gui.map.delete(veh.rep)
-            gui.map.delete(veh.brake_rep)
-        deleted_vehicles.clear()
-
-        t+= dt_d
-
-    global delay
-    delay = perf_counter() - T
+    for veh in shown.load(snapshot["vehicles"], snapshot["priority"]):
+        # Delete the vehicles that left the map
+        gui.map.delete_vehicle(veh)
+    vehicle_list = list(shown.shown.values())
+    timed("draw_vehicle", gui.map.draw_vehicle, vehicle_list)
+    timed("draw_traffic_lights", gui.map.draw_traffic_lights, crosses)
+    gui.controls.time_str.set("Current time : " + str(snapshot["t"]) + " s.")
+    gui.controls.nb_veh.set(len(vehicle_list))
+    gui.controls.avg_speed.set("{:.4f}".format(snapshot["average_speed"]))
+    profiler.add("drawing", perf_counter() - T)
 
 def update():
     """Update the graphic interface :
-    Compute the correct number of simulation steps
+    Send the controls to the simulation and draw its latest snapshot
     Update the position of the vehicles, the traffic lights and the leadership arrows"""
 
-    global delay
-    global average_speed
+    global frames, shown_snapshot, simulation_profile, controls_sent
     T = perf_counter()
-    if gui.controls.play.get():
-        next_steps(dt_s, int((dt_g/(1000*float(dt_s)))*gui.controls.speed.get()))
-        gui.map.draw_vehicle(vehicles)
-        gui.map.draw_traffic_lights(crosses)
-        gui.controls.time_str.set("Current time : " + str(t) + " s.")
-        gui.controls.nb_veh.set(len(vehicles))
-        gui.controls.avg_speed.set("{:.4f}".format(average_speed))
-        mouseover()
-        if gui.controls.leadership.get():
-            gui.map.draw_leadership(vehicles)
-        else:
-            gui.map.delete("leadership")
-        delay += perf_counter() - T + delay
-        gui.map.after(int(dt_g * exp(-delay*1000/dt_g)), update)
-    else:
-        mouseover()
-        gui.map.after(dt_g, update)
-        if gui.controls.leadership.get():
-            gui.map.draw_leadership(vehicles)
-        else:
-            gui.map.delete("leadership")
+    frames += 1
+    controls = (gui.controls.play.get(), gui.controls.speed.get())
+    if controls != controls_sent:
+        simulation.send("play", controls[0])
+        simulation.send("speed", controls[1])
+        controls_sent = controls
+
+    snapshot = simulation.latest()
+    drawn = False
+    if snapshot != None and snapshot is not shown_snapshot:
+        show(snapshot)
+        shown_snapshot = snapshot
+        if snapshot["profile"] != None:
+            simulation_profile = snapshot["profile"]
+        drawn = True
+    elif gui.map.viewport() != gui.map.drawn_viewport: # the map was moved : draw the vehicles now in view
+        timed("draw_vehicle", gui.map.draw_vehicle, list(shown.shown.values()), False)
+        drawn = True
+
+    if frames % profile_period == 0:
+        summary = dict(simulation_profile)
+        summary.update(profiler.summary())
+        gui.controls.show_profile(summary)
+    mouseover()
+    if not gui.controls.leadership.get():
+        gui.map.delete("leadership")
+    elif drawn:
+        timed("draw_leadership", gui.map.draw_leadership, list(shown.shown.values()))
+    gui.map.after(max(1, int(dt_g - (perf_counter() - T) * 1000)), update)
 
 
 mouse_x, mouse_y = 0, 0
 
 def click(event):
     """Slow down a vehicle when clicking on it"""
-    x, y = gui.map.canvasx(event.x), gui.map.canvasy(event.y)
-    objects = gui.map.find_overlapping(x,y,x,y)
-    for obj in objects:
-        tags = gui.map.gettags(obj)
-        if "vehicle" in tags:
-            for veh in vehicles:
-                if veh.rep == obj:
-                    veh.v0 = veh.v/3
-                    veh.slow_down = 10*int(1/dt_s)
-                    break
+    for item in gui.map.find_withtag("current"):
+        veh = gui.map.objects.get(item)
+        if isinstance(veh, ShownVehicle):
+            simulation.send("slow_down", veh.id)
 
 def mouseover():
     """Update the text to give information to the user"""
     x, y = gui.map.canvasx(mouse_x), gui.map.canvasy(mouse_y)
-    objects = gui.map.find_overlapping(x,y,x,y)
     txt = ""
-    for obj in objects:
-        tags = gui.map.gettags(obj)
-        if "road" in tags:
-            for road in roads:
-                if road.rep == obj:
-                    txt = txt + "Road {} (angle: {:.2f}) ".format(roads.index(road), road.angle)
-                    break
-        elif "cross" in tags:
-            for cross in crosses:
-                if cross.rep == obj:
-                    txt = txt + "Cross " + str(crosses.index(cross)) + "  "
-                    break
-        elif "vehicle" in tags:
-            for veh in vehicles:
-                if veh.rep == obj:
-                    next_road_id = None if veh.next_road == None else veh.next_road.id
-                    leader_index = None if veh.leader == None or veh.leader.veh_type == "stop" else vehicles.index(veh.leader)
-                    leader_index = "stop" if veh.leader != None and veh.leader.veh_type == "stop" else leader_index
-                    txt = txt + "Vehicle {} \n(speed: {:.2f}, v0: {:.2f}, d_to_cross: {:.2f}, going to: {}, leader: {}, decision: {})".format(vehicles.index(veh), veh.v*3.6, veh.v0*3.6, veh.d_to_cross(), next_road_id, leader_index, veh.decision)
-                    break
+    for obj in gui.map.find_at(x, y):
+        if isinstance(obj, Road):
+            txt = txt + "Road {} (angle: {:.2f}) ".format(obj.id, obj.angle)
+        elif isinstance(obj, Cross):
+            txt = txt + "Cross " + str(cross_numbers[obj]) + "  "
+        else:
+            leader_id = None if obj.leader == None else obj.leader.id
+            txt = txt + "Vehicle {} \n(speed: {:.2f}, v0: {:.2f}, d_to_cross: {:.2f}, going to: {}, leader: {}, decision: {})".format(obj.id, obj.v*3.6, obj.v0*3.6, obj.d_to_cross, obj.next_road, leader_id, obj.decision)
     gui.map.itemconfigure(tag, text=txt)
     gui.map.coords(tag, x+15, y+15)
 
@@ -173,9 +111,23 @@ def moved(event):
     global mouse_x, mouse_y
     mouse_x, mouse_y = event.x, event.y
 
-gui.map.bind("<Motion>", moved)
-gui.map.bind("<ButtonPress-3>", click)
-tag = gui.map.create_text(10, 10, text="", anchor="nw")
 
-gui.map.after(dt_g, update)
-gui.root.mainloop()
+# The simulation process imports this module without running the interface
+if __name__ == "__main__":
+    import gui
+    load_network(map_filename)
+    cross_numbers = {cross: i for i, cross in enumerate(crosses)} # Numbers shown by mouseover()
+    gui.map.draw_cross(crosses)
+    gui.map.draw_road(roads)
+    gui.map.draw_stop(roads)
+    simulation = SimulationProcess(map_filename, dt_s)
+
+    gui.map.bind("<Motion>", moved)
+    gui.map.bind("<ButtonPress-3>", click)
+    tag = gui.map.create_text(10, 10, text="", anchor="nw")
+
+    gui.map.after(dt_g, update)
+    try:
+        gui.root.mainloop()
+    finally:
+        simulation.close()
@@ -0,0 +1,296 @@
+"""Build the road network from the map_creator data, without any graphic interface
+
+The prepared network of a map is compiled once in a cache next to it (__netcache__ directory),
+keyed by the hash of the map : the next loadings skip the parsing and the preparation of the crosses.
+
+    python3 network.py maps/map_data.txt
+"""
+
+from simulation import *
+from random import getstate, setstate
+from itertools import count
+import hashlib
+import gc
+import tempfile
+import pickle
+import os
+import sys
+
+CACHE_VERSION = 1 # To increase when the compiled data or the simulated objects change
+CACHE_DIRECTORY = "__netcache__"
+
+def copy_list(a):
+    b = list()
+    for i in range(len(a)):
+        b.append(list())
+        for j in range(len(a[i])):
+            b[i].append(a[i][j])
+    return b
+
+# default_dispatch_3=[[0   , 0 , 1],
+#                     [0 , 0   , 1],
+#                     [1 , 0 , 0  ]]
+default_dispatch_3=[[0   , 0.2 , 0.8],
+                    [0.5 , 0   , 0.5],
+                    [0.8 , 0.2 , 0  ]]
+# default_dispatch_3=[[0   , 0.8 , 0.2],
+#                     [1 , 0   , 0],
+#                     [0.2 , 0.8 , 0  ]]
+
+default_dispatch_4=[[0   , 0.2, 0.6 , 0.2],
+                    [0.4 , 0  , 0.4 , 0.2],
+                    [0.6 , 0.2, 0   , 0.2],
+                    [0.4 , 0.2, 0.4 , 0  ]]
+
+disp = {1: None, 2: None, 3:default_dispatch_3, 4:default_dispatch_4}
+
+
+def setup_cross(cross, axis):
+    """Give to a cross of 3 or 4 roads its priority axis (tuple of 2 roads) and the default dispatch"""
+    cross.define_priority_axis(axis)
+    cross.sort_roads()
+    cross.set_dispatch(copy_list(disp[len(cross.roads)]))
+
+def add_road(cross1, cross2, speed_limit):
+    """Create a road between two crosses and add it to the roads list"""
+    road = Road(cross1, cross2, speed_limit, id=len(roads))
+    roads.append(road)
+    return road
+
+def parse_network(lines, period=6, speed_limit=50/3.6, filename="map"):
+    """Fill the lists of simulated objects with the network described by the lines of a map_creator file
+    Raise a ValueError giving the line of the first error"""
+    reset()
+    state = "generator"
+    compteur_roads = 0
+    for number, line in enumerate(lines, 1):
+        try:
+            if state == "generator":
+                if line.strip() != "":
+                    x,y = line.split()
+                    x,y = float(x), float(y)
+                    gen = GeneratorCross(coords = (x,y), period = period)
+                    generators.append(gen)
+                    crosses.append(gen)
+                else:
+                    state = "cross"
+            elif state == "cross":
+                if line.strip() != "":
+                    x,y,t = line.split()
+                    x,y = float(x), float(y)
+                    t = False if t == "False" else True
+                    cross = Cross(coords = (x,y), traffic_lights=t)
+                    crosses.append(cross)
+                else:
+                    state = "road"
+
+            elif state == "road":
+                if line.strip() != "":
+                    c1, c2 = line.split()
+                    c1, c2 = int(c1), int(c2)
+                    if c1 == c2:
+                        raise ValueError("a road cannot join a cross to itself")
+                    c1 = crosses[c1]
+                    c2 = crosses[c2]
+                    road = Road(c1, c2, speed_limit, id=compteur_roads)
+                    compteur_roads+=1
+                    roads.append(road)
+                else:
+                    state = "priority"
+
+            elif state == "priority":
+                if line.strip() != "":
+                    c, r1, r2 = line.split()
+                    c, r1, r2 = int(c), int(r1), int(r2)
+                    setup_cross(crosses[c], (roads[r1], roads[r2]))
+        except Exception as error:
+            raise ValueError("{} line {}: {!r} ({})".format(filename, number, line.strip(), error)) from error
+    check_network(filename)
+
+def check_network(filename="map"):
+    """Check that the network can be simulated : a single road on each generator,
+    a priority axis and a dispatch on each cross of 3 or 4 roads"""
+    for i, cross in enumerate(crosses):
+        if type(cross) is GeneratorCross:
+            if len(cross.roads) != 1:
+                raise ValueError("{}: generator {} has {} roads instead of 1".format(filename, i, len(cross.roads)))
+        elif len(cross.roads) < 2:
+            raise ValueError("{}: cross {} has less than 2 roads".format(filename, i))
+        elif len(cross.roads) > 2 and (cross.priority_axis == None or cross.dispatch == None):
+            raise ValueError("{}: cross {} has no priority axis".format(filename, i))
+
+def network_data():
+    """Return the prepared network (geometry, sorted roads, priority axes, cumulated dispatch)
+    as plain data, without the parameters given at loading (period, speed_limit)"""
+    cross_index = {cross: i for i, cross in enumerate(crosses)}
+    road_index = {road: i for i, road in enumerate(roads)}
+    return {"crosses": [(cross.coords, type(cross) is GeneratorCross, cross.traffic_lights_enabled) for cross in crosses],
+            "roads": [(cross_index[road.cross1], cross_index[road.cross2], road.angle, road.cos_angle, road.sin_angle, road.length)
+                      for road in roads],
+            "cross_roads": [[road_index[road] for road in cross.roads] for cross in crosses],
+            "priority_axes": [None if cross.priority_axis == None else tuple(road_index[road] for road in cross.priority_axis)
+                              for cross in crosses],
+            "dispatches": [cross.dispatch for cross in crosses]}
+
+def build_network(data, period=6, speed_limit=50/3.6):
+    """Fill the lists of simulated objects with a network returned by network_data()
+    Nothing is computed again : the roads are created without their checks and geometry"""
+    reset()
+    # The objects created all at once would trigger many useless collections
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        build_objects(data, period, speed_limit)
+    finally:
+        if enabled:
+            gc.enable()
+
+def build_objects(data, period, speed_limit):
+    """Create the simulated objects of build_network()"""
+    for coords, generator, traffic_lights in data["crosses"]:
+        if generator:
+            cross = GeneratorCross(coords=coords, period=period)
+            generators.append(cross)
+        else:
+            cross = Cross(coords=coords, traffic_lights=traffic_lights)
+        crosses.append(cross)
+
+    for i, (c1, c2, road_angle, cos_angle, sin_angle, length) in enumerate(data["roads"]):
+        road = Road.__new__(Road)
+        road.cross1, road.cross2 = crosses[c1], crosses[c2]
+        road.speed_limit = speed_limit
+        road.id = i
+        road.rep = None
+        road.angle, road.cos_angle, road.sin_angle, road.length = road_angle, cos_angle, sin_angle, length
+        # Same stop vehicles as Road.__init__(), created in the same order (random colors and numbers)
+        road.stop1 = Vehicle(road, road.cross1, vehicle_type="stop")
+        road.stop1.v = 0
+        road.stop1.x = length - 1
+        road.stop2 = Vehicle(road, road.cross2, vehicle_type="stop")
+        road.stop2.v = 0
+        road.stop2.x = length - 1
+        road.vehicle_list_12 = Lane()
+        road.vehicle_list_21 = Lane()
+        roads.append(road)
+
+    for cross, cross_roads, axis, dispatch in zip(crosses, data["cross_roads"], data["priority_axes"], data["dispatches"]):
+        cross.roads = [roads[i] for i in cross_roads]
+        cross.priority_axis = None if axis == None else (roads[axis[0]], roads[axis[1]])
+        cross.dispatch = dispatch
+
+def cache_filename(filename, digest):
+    """Compiled network of the map filename whose content has the hash digest"""
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, CACHE_DIRECTORY, "{}.{}.net".format(name, digest[:16]))
+
+def compile_network(filename):
+    """Check the map filename and write its prepared network in the cache, next to the map
+    Return the path of the compiled network"""
+    with open(filename, "rb") as file:
+        text = file.read()
+    digest = hashlib.sha256(text).hexdigest()
+    # The compilation does not change the random numbers drawn by the simulation
+    random_state, next_id = getstate(), Vehicle.ids.__reduce__()[1]
+    try:
+        parse_network(text.decode().splitlines(), filename=filename)
+    finally:
+        setstate(random_state)
+        Vehicle.ids = count(*next_id)
+    path = cache_filename(filename, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written under a temporary name then renamed, for the processes loading the same map at once
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as file:
+        pickle.dump({"version": CACHE_VERSION, "source": digest, "network": network_data()}, file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+    return path
+
+def load_network(filename="maps/map_data.txt", period=6, speed_limit=50/3.6, cache=True):
+    """Fill the lists of simulated objects with the network described in filename
+    period [s] : time between two vehicle income on each generator
+    speed_limit [m/s] : speed limit of every road
+    cache : use the compiled network if the map did not change since its compilation,
+    compile it otherwise (see compile_network)"""
+    if not cache:
+        with open(filename, "r") as file:
+            parse_network(file.readlines(), period, speed_limit, filename)
+        return
+
+    with open(filename, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    path = cache_filename(filename, digest)
+    try:
+        with open(path, "rb") as file:
+            compiled = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        compiled = None
+    if compiled == None or compiled.get("version") != CACHE_VERSION or compiled.get("source") != digest:
+        try:
+            path = compile_network(filename)
+        except OSError: # read-only directory : no cache
+            with open(filename, "r") as file:
+                parse_network(file.readlines(), period, speed_limit, filename)
+            return
+        with open(path, "rb") as file:
+            compiled = pickle.load(file)
+    build_network(compiled["network"], period, speed_limit)
+
+def grid_network(size, spacing=200, period=6, speed_limit=50/3.6, traffic_lights=True):
+    """Fill the lists of simulated objects with a grid of size x size crosses, spacing [m] apart,
+    with a generator at both ends of each row and each column (4*size generators)
+    The rows are the priority axis"""
+    reset()
+    if type(size) is not int or size < 1:
+        raise ValueError("size must be a positive int")
+    end = (size + 1) * spacing
+    for i in range(size):
+        position = (i + 1) * spacing
+        for coords in ((0, position), (end, position), (position, 0), (position, end)):
+            gen = GeneratorCross(coords=coords, period=period)
+            generators.append(gen)
+            crosses.append(gen)
+    grid = [[Cross(coords=((i + 1) * spacing, (j + 1) * spacing), traffic_lights=traffic_lights) for j in range(size)]
+            for i in range(size)]
+    for column in grid:
+        crosses.extend(column)
+
+    row_roads, column_roads = dict(), dict()
+    for j in range(size):
+        row = [generators[4*j]] + [grid[i][j] for i in range(size)] + [generators[4*j + 1]]
+        for a, b in zip(row[:-1], row[1:]):
+            road = add_road(a, b, speed_limit)
+            row_roads.setdefault(a, []).append(road)
+            row_roads.setdefault(b, []).append(road)
+    for i in range(size):
+        column = [generators[4*i + 2]] + grid[i] + [generators[4*i + 3]]
+        for a, b in zip(column[:-1], column[1:]):
+            add_road(a, b, speed_limit)
+
+    for column in grid:
+        for cross in column:
+            setup_cross(cross, tuple(row_roads[cross]))
+
+def arterial_network(size, spacing=200, period=6, speed_limit=50/3.6, traffic_lights=True):
+    """Fill the lists of simulated objects with an arterial of size crosses, spacing [m] apart,
+    each one being joined by a side street alternately from the north and the south
+    The arterial is the priority axis, with a generator at both ends and at the end of each side street"""
+    reset()
+    if type(size) is not int or size < 1:
+        raise ValueError("size must be a positive int")
+    for coords in [(0, 0), ((size + 1) * spacing, 0)] + [((i + 1) * spacing, spacing if i % 2 == 0 else -spacing) for i in range(size)]:
+        gen = GeneratorCross(coords=coords, period=period)
+        generators.append(gen)
+        crosses.append(gen)
+    line = [Cross(coords=((i + 1) * spacing, 0), traffic_lights=traffic_lights) for i in range(size)]
+    crosses.extend(line)
+
+    arterial = [generators[0]] + line + [generators[1]]
+    axis = [add_road(a, b, speed_limit) for a, b in zip(arterial[:-1], arterial[1:])]
+    for i in range(size):
+        add_road(line[i], generators[i + 2], speed_limit)
+        setup_cross(line[i], (axis[i], axis[i + 1]))
+
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        print("{} -> {}".format(filename, compile_network(filename)))
@@ -0,0 +1,332 @@
+# coding = utf-8
+"""Simulation of a large map split in regions, each one stepped by its own process
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --regions 4
+
+Each lane (direction of a road) belongs to the region of the cross it leads to, with the
+generators feeding it : the vehicles approaching a cross, the traffic lights and the
+priorities of the cross are all handled by the same process. The regions exchange, in one
+message to each neighbor :
+- the vehicles which entered a lane of another region, handed over to it with Road.incoming_veh()
+- the last vehicle of each lane coming from another region, copied there as a "ghost"
+  vehicle, so that the vehicles about to enter the lane can follow it
+The exchanges only happen at the end of each window of lookahead() steps : until then, a vehicle
+entering a lane of another region cannot reach the cross at its end, and is simulated by the region
+it comes from. The ghosts keep their position during the window, behind the real vehicles
+"""
+
+from simulation import *
+from network import load_network
+from engine import Engine
+from headless import STEPS_PER_CALL
+from time import perf_counter
+from itertools import count
+from queue import Empty
+import multiprocessing
+import traceback
+import random
+
+
+def partition(nb_regions):
+    """Split the crosses in nb_regions regions of the same size, by recursive coordinate
+    bisection : the largest side of each region is cut in two
+    The generators are put in the region of the cross they are linked to
+    Return the region of each cross, in the order of the crosses list"""
+    if type(nb_regions) is not int or nb_regions < 1:
+        raise ValueError("nb_regions must be a positive int")
+    inner = [cross for cross in crosses if type(cross) is not GeneratorCross]
+    if nb_regions > max(1, len(inner)):
+        raise ValueError("There are less crosses than regions")
+
+    region = dict()
+    def bisect(group, first, nb):
+        if nb == 1:
+            for cross in group:
+                region[cross] = first
+            return
+        spread = [max(c.coords[axis] for c in group) - min(c.coords[axis] for c in group) for axis in (0, 1)]
+        axis = 0 if spread[0] >= spread[1] else 1
+        group = sorted(group, key=lambda cross: cross.coords[axis])
+        half = nb // 2
+        cut = round(len(group) * half / nb)
+        bisect(group[:cut], first, half)
+        bisect(group[cut:], first + half, nb - half)
+    bisect(inner, 0, nb_regions)
+
+    for gen in generators:
+        road = gen.roads[0]
+        region[gen] = region.get(road.cross2 if road.cross1 is gen else road.cross1, 0)
+    return [region[cross] for cross in crosses]
+
+def boundary_roads(cross_regions):
+    """Return the roads linking two regions"""
+    region_of = dict(zip(crosses, cross_regions))
+    return [road for road in roads if region_of[road.cross1] != region_of[road.cross2]]
+
+def lookahead(cross_regions, dt):
+    """Number of steps during which the regions can be simulated without exchanging : the time for a
+    vehicle entering a boundary road, at the highest speed limit of the map, to reach the decision or
+    turning zone of the cross at its end, with two steps of margin (position when entering, rounding)
+    At least 1 step"""
+    v = max(road.speed_limit for road in roads)
+    zone = max((v*v)/(2*Vehicle.VEH_B_MAX[veh_type]) + max(30, v*PRIORITY_GAP[veh_type]) for veh_type in ("car", "truck"))
+    boundary = boundary_roads(cross_regions)
+    if len(boundary) == 0:
+        return 1
+    length = min(road.length for road in boundary)
+    return max(1, int((length - zone) / (v*dt)) - 2)
+
+
+class Region:
+    """Part of the map simulated by one process, and its boundary with the other regions"""
+
+    def __init__(self, index, cross_regions, inboxes, dt=0.01, mode="scalar"):
+        """index : number of the region
+        cross_regions : region of each cross (see partition())
+        inboxes : multiprocessing queue of the messages sent to each region
+        dt, mode : see Engine"""
+        self.index = index
+        self.inboxes = inboxes
+        self.pending = dict() # Messages received in advance, by step
+        self.window = lookahead(cross_regions, dt) # Number of steps between two exchanges
+        self.handed = set() # Vehicles handed over on the last exchange, still on the lanes as ghosts
+        region_of = dict(zip(crosses, cross_regions))
+
+        lanes = [] # Lanes simulated here
+        self.ghost_lanes = [] # (key, road, destination, owner) : lanes of other regions leaving our crosses
+        self.border_lanes = [] # (key, road, destination, origin region) : our lanes coming from other regions
+        for i, road in enumerate(roads):
+            for origin, destination in ((road.cross2, road.cross1), (road.cross1, road.cross2)):
+                key = (i, destination is road.cross2)
+                if region_of[destination] == index:
+                    lanes.append((road, destination))
+                    if region_of[origin] != index:
+                        self.border_lanes.append((key, road, destination, region_of[origin]))
+                elif region_of[origin] == index:
+                    self.ghost_lanes.append((key, road, destination, region_of[destination]))
+        self.neighbors = sorted(set(lane[3] for lane in self.ghost_lanes + self.border_lanes))
+        self.road_index = {road: i for i, road in enumerate(roads)}
+        self.engine = Engine(dt, mode, lanes)
+
+    def update_boundary(self):
+        """Exchange the boundary vehicles with the neighbors, at the end of a window (see lookahead())"""
+        handovers, tails = self.hand_over(), self.tails()
+        messages = {neighbor: (handovers[neighbor], tails[neighbor]) for neighbor in self.neighbors}
+        for handovers, tails in self.exchange(messages):
+            for key, state in handovers:
+                self.receive(key, state)
+            for key, state in tails:
+                self.update_ghost(key, state)
+        self.handed.clear()
+
+    def exchange(self, messages):
+        """Send messages[neighbor] to each neighbor and return their messages, in the order of self.neighbors
+        The neighbors can be one exchange ahead : their messages are kept until needed"""
+        step = self.engine.steps
+        for neighbor in self.neighbors:
+            self.inboxes[neighbor].put((self.index, step, messages[neighbor]))
+
+        received = self.pending.pop(step, dict())
+        while len(received) < len(self.neighbors):
+            sender, sender_step, content = self.inboxes[self.index].get()
+            if sender_step == step:
+                received[sender] = content
+            else:
+                self.pending.setdefault(sender_step, dict())[sender] = content
+        return [received[neighbor] for neighbor in self.neighbors]
+
+    def lane_ends(self, key):
+        """Return the road, origin cross and destination cross of the lane key"""
+        road = roads[key[0]]
+        if key[1]:
+            return road, road.cross1, road.cross2
+        return road, road.cross2, road.cross1
+
+    def hand_over(self):
+        """Remove from the region the vehicles which entered a lane of another region
+        They stay on the lane as ghosts, followed by our vehicles
+        Return the messages for each neighbor"""
+        messages = {neighbor: [] for neighbor in self.neighbors}
+        for key, road, destination, owner in self.ghost_lanes:
+            for veh in road.lane(destination):
+                if veh in vehicles:
+                    veh.fetch()
+                    vehicles.remove(veh)
+                    self.handed.add(veh)
+                    veh.change_leader(None)
+                    last_road = -1 if veh.last_road == None else self.road_index[veh.last_road]
+                    messages[owner].append((key, (veh.id, veh.veh_type, veh.x, veh.v, veh.last_a, veh.v0, veh.slow_down,
+                        veh.T, veh.s0, veh.a, veh.b, veh.leadership_color, last_road)))
+        return messages
+
+    def receive(self, key, state):
+        """Put on its lane a vehicle handed over by another region"""
+        road, origin, destination = self.lane_ends(key)
+        id, veh_type, x, v, last_a, v0, slow_down, T, s0, a, b, color, last_road = state
+        veh = Vehicle(road, origin, T=T, s0=s0, a=a, vehicle_type=veh_type, b=b)
+        veh.id = id
+        veh.v = v
+        veh.last_a = last_a
+        veh.v0 = v0
+        veh.slow_down = slow_down
+        veh.leadership_color = color
+        veh.road = road if last_road < 0 else roads[last_road] # becomes veh.last_road
+        vehicles.append(veh)
+        origin.transfer_vehicle(veh, road, x)
+        self.engine.awake_crosses[destination] = None
+
+    def tails(self):
+        """Return the messages for each neighbor describing the last vehicle of our lanes coming from it"""
+        messages = {neighbor: [] for neighbor in self.neighbors}
+        for key, road, destination, origin_region in self.border_lanes:
+            veh = road.lane(destination).last
+            if veh == None:
+                state = None
+            elif veh.veh_type == "stop":
+                state = "stop"
+            else:
+                veh.fetch()
+                last_road = -1 if veh.last_road == None else self.road_index[veh.last_road]
+                state = (veh.id, veh.veh_type, veh.x, veh.v, last_road)
+            messages[origin_region].append((key, state))
+        return messages
+
+    def update_ghost(self, key, state):
+        """Make the ghost lane key only contain a copy of the last vehicle of the real lane
+        The tail was sent before receiving our vehicles handed over : the last of them stays instead"""
+        road, origin, destination = self.lane_ends(key)
+        lane = road.lane(destination)
+        if lane.last in self.handed:
+            tail = lane.last
+        elif state == None:
+            tail = None
+        elif state == "stop":
+            tail = road.stop1 if destination is road.cross1 else road.stop2
+        else:
+            id, veh_type, x, v, last_road = state
+            tail = None
+            for veh in lane:
+                if veh.id == id and veh.veh_type != "stop":
+                    tail = veh
+            if tail == None:
+                tail = Vehicle(road, origin, vehicle_type=veh_type)
+                tail.id = id
+                tail.destination_cross = destination
+            tail.x = x
+            tail.v = v
+            tail.last_road = None if last_road < 0 else roads[last_road]
+
+        if tail != None and tail.lane is not lane:
+            lane.append(tail)
+        for veh in lane:
+            if veh is not tail:
+                self.drop_ghost(veh)
+        if tail != None:
+            tail.sync()
+
+    def drop_ghost(self, veh):
+        """Remove a ghost from its lane, its followers looking for a new leader"""
+        veh.lane.remove(veh)
+        veh.leave_leader()
+        veh.leader = None
+        for follower in list(veh.followers):
+            follower.change_leader(None)
+            follower.find_leader()
+        if veh.veh_type != "stop" and Vehicle.arrays is not None:
+            Vehicle.arrays.remove(veh)
+
+
+def work(index, cross_regions, map_filename, duration, dt, period, seed, mode, inboxes, results):
+    """Process simulating the region index during duration [s]
+    Put (index, KPIs of the region) in results, or (index, traceback) if the simulation failed"""
+    try:
+        random.seed(None if seed == None else seed * len(inboxes) + index)
+        load_network(map_filename, period=period)
+        Vehicle.ids = count(index, len(inboxes)) # numbers unique among the regions
+        region = Region(index, cross_regions, inboxes, dt, mode)
+        engine = region.engine
+        total_steps = int(round(duration / dt))
+
+        samples = [] # (sum of the speeds [km/h], number of vehicles) every STEPS_PER_CALL steps
+        while engine.steps < total_steps:
+            end = min(engine.steps + region.window, total_steps)
+            while engine.steps < end:
+                engine.next_steps(min(end, (engine.steps // STEPS_PER_CALL + 1) * STEPS_PER_CALL) - engine.steps)
+                deleted_vehicles.clear() # nothing to delete on a canvas
+                if engine.steps % STEPS_PER_CALL == 0 or engine.steps == total_steps:
+                    samples.append((engine.average_speed * len(vehicles), len(vehicles)))
+            region.update_boundary()
+
+        results.put((index, {"steps": engine.steps,
+                             "simulated_time": engine.t,
+                             "vehicles_on_map": len(vehicles),
+                             "generated_vehicles": engine.generated,
+                             "exited_vehicles": engine.exited,
+                             "samples": samples,
+                             "nb_generated": [gen.nb_generated for gen in generators],
+                             "nb_absorbed": [gen.nb_absorbed for gen in generators]}))
+    except BaseException:
+        results.put((index, traceback.format_exc()))
+
+def run_partitioned(map_filename="maps/map_data.txt", duration=3600, dt=0.01, period=6, seed=None, mode="scalar", nb_regions=2):
+    """Same as headless.run(), the map being split in nb_regions regions simulated on as many processes
+    Return the region of each cross and the key performance indicators of the run"""
+    load_network(map_filename, period=period)
+    cross_regions = partition(nb_regions)
+    nb_boundary_roads = len(boundary_roads(cross_regions))
+
+    context = multiprocessing.get_context()
+    inboxes = [context.Queue() for i in range(nb_regions)]
+    results = context.Queue()
+    workers = [context.Process(target=work, daemon=True,
+                               args=(i, cross_regions, map_filename, duration, dt, period, seed, mode, inboxes, results))
+               for i in range(nb_regions)]
+
+    T = perf_counter()
+    for worker in workers:
+        worker.start()
+    reports = dict()
+    try:
+        while len(reports) < nb_regions:
+            try:
+                index, report = results.get(timeout=1)
+            except Empty:
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise RuntimeError("A region process died without reporting")
+                continue
+            if type(report) is str:
+                raise RuntimeError("Error in the region {}:\n{}".format(index, report))
+            reports[index] = report
+    except:
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+    wall_time = perf_counter() - T
+
+    reports = [reports[i] for i in range(nb_regions)]
+    speeds = []
+    for sample in zip(*(report["samples"] for report in reports)):
+        nb_vehicles = sum(n for speed_sum, n in sample)
+        speeds.append(sum(speed_sum for speed_sum, n in sample) / nb_vehicles if nb_vehicles > 0 else 0)
+    steps = reports[0]["steps"]
+    simulated_time = reports[0]["simulated_time"]
+    hours = max(simulated_time, dt) / 3600
+
+    kpis = {"simulated_time": simulated_time,
+            "steps": steps,
+            "wall_time": wall_time,
+            "steps_per_second": steps / wall_time if wall_time > 0 else float("inf"),
+            "real_time_factor": simulated_time / wall_time if wall_time > 0 else float("inf"),
+            "vehicles_on_map": sum(report["vehicles_on_map"] for report in reports),
+            "generated_vehicles": sum(report["generated_vehicles"] for report in reports),
+            "exited_vehicles": sum(report["exited_vehicles"] for report in reports),
+            "final_average_speed": speeds[-1] if len(speeds) > 0 else 0,
+            "mean_average_speed": sum(speeds) / max(1, len(speeds)),
+            "generated_flows": [sum(counts) / hours for counts in zip(*(report["nb_generated"] for report in reports))],
+            "absorbed_flows": [sum(counts) / hours for counts in zip(*(report["nb_absorbed"] for report in reports))],
+            "regions": nb_regions,
+            "boundary_roads": nb_boundary_roads}
+    return cross_regions, kpis
@@ -0,0 +1,60 @@
+# coding = utf-8
+"""Rolling percentiles of the computation time of each phase of the simulation and of its display"""
+
+from collections import deque
+
+
+def nearest_rank(ordered, p):
+    """p-th percentile of the sorted list ordered (nearest rank method)"""
+    if not 0 <= p <= 100:
+        raise ValueError("p must be between 0 and 100")
+    rank = -(-p * len(ordered) // 100) # ceil(p/100 * n)
+    return ordered[max(1, int(rank)) - 1]
+
+
+class Profiler:
+    """Computation times of named phases, over their last window samples
+    The Engine adds the time of each of its phases (see Engine.PHASES) and the total "simulation" time
+    on each call to next_steps, the graphic interface adds the time of each drawing"""
+
+    def __init__(self, window=200):
+        """window : number of samples kept for each phase"""
+        if type(window) is not int or window < 1:
+            raise ValueError("window must be a positive int")
+        self.window = window
+        self.samples = dict() # Last durations [s] of each phase, in order of first appearance
+
+    def add(self, phase, duration):
+        """Record a duration [s] of phase"""
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = deque(maxlen=self.window)
+        samples.append(duration)
+
+    def percentile(self, phase, p):
+        """Return the p-th percentile [s] (nearest rank) of the recorded durations of phase"""
+        return nearest_rank(sorted(self.samples[phase]), p)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Return {phase: {"mean": .., "p50": .., ...}} in seconds, for the phases recorded so far"""
+        summary = dict()
+        for phase, samples in self.samples.items():
+            ordered = sorted(samples)
+            stats = {"mean": sum(ordered) / len(ordered)}
+            for p in percentiles:
+                stats["p{}".format(p)] = nearest_rank(ordered, p)
+            summary[phase] = stats
+        return summary
+
+    def reset(self):
+        """Forget every sample"""
+        self.samples.clear()
+
+
+def format_summary(summary):
+    """Return a text table of a Profiler summary, in milliseconds"""
+    columns = [key for key in next(iter(summary.values()), {})]
+    lines = ["{:<20}".format("[ms]") + "".join("{:>8}".format(key) for key in columns)]
+    for phase, stats in summary.items():
+        lines.append("{:<20}".format(phase) + "".join("{:8.2f}".format(stats[key] * 1000) for key in columns))
+    return "\n".join(lines)
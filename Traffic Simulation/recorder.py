@@ -0,0 +1,217 @@
+# coding = utf-8
+"""Record the trajectories of the vehicles in column-oriented NumPy files, written in the background
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --record records/run1 --record-rate 10
+
+A recording is a directory holding :
+- meta.json : time step, sampling rate, columns, number of chunks/frames/rows...
+- <column>_<chunk>.npy : one file per column and per chunk, which can be memory-mapped (numpy.load(mmap_mode="r"))
+Each frame (sample of the map) holds one row per vehicle. The frames are never split between two chunks.
+"""
+
+from simulation import *
+from threading import Thread
+from queue import Queue
+import numpy as np
+import json
+import os
+
+VERSION = 1
+
+# One row per vehicle and per frame
+COLUMNS = {"id": np.int32, # Vehicle.id
+           "road": np.int32, # Road.id
+           "lane": np.int8, # 1 if the vehicle goes to road.cross2, 0 if it goes to road.cross1
+           "turn": np.int8, # Direction at the next cross, see TURNS
+           "type": np.int8, # Vehicle type, see TYPES
+           "x": np.float32, # [m] Position on the road
+           "v": np.float32, # [m/s] Speed
+           "last_a": np.float32, # [m/s²] Acceleration
+           "leader": np.int32} # Vehicle.id of the leader, NO_LEADER or STOP_LEADER
+# One row per frame
+FRAME_COLUMNS = {"frame_t": np.float64, # [s] Time of the frame
+                 "frame_rows": np.int32, # Number of vehicles in the frame
+                 "priority": np.int8} # Cross.priority of every cross (one column per cross)
+
+TURNS = {None: 0, "left": 1, "right": 2}
+TYPES = {"car": 0, "truck": 1}
+NO_LEADER = -1
+STOP_LEADER = -2
+
+
+class TrajectoryRecorder:
+    """Sample the state of the vehicles every 1/rate seconds of simulated time (see Engine.recorder)
+    The samples are gathered in chunks of about chunk_rows rows, each chunk being written to the disk
+    by a background thread : at most max_pending chunks wait in memory for their writing"""
+
+    def __init__(self, directory, dt, rate=10, chunk_rows=2**20, max_pending=2, map_filename=None):
+        """directory : created if needed, existing recordings are overwritten
+        dt [s] : time step of the Engine
+        rate [Hz] : number of frames per simulated second, at most 1/dt
+        map_filename : map of the recording, for the replay"""
+        if type(rate) not in (int,float) or rate <= 0:
+            raise ValueError("rate must be a positive int/float")
+        if type(chunk_rows) is not int or chunk_rows < 1:
+            raise ValueError("chunk_rows must be a positive int")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dt = dt
+        self.rate = rate
+        self.every = max(1, int(round(1 / (rate * dt)))) # Number of ticks between two frames
+        self.next_tick = self.every # Tick of the next frame
+        self.chunk_rows = chunk_rows
+        self.map_filename = map_filename
+
+        self.nb_chunks = 0
+        self.nb_frames = 0
+        self.nb_rows = 0
+        self.error = None # Exception raised by the writer thread
+        self.new_chunk()
+
+        self.queue = Queue(maxsize=max_pending)
+        self.writer = Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+
+    def new_chunk(self):
+        """Empty the buffers of the current chunk"""
+        self.buffers = {name: [] for name in COLUMNS}
+        self.frame_buffers = {name: [] for name in FRAME_COLUMNS}
+        self.buffered_rows = 0
+
+    def sample(self, engine):
+        """Add a frame with the state of every vehicle on the map"""
+        if self.error != None:
+            raise self.error
+        engine.fetch_vehicles()
+        ids, road_ids, lanes, turns, types, xs, vs, accelerations, leaders = [], [], [], [], [], [], [], [], []
+        for veh in vehicles:
+            road = veh.road
+            leader = veh.leader
+            ids.append(veh.id)
+            road_ids.append(road.id)
+            lanes.append(veh.destination_cross is road.cross2)
+            turns.append(TURNS[veh.direction])
+            types.append(TYPES[veh.veh_type])
+            xs.append(veh.x)
+            vs.append(veh.v)
+            accelerations.append(veh.last_a)
+            leaders.append(NO_LEADER if leader == None else STOP_LEADER if leader.veh_type == "stop" else leader.id)
+
+        for name, values in zip(COLUMNS, (ids, road_ids, lanes, turns, types, xs, vs, accelerations, leaders)):
+            self.buffers[name].append(np.array(values, dtype=COLUMNS[name]))
+        self.frame_buffers["frame_t"].append(engine.t)
+        self.frame_buffers["frame_rows"].append(len(ids))
+        self.frame_buffers["priority"].append([getattr(cross, "priority", -1) for cross in crosses])
+
+        self.nb_frames += 1
+        self.nb_rows += len(ids)
+        self.buffered_rows += len(ids)
+        self.next_tick = engine.tick + self.every
+        if self.buffered_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """Send the current chunk to the writer thread"""
+        if len(self.frame_buffers["frame_t"]) == 0:
+            return
+        chunk = {name: np.concatenate(self.buffers[name]) for name in COLUMNS}
+        for name, dtype in FRAME_COLUMNS.items():
+            chunk[name] = np.array(self.frame_buffers[name], dtype=dtype)
+        self.queue.put((self.nb_chunks, chunk)) # waits if max_pending chunks are not written yet
+        self.nb_chunks += 1
+        self.new_chunk()
+
+    def write_chunks(self):
+        """Writer thread : save the chunks of the queue until None is received"""
+        while True:
+            item = self.queue.get()
+            if item == None:
+                break
+            if self.error != None:
+                continue
+            index, chunk = item
+            try:
+                for name, array in chunk.items():
+                    np.save(os.path.join(self.directory, "{}_{:06d}.npy".format(name, index)), array)
+            except Exception as error:
+                self.error = error
+
+    def close(self):
+        """Write the last chunk and the description of the recording, then stop the writer thread"""
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+        if self.error != None:
+            raise self.error
+        meta = {"version": VERSION,
+                "dt": self.dt,
+                "rate": self.rate,
+                "every": self.every,
+                "map": self.map_filename,
+                "chunks": self.nb_chunks,
+                "frames": self.nb_frames,
+                "rows": self.nb_rows,
+                "crosses": len(crosses),
+                "columns": {name: np.dtype(dtype).name for name, dtype in COLUMNS.items()},
+                "frame_columns": {name: np.dtype(dtype).name for name, dtype in FRAME_COLUMNS.items()},
+                "turns": {str(key): value for key, value in TURNS.items()},
+                "types": TYPES,
+                "no_leader": NO_LEADER,
+                "stop_leader": STOP_LEADER}
+        with open(os.path.join(self.directory, "meta.json"), "w") as file:
+            json.dump(meta, file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class TrajectoryReader:
+    """Recording written by a TrajectoryRecorder
+    The frame columns are loaded in memory, the vehicle columns are memory-mapped :
+    only the pages of the frames actually read are loaded from the disk"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as file:
+            self.meta = json.load(file)
+        if self.meta["version"] != VERSION:
+            raise ValueError("Unsupported recording version {}".format(self.meta["version"]))
+        self.directory = directory
+        self.dt = self.meta["dt"] * self.meta["every"] # [s] Time between two frames
+        self.chunks = dict() # Memory-mapped vehicle columns of the chunks already opened
+
+        chunks = range(self.meta["chunks"])
+        self.frame_t = np.concatenate([self.load("frame_t", c) for c in chunks] or [np.zeros(0)])
+        self.priority = np.concatenate([self.load("priority", c) for c in chunks] or [np.zeros((0, self.meta["crosses"]), np.int8)])
+        # Chunk of each frame, and index of its first row in the chunk
+        frame_rows = [self.load("frame_rows", c) for c in chunks]
+        self.frame_chunk = np.concatenate([np.full(len(rows), c) for c, rows in enumerate(frame_rows)] or [np.zeros(0, int)])
+        self.frame_start = np.concatenate([np.cumsum(rows) - rows for rows in frame_rows] or [np.zeros(0, int)])
+        self.frame_rows = np.concatenate(frame_rows or [np.zeros(0, int)])
+
+    def load(self, name, chunk, mmap_mode=None):
+        return np.load(os.path.join(self.directory, "{}_{:06d}.npy".format(name, chunk)), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        """Number of frames"""
+        return len(self.frame_t)
+
+    @property
+    def duration(self):
+        """[s] Time of the last frame"""
+        return float(self.frame_t[-1]) if len(self) > 0 else 0
+
+    def frame_at(self, t):
+        """Index of the last frame at or before t [s] (the first one if t is before it)"""
+        return max(0, int(np.searchsorted(self.frame_t, t, side="right")) - 1)
+
+    def frame(self, i):
+        """Return {column: array} of the vehicles of the frame i (views of the memory-mapped files)"""
+        chunk = int(self.frame_chunk[i])
+        if chunk not in self.chunks:
+            self.chunks[chunk] = {name: self.load(name, chunk, mmap_mode="r") for name in COLUMNS}
+        start = int(self.frame_start[i])
+        end = start + int(self.frame_rows[i])
+        return {name: column[start:end] for name, column in self.chunks[chunk].items()}
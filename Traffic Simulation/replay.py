@@ -0,0 +1,95 @@
+# coding = utf-8
+"""Replay a recording of the trajectories (see recorder.py) in the graphic interface, without simulating
+
+    python3 replay.py records/run1
+
+The frames are read from the memory-mapped files only when they are shown : a long recording
+can be scrubbed with the "Time" scale and played up to 1000 times faster than real time
+(simulation speed x replay speed), the intermediate frames being skipped.
+"""
+
+from simulation import *
+from network import load_network
+from recorder import TrajectoryReader, TURNS, TYPES, NO_LEADER, STOP_LEADER
+from snapshot import ShownMap
+from time import perf_counter
+import sys
+import gui
+
+TURN_NAMES = {code: turn for turn, code in TURNS.items()}
+TYPE_NAMES = {code: veh_type for veh_type, code in TYPES.items()}
+
+
+class Replay(ShownMap):
+    """Show the frames of a recording on gui.map"""
+
+    def __init__(self, reader):
+        ShownMap.__init__(self)
+        self.reader = reader
+        self.t = 0 # [s] Current time of the replay
+        self.frame_index = None # Frame currently shown
+
+    def load_frame(self, i):
+        """Update the shown vehicles and the traffic lights with the frame i
+        Return the vehicles that left the map since the previous frame shown"""
+        frame = self.reader.frame(i)
+        columns = {name: frame[name].tolist() for name in ("id", "road", "lane", "x", "v", "last_a")}
+        columns["direction"] = [TURN_NAMES[turn] for turn in frame["turn"].tolist()]
+        columns["type"] = [TYPE_NAMES[veh_type] for veh_type in frame["type"].tolist()]
+        columns["leader"] = [None if leader in (NO_LEADER, STOP_LEADER) else leader for leader in frame["leader"].tolist()]
+        self.frame_index = i
+        return self.load(columns, self.reader.priority[i].tolist())
+
+    def show(self, i):
+        """Draw the frame i on gui.map"""
+        for veh in self.load_frame(i):
+            gui.map.delete_vehicle(veh)
+        vehicle_list = list(self.shown.values())
+        gui.map.draw_vehicle(vehicle_list)
+        gui.map.draw_traffic_lights(crosses)
+        if gui.controls.leadership.get():
+            gui.map.draw_leadership(vehicle_list)
+        else:
+            gui.map.delete("leadership")
+        gui.controls.time_str.set("Current time : {:.1f} s.".format(self.reader.frame_t[i]))
+        gui.controls.nb_veh.set(len(vehicle_list))
+        gui.controls.avg_speed.set("{:.4f}".format(self.average_speed))
+
+
+reader = TrajectoryReader(sys.argv[1] if len(sys.argv) > 1 else "records/run1")
+if reader.meta["map"] == None:
+    raise ValueError("The recording does not give its map")
+load_network(reader.meta["map"])
+if len(crosses) != reader.meta["crosses"]:
+    raise ValueError("The map {} does not match the recording".format(reader.meta["map"]))
+gui.map.draw_cross(crosses)
+gui.map.draw_road(roads)
+gui.map.draw_stop(roads)
+
+replay = Replay(reader)
+dt_g = 100 # [ms] # Time interval for graphic update()
+scale_time = 0 # Last time written on the "Time" scale, to detect the moves of the user
+last_update = perf_counter()
+gui.controls.add_replay(reader.duration, reader.dt)
+
+def update():
+    """Advance the replay by the elapsed time times the speed, and show the frame reached"""
+    global scale_time, last_update
+    T = perf_counter()
+    elapsed, last_update = T - last_update, T
+    if abs(gui.controls.replay_time.get() - scale_time) > reader.dt / 2: # moved by the user
+        replay.t = gui.controls.replay_time.get()
+    elif gui.controls.play.get():
+        replay.t = min(reader.duration, replay.t + elapsed * gui.controls.speed.get() * gui.controls.replay_factor.get())
+
+    i = reader.frame_at(replay.t)
+    if len(reader) > 0 and i != replay.frame_index:
+        replay.show(i)
+    elif gui.map.viewport() != gui.map.drawn_viewport: # the map was moved : draw the vehicles now in view
+        gui.map.draw_vehicle(list(replay.shown.values()), blink=False)
+    gui.controls.replay_time.set(replay.t)
+    scale_time = gui.controls.replay_time.get()
+    gui.map.after(max(1, int(dt_g - (perf_counter() - T) * 1000)), update)
+
+gui.map.after(dt_g, update)
+gui.root.mainloop()
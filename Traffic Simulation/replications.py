@@ -0,0 +1,106 @@
+# coding = utf-8
+"""Monte Carlo replications of a scenario on several processes, with confidence intervals
+
+    python3 headless.py replicate --map maps/map_data.txt --duration 600 --runs 32 --tolerance 0.02
+"""
+
+from headless import run
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from statistics import NormalDist, mean, stdev
+from math import sqrt, tan, pi
+import os
+
+# KPIs averaged over the replications (see headless.run)
+KPIS = ("mean_average_speed", "final_average_speed", "vehicles_on_map", "generated_vehicles", "exited_vehicles")
+
+
+def student_quantile(p, df):
+    """Quantile p of the Student's t-distribution with df degrees of freedom
+    Exact for df = 1 and 2, Cornish-Fisher expansion of the normal quantile otherwise"""
+    if df == 1:
+        return tan(pi * (p - 0.5))
+    if df == 2:
+        return (2*p - 1) / sqrt(2*p*(1 - p))
+    z = NormalDist().inv_cdf(p)
+    return (z + (z**3 + z)/(4*df) + (5*z**5 + 16*z**3 + 3*z)/(96*df**2)
+            + (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/(384*df**3))
+
+def confidence_interval(values, confidence=0.95):
+    """Return (mean, half width of the confidence interval) of values"""
+    m = mean(values)
+    if len(values) < 2:
+        return m, float("inf")
+    return m, student_quantile((1 + confidence)/2, len(values) - 1) * stdev(values) / sqrt(len(values))
+
+def summarize(results, confidence=0.95):
+    """Mean and half width of the confidence interval of each KPI over the results of the runs"""
+    summary = {kpi: confidence_interval([r[kpi] for r in results], confidence) for kpi in KPIS}
+    for flows in ("generated_flows", "absorbed_flows"):
+        summary[flows] = [confidence_interval([r[flows][i] for r in results], confidence)
+                          for i in range(len(results[0][flows]))]
+    return summary
+
+
+def replication(args):
+    """Run one replication in a worker process, return its seed and KPIs (or the error)"""
+    map_filename, duration, dt, period, mode, seed = args
+    try:
+        engine, kpis = run(map_filename, duration, dt, period, seed, mode, quiet=True)
+        return seed, kpis, None
+    except Exception as error:
+        return seed, None, repr(error)
+
+def replicate(map_filename="maps/map_data.txt", duration=600, dt=0.01, period=6, mode="scalar",
+              runs=32, min_runs=4, tolerance=None, confidence=0.95, workers=None, first_seed=0, verbose=True):
+    """Simulate up to runs independent replications (seeds first_seed, first_seed+1...) on a pool of processes
+    Stop early when the confidence interval of the mean average speed is narrower than
+    tolerance (relative half width), after min_runs replications
+    Return the KPIs of each run, the summary and the seeds of the failed runs"""
+    workers = workers or os.cpu_count()
+    results, failed = [], []
+    next_seed = first_seed
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        def submit():
+            nonlocal next_seed
+            pending.add(pool.submit(replication, (map_filename, duration, dt, period, mode, next_seed)))
+            next_seed += 1
+
+        for i in range(min(workers, runs)):
+            submit()
+        converged = False
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                seed, kpis, error = future.result()
+                if error != None:
+                    failed.append(seed)
+                    if verbose:
+                        print("Run #{} failed: {}".format(seed, error))
+                    continue
+                results.append(kpis)
+                m, half_width = confidence_interval([r["mean_average_speed"] for r in results], confidence)
+                if verbose:
+                    print("Run #{} done: mean speed {:.2f} km/h, {} runs: {:.2f} +/- {:.2f} km/h"
+                        .format(seed, kpis["mean_average_speed"], len(results), m, half_width))
+                if tolerance != None and len(results) >= min_runs and half_width <= tolerance * abs(m):
+                    converged = True
+            # Keep the pool busy until the interval is tight enough
+            while not converged and len(pending) < workers and next_seed - first_seed < runs:
+                submit()
+
+    summary = summarize(results, confidence) if len(results) > 0 else None
+    return results, summary, failed
+
+def print_summary(summary, nb_runs, confidence=0.95):
+    """Print the mean and confidence interval of each KPI"""
+    print()
+    print("{} runs, {:.0f}% confidence intervals:".format(nb_runs, confidence*100))
+    for kpi in KPIS:
+        m, half_width = summary[kpi]
+        print("  {:<22} {:10.2f} +/- {:.2f}".format(kpi, m, half_width))
+    print("  Generator flows (in / out) [veh/h]:")
+    for i in range(len(summary["generated_flows"])):
+        (m_in, h_in), (m_out, h_out) = summary["generated_flows"][i], summary["absorbed_flows"][i]
+        print("    #{:<3} {:8.1f} +/- {:<6.1f} / {:8.1f} +/- {:.1f}".format(i, m_in, h_in, m_out, h_out))
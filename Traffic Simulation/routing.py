@@ -0,0 +1,179 @@
+# coding = utf-8
+"""Origin-destination demand : the vehicles drive to a destination generator drawn from an OD matrix,
+following a routing table instead of the random walk of the dispatch matrices (see Cross.choose_direction())
+
+    python3 headless.py run --map maps/map_data.txt --duration 3600 --od maps/od.txt --routes 2
+
+The routing table gives, on each cross and for each destination generator, the next road toward it.
+It is built once per network from the shortest travel time (length / speed limit) of every cross to
+every generator : one Dijkstra per destination, run on a pool of processes, the table being cached.
+With k routes, a vehicle chooses between the k best next roads getting closer to its destination
+(logit on their travel time) : the routes never loop, and never turn back.
+"""
+
+from simulation import *
+from concurrent.futures import ProcessPoolExecutor
+from math import exp, inf
+import hashlib
+import heapq
+import pickle
+import tempfile
+import os
+
+VERSION = 1
+ROUTE_SPREAD = 0.1 # Relative detour of an alternative route making it e times less chosen than the best one
+PARALLEL_CROSSES = 500 # Smallest network whose Dijkstras are run on a pool of processes
+
+
+def road_graph():
+    """Return the network as adjacency lists : for each cross, (road index, other cross index, travel time [s])
+    of its roads, and the index of the generators"""
+    cross_index = {cross: i for i, cross in enumerate(crosses)}
+    graph = [[(road.id, cross_index[road.cross2 if road.cross1 is cross else road.cross1], road.length / road.speed_limit)
+              for road in cross.roads] for cross in crosses]
+    return graph, [cross_index[gen] for gen in generators]
+
+def shortest_times(graph, is_generator, source):
+    """Dijkstra : shortest travel time [s] from every cross to the cross source (the roads are two-way)
+    The other generators are dead ends, no route goes through them"""
+    times = [inf] * len(graph)
+    times[source] = 0
+    heap = [(0, source)]
+    while len(heap) > 0:
+        time, cross = heapq.heappop(heap)
+        if time > times[cross] or (is_generator[cross] and cross != source):
+            continue
+        for road, other, weight in graph[cross]:
+            if time + weight < times[other]:
+                times[other] = time + weight
+                heapq.heappush(heap, (time + weight, other))
+    return times
+
+# Network of the worker processes, sent once to each of them
+worker_graph = None
+
+def init_worker(graph, is_generator):
+    global worker_graph
+    worker_graph = (graph, is_generator)
+
+def worker_times(source):
+    return shortest_times(worker_graph[0], worker_graph[1], source)
+
+def next_roads(graph, times, k):
+    """For each cross, the k best next roads toward the destination of times, as a road index if k = 1
+    or a tuple (road indices, cumulated probabilities), None if the destination cannot be reached"""
+    table = []
+    for cross, edges in enumerate(graph):
+        candidates = sorted((weight + times[other], road) for road, other, weight in edges if times[other] < times[cross])
+        if len(candidates) == 0:
+            table.append(None)
+        elif k == 1 or len(candidates) == 1:
+            table.append(candidates[0][1])
+        else:
+            candidates = candidates[:k]
+            best = candidates[0][0]
+            weights = [exp(-(time - best) / (ROUTE_SPREAD * best)) for time, road in candidates]
+            cumulated, total = [], 0
+            for weight in weights:
+                total += weight
+                cumulated.append(total / sum(weights))
+            cumulated[-1] = 1
+            table.append((tuple(road for time, road in candidates), tuple(cumulated)))
+    return table
+
+def network_signature(graph, k):
+    """Hash of the network and of the parameters of the routing table"""
+    return hashlib.sha256(pickle.dumps((VERSION, k, ROUTE_SPREAD, graph), pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+class RouteTable:
+    """Next road on each cross toward each generator (see next_roads()), and travel times between the generators"""
+
+    def __init__(self, k=1, workers=None, cache_directory=None):
+        """k : number of alternative routes
+        workers : number of processes computing the Dijkstras (default : number of cores, 1 : no process)
+        cache_directory : where the table is kept, keyed by the hash of the network, and reused"""
+        if type(k) is not int or k < 1:
+            raise ValueError("k must be a positive int")
+        graph, sources = road_graph()
+        path = None
+        if cache_directory != None:
+            path = os.path.join(cache_directory, "routes.{}.k{}".format(network_signature(graph, k)[:16], k))
+            try:
+                with open(path, "rb") as file:
+                    cached = pickle.load(file)
+                if cached["version"] == VERSION:
+                    self.table, self.times = cached["table"], cached["times"]
+                    return
+            except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+                pass
+
+        is_generator = [False] * len(graph)
+        for source in sources:
+            is_generator[source] = True
+        workers = workers or os.cpu_count()
+        if workers > 1 and len(sources) > 1 and len(graph) >= PARALLEL_CROSSES:
+            with ProcessPoolExecutor(min(workers, len(sources)), initializer=init_worker, initargs=(graph, is_generator)) as pool:
+                all_times = list(pool.map(worker_times, sources, chunksize=max(1, len(sources) // (4 * workers))))
+        else:
+            all_times = [shortest_times(graph, is_generator, source) for source in sources]
+
+        # table[cross][destination] : next road toward the generator number destination
+        tables = [next_roads(graph, times, k) for times in all_times]
+        self.table = [[tables[d][cross] for d in range(len(sources))] for cross in range(len(graph))]
+        # times[origin][destination] [s] : shortest travel time between two generators
+        self.times = [[all_times[d][origin] for d in range(len(sources))] for origin in sources]
+
+        if path != None:
+            try:
+                os.makedirs(cache_directory, exist_ok=True)
+                fd, temporary = tempfile.mkstemp(dir=cache_directory)
+                with os.fdopen(fd, "wb") as file:
+                    pickle.dump({"version": VERSION, "table": self.table, "times": self.times}, file, pickle.HIGHEST_PROTOCOL)
+                os.replace(temporary, path)
+            except OSError: # read-only directory : no cache
+                pass
+
+    def apply(self):
+        """Give to every cross its routes (Cross.routes), with the roads of the network"""
+        for cross, routes in zip(crosses, self.table):
+            cross.routes = [None if hop == None else roads[hop] if type(hop) is int else (tuple(roads[i] for i in hop[0]), hop[1])
+                            for hop in routes]
+
+
+def read_od(filename):
+    """Read an OD matrix : one line per origin generator, giving the demand toward each destination generator
+    (any positive unit : only the proportions of each line are used)"""
+    with open(filename) as file:
+        matrix = [[float(value) for value in line.split()] for line in file if line.strip() != ""]
+    return matrix
+
+def set_demand(matrix, routes):
+    """Make the vehicles of each generator drive to a destination drawn from its line of matrix,
+    along the routes of the RouteTable routes (see GeneratorCross.destinations and Vehicle.destination)
+    The destinations which cannot be reached from an origin are ignored"""
+    if len(matrix) != len(generators) or any(len(line) != len(generators) for line in matrix):
+        raise ValueError("The OD matrix must have {0} lines of {0} values".format(len(generators)))
+    routes.apply()
+    for origin, (gen, line) in enumerate(zip(generators, matrix)):
+        if any(value < 0 for value in line):
+            raise ValueError("Negative demand from generator {}".format(origin))
+        if line[origin] != 0:
+            raise ValueError("A vehicle cannot go back to its generator {}".format(origin))
+        demand = [value if routes.times[origin][destination] < inf else 0 for destination, value in enumerate(line)]
+        total = sum(demand)
+        if total == 0:
+            raise ValueError("No destination can be reached from generator {}".format(origin))
+        cumulated, running = [], 0
+        for value in demand:
+            running += value
+            cumulated.append(running / total)
+        last = max(destination for destination, value in enumerate(demand) if value > 0)
+        gen.destinations = cumulated[:last] + [1] * (len(cumulated) - last) # never above the last reachable destination
+
+def clear_demand():
+    """Go back to the random walk of the dispatch matrices"""
+    for cross in crosses:
+        cross.routes = None
+        if type(cross) is GeneratorCross:
+            cross.destinations = None
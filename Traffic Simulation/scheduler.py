@@ -0,0 +1,35 @@
+# coding = utf-8
+"""Priority queue of the events of the simulation, dated in integer ticks"""
+
+import heapq
+
+# Order of the events happening on the same tick
+GENERATION = 0
+TRAFFIC_LIGHTS = 1
+
+
+class Scheduler:
+    """Events are (tick, kind, action, args) : action(*args) is called on the tick"""
+
+    def __init__(self):
+        self.queue = []
+        self.counter = 0 # Keep the insertion order between events of the same tick and kind
+
+    def __len__(self):
+        return len(self.queue)
+
+    def schedule(self, tick, kind, action, *args):
+        """Call action(*args) when the tick is reached"""
+        heapq.heappush(self.queue, (tick, kind, self.counter, action, args))
+        self.counter += 1
+
+    def next_tick(self):
+        """Tick of the next event, None if there is no event left"""
+        return self.queue[0][0] if len(self.queue) > 0 else None
+
+    def run(self, tick):
+        """Call the actions of every event due at tick (or before)"""
+        queue = self.queue
+        while len(queue) > 0 and queue[0][0] <= tick:
+            event = heapq.heappop(queue)
+            event[3](*event[4])
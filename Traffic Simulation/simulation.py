@@ -4,19 +4,152 @@ from constants import *
 from functions import angle, random_color
 from math import pow, cos, sin
 from random import randint, random
+from bisect import bisect_left
 from math import log, e, pi
+from itertools import count
+
+
+class Lane:
+    """Ordered vehicles of a road going in one direction, the first one being the closest to the cross
+    Doubly linked list chained through the vehicles (Vehicle.lane, lane_prev, lane_next):
+    push/pop at both ends, membership test and removal of any vehicle are O(1)
+    The vehicles appended are numbered in their order of entry (Vehicle.lane_rank)"""
+
+    __slots__ = ("first", "last", "size", "entries", "indicators")
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.size = 0
+        self.entries = 0 # Number of vehicles appended so far
+        self.indicators = None # LaneIndicators counting the vehicles entering and leaving (see indicators.py)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, veh):
+        return veh.lane is self
+
+    def __iter__(self):
+        # The next vehicle is read before yielding, so that the current one can be removed
+        veh = self.first
+        while veh != None:
+            next_veh = veh.lane_next
+            yield veh
+            veh = next_veh
+
+    def append(self, veh):
+        """Add veh at the end of the lane"""
+        if veh.lane is not None:
+            raise ValueError("The vehicle is already on a lane")
+        veh.lane = self
+        veh.lane_rank = self.entries
+        self.entries += 1
+        veh.lane_prev = self.last
+        veh.lane_next = None
+        if self.last != None:
+            self.last.lane_next = veh
+        else:
+            self.first = veh
+        self.last = veh
+        self.size += 1
+
+    def insert_before(self, veh, new):
+        """Insert new just before veh in the lane, i.e. just ahead of it, between veh and the cross
+        (new is moved if it was already on a lane)"""
+        if veh.lane is not self:
+            raise ValueError("The vehicle is not on this lane")
+        if new.lane is not None:
+            new.lane.remove(new)
+        new.lane = self
+        new.lane_rank = veh.lane_rank
+        new.lane_prev = veh.lane_prev
+        new.lane_next = veh
+        if veh.lane_prev != None:
+            veh.lane_prev.lane_next = new
+        else:
+            self.first = new
+        veh.lane_prev = new
+        self.size += 1
+
+    def remove(self, veh):
+        """Remove veh from the lane"""
+        if veh.lane is not self:
+            raise ValueError("The vehicle is not on this lane")
+        if veh.lane_prev != None:
+            veh.lane_prev.lane_next = veh.lane_next
+        else:
+            self.first = veh.lane_next
+        if veh.lane_next != None:
+            veh.lane_next.lane_prev = veh.lane_prev
+        else:
+            self.last = veh.lane_prev
+        veh.lane = veh.lane_prev = veh.lane_next = None
+        self.size -= 1
+
+    def popleft(self):
+        """Remove and return the first vehicle of the lane"""
+        veh = self.first
+        if veh == None:
+            raise IndexError("pop from an empty lane")
+        self.remove(veh)
+        return veh
+
+
+class VehicleSet:
+    """Vehicles on the map, in order of arrival, with O(1) removal"""
+
+    def __init__(self):
+        self.items = dict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, veh):
+        return veh in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def append(self, veh):
+        self.items[veh] = None
+
+    def remove(self, veh):
+        del self.items[veh]
+
+    def index(self, veh):
+        """Rank of veh in the order of arrival (O(n), for display only)"""
+        for i, item in enumerate(self.items):
+            if item is veh:
+                return i
+        raise ValueError("The vehicle is not on the map")
+
+    def clear(self):
+        self.items.clear()
+
 
 # Lists of simulated objects
 generators = []
 crosses = []
 roads = []
-vehicles = []
+vehicles = VehicleSet()
 deleted_vehicles = []
 
+def reset():
+    """Empty the lists of simulated objects, before loading a new network"""
+    for object_list in (generators, crosses, roads, vehicles, deleted_vehicles):
+        object_list.clear()
+    Vehicle.ids = count()
+
 
 class Road:
     """Class representing a road, which is a segment between two intersections"""
 
+    __slots__ = ("cross1", "cross2", "speed_limit", "id", "rep", "angle", "cos_angle", "sin_angle", "length",
+                 "stop1", "stop2", "vehicle_list_12", "vehicle_list_21")
+
+    width = 6
+
     def __init__(self, cross1, cross2, speed_limit, id=None):
         """Initialize a Road object connected to two Intersections, with a speed_limit"""
         if not isinstance(cross1, Cross) or not isinstance(cross2, Cross):
@@ -38,7 +171,6 @@ class Road:
         self.sin_angle = sin(self.angle)
         # Set the geometry of the road
         self.length = float(((x2-x1)**2 + (y2-y1)**2)**0.5)
-        self.width = 6
 
         # Fake vehicles representing a stop sign at the end of the road
         self.stop1 = Vehicle(self, cross1, vehicle_type="stop")
@@ -53,8 +185,8 @@ class Road:
         cross2.add_road(self)
 
         # Lists containing the vehicles
-        self.vehicle_list_12 = list()
-        self.vehicle_list_21 = list()
+        self.vehicle_list_12 = Lane()
+        self.vehicle_list_21 = Lane()
 
     def incoming_veh(self, veh, origin_cross, x = 0):
         """Incoming vehicle on the road from origin_cross
@@ -76,13 +208,15 @@ class Road:
 
         # We add the vehicle at the beginning of the road, in the corresponding direction
         if origin_cross == self.cross1:
-            self.vehicle_list_12.append(veh)
+            lane = self.vehicle_list_12
             veh.destination_cross = self.cross2
         else:
-            self.vehicle_list_21.append(veh)
+            lane = self.vehicle_list_21
             veh.destination_cross = self.cross1
+        lane.append(veh)
 
         veh.x = x
+        veh.free_time += self.length / self.speed_limit
         veh.last_road = veh.road
         veh.road = self
         veh.origin_cross = origin_cross
@@ -90,24 +224,24 @@ class Road:
             veh.v0 = self.speed_limit
 
         # Choose the next road
-        veh.next_road = veh.destination_cross.choose_direction(self)
+        if veh.destination != None:
+            veh.next_road = veh.destination_cross.route(veh.destination)
+        else:
+            veh.next_road = veh.destination_cross.choose_direction(self)
 
 
         # Update the vehicle direction
         if veh.next_road != None:
-            nb_roads = len(veh.destination_cross.roads)
-            if nb_roads == 2 or veh.road in veh.destination_cross.priority_axis and veh.next_road in veh.destination_cross.priority_axis:
-                veh.direction = None
-            else:
-                i = veh.destination_cross.roads.index(veh.road)
-                j = veh.destination_cross.roads.index(veh.next_road)
-                if j == (i-1)%nb_roads:
-                    veh.direction = "right"
-                elif j == (i+1)%nb_roads:
-                    veh.direction = "left"
+            veh.movement = veh.destination_cross.movement(self, veh.next_road)
+            veh.direction = veh.movement.direction
         else:
+            veh.movement = None
             veh.direction = None
 
+        veh.sync()
+        if lane.indicators is not None:
+            lane.indicators.enter(veh)
+
         # Tell the follower that won't go the same direction we are gone
         for follower in veh.followers:
             if follower.next_road != veh.road:
@@ -131,29 +265,29 @@ class Road:
                 add = 0
 
             if veh.x >= length:
-                if veh in self.vehicle_list_12: # the vehicle is going to cross2
-                    if type(destination_cross) is GeneratorCross: # end of the map
-                        del self.vehicle_list_12[0]
-                        veh.destroy()
-                        # Update follower's leader to None
-                        if len(self.vehicle_list_12) > 0:
-                            self.first_vehicle(destination_cross).change_leader(None)
-                    else: # go to the next road
-                        destination_cross.transfer_vehicle(self.vehicle_list_12.pop(0), veh.next_road, veh.x - self.length +add)
-
-
-                elif veh in self.vehicle_list_21: # the vehicle is going to cross1
-                    if type(destination_cross) is GeneratorCross: # end of the map
-                        del self.vehicle_list_21[0]
-                        veh.destroy()
-                        # Update follower's leader to None
-                        if len(self.vehicle_list_21) > 0:
-                            self.first_vehicle(destination_cross).change_leader(None)
-                    else: # go to the next road
-                        destination_cross.transfer_vehicle(self.vehicle_list_21.pop(0), veh.next_road, veh.x - self.length +add)
-
-                else:
+                if veh.lane is not self.vehicle_list_12 and veh.lane is not self.vehicle_list_21:
                     raise ValueError("Vehicle not on this road")
+                lane = veh.lane # vehicle_list_12 if the vehicle is going to cross2
+                if lane.indicators is not None:
+                    lane.indicators.leave(veh)
+
+                if type(destination_cross) is GeneratorCross: # end of the map
+                    lane.popleft()
+                    veh.destroy()
+                    destination_cross.nb_absorbed += 1
+                    # Update follower's leader to None
+                    if len(lane) > 0:
+                        self.first_vehicle(destination_cross).change_leader(None)
+                else: # go to the next road
+                    destination_cross.transfer_vehicle(lane.popleft(), veh.next_road, veh.x - self.length +add)
+
+    def lane(self, destination_cross):
+        """Return the Lane of the vehicles going to destination_cross"""
+        if destination_cross is self.cross2:
+            return self.vehicle_list_12
+        elif destination_cross is self.cross1:
+            return self.vehicle_list_21
+        raise NotLinkedCross
 
     def first_vehicle(self,destination_cross):
         """Return the first vehicle arriving on destination_cross from this road"""
@@ -164,9 +298,9 @@ class Road:
             raise crossNotOnRoad
 
         if destination_cross is self.cross1:
-            return None if len(self.vehicle_list_21) == 0 else self.vehicle_list_21[0]
+            return self.vehicle_list_21.first
         else:
-            return None if len(self.vehicle_list_12) == 0 else self.vehicle_list_12[0]
+            return self.vehicle_list_12.first
 
     def last_vehicle(self, origin_cross):
         """Return the last vehicle arrived on the road from the origin_cross"""
@@ -177,14 +311,67 @@ class Road:
             raise crossNotOnRoad
 
         if origin_cross is self.cross1:
-            return None if len(self.vehicle_list_12) == 0 else self.vehicle_list_12[-1]
+            return self.vehicle_list_12.last
+        else:
+            return self.vehicle_list_21.last
+
+
+class Movement:
+    """Movement through a cross, from an incoming road to an outgoing road
+    Computed once by Cross.build_movements() as the network does not change"""
+
+    __slots__ = ("origin_index", "next_index", "angle", "speed_factor", "direction")
+
+    def __init__(self, cross, origin_index, next_index):
+        origin_road = cross.roads[origin_index]
+        next_road = cross.roads[next_index]
+        self.origin_index = origin_index # Index of the roads in cross.roads
+        self.next_index = next_index
+
+        # Angle of the bend, from the angles of both roads seen from the cross
+        if cross == origin_road.cross1:
+            angle_road = origin_road.angle
+        elif origin_road.angle >= 0:
+            angle_road = origin_road.angle - pi
+        else:
+            angle_road = pi + origin_road.angle
+
+        if cross == next_road.cross1:
+            angle_next_road = next_road.angle
+        elif next_road.angle >= 0:
+            angle_next_road = next_road.angle - pi
+        else:
+            angle_next_road = pi + next_road.angle
+
+        angle = abs(angle_road - angle_next_road)
+        if angle < 0.01:
+            angle = 3.1415
+        elif angle > pi:
+             angle = 2*pi - angle
+        self.angle = angle
+        # Optimal speed for taking the bend, relatively to the speed limit
+        # f(0) = 0, f(PI/2) = 15/50, f(PI) = 1
+        self.speed_factor = 0.08*angle*angle + 0.06*angle
+
+        # Direction of the vehicle : "left", "right" or None (ahead, or on the priority axis)
+        nb_roads = len(cross.roads)
+        priority_axis = cross.priority_axis or ()
+        if nb_roads == 2 or origin_road in priority_axis and next_road in priority_axis:
+            self.direction = None
+        elif next_index == (origin_index-1)%nb_roads:
+            self.direction = "right"
+        elif next_index == (origin_index+1)%nb_roads:
+            self.direction = "left"
         else:
-            return None if len(self.vehicle_list_21) == 0 else self.vehicle_list_21[-1]
+            self.direction = None
 
 
 class Cross:
     """Class modelizing a cross at coords (x,y), with or without traffic_lights"""
 
+    __slots__ = ("coords", "roads", "id", "rep", "movements", "exits", "priority", "priority_axis", "dispatch",
+                 "routes", "traffic_lights_enabled", "traffic_lights")
+
     def __init__(self, coords, id=None, traffic_lights=True):
         """Generate a Cross"""
 
@@ -196,6 +383,11 @@ class Cross:
         self.roads = list()
         self.id = id
         self.rep = None
+        self.movements = None # Movement for each (incoming road, outgoing road), see build_movements()
+        self.exits = None # Cumulated dispatch row of each incoming road
+        self.priority_axis = None
+        self.dispatch = None
+        self.routes = None # Next road toward each generator, for the origin-destination demand (see routing.py)
 
         self.priority = 1
         self.traffic_lights_enabled = traffic_lights
@@ -210,6 +402,7 @@ class Cross:
 
         if len(self.roads) < 4:
             self.roads.append(road)
+            self.movements = None
         else:
             print("Cross ID: ", self.id)
             raise TooManyRoads
@@ -223,6 +416,7 @@ class Cross:
             raise WrongAxisFormat
 
         self.priority_axis = axis
+        self.movements = None
 
     def sort_roads(self):
         """Sort the connected roads according to their angle"""
@@ -244,6 +438,25 @@ class Cross:
         if len(self.roads) > 2:
             while not (self.priority_axis[0] in (self.roads[0], self.roads[2]) and self.priority_axis[1] in (self.roads[0], self.roads[2])):
                 self.roads.append(self.roads.pop(0))
+        self.movements = None
+
+    def build_movements(self):
+        """Precompute the Movement of every pair of (incoming road, outgoing road)
+        and the cumulated dispatch row of every incoming road"""
+        self.movements = dict()
+        self.exits = dict()
+        for i in range(len(self.roads)):
+            for j in range(len(self.roads)):
+                if i != j:
+                    self.movements[(self.roads[i], self.roads[j])] = Movement(self, i, j)
+            if self.dispatch != None:
+                self.exits[self.roads[i]] = self.dispatch[i]
+
+    def movement(self, origin_road, next_road):
+        """Return the Movement from origin_road to next_road"""
+        if self.movements == None:
+            self.build_movements()
+        return self.movements[(origin_road, next_road)]
 
     def transfer_vehicle(self, vehicle, next_road, x=0):
         """Put vehicle on next_road at the abscissa x"""
@@ -275,10 +488,25 @@ class Cross:
         while rand == 0:
             rand = random()
 
+        if self.movements == None:
+            self.build_movements()
+        dispatch = self.exits[origin_road]
         for j in range(len(self.roads)):
-            if rand <= self.dispatch[self.roads.index(origin_road)][j]:
+            if rand <= dispatch[j]:
                 return self.roads[j]
 
+    def route(self, destination):
+        """Return the next road of a vehicle going to the generator number destination (see routing.py)"""
+        if type(self) is GeneratorCross: # end of the map
+            return None
+        hop = self.routes[destination]
+        if type(hop) is not tuple:
+            return hop
+        rand = 0
+        while rand == 0:
+            rand = random()
+        return hop[0][bisect_left(hop[1], rand)]
+
     def set_dispatch(self, dispatch):
         """Set the dispatch matrix of the cross,
         converting a probability matrix into a cumulated probability matrix"""
@@ -305,6 +533,18 @@ class Cross:
                 raise ValueError("Frequencies sum must equal 1")
 
         self.dispatch = dispatch
+        self.movements = None
+
+    def has_vehicle_in_decision_zone(self):
+        """Return True if the first vehicle arriving on the cross from one of its roads
+        (behind the stop of the traffic lights, if any) is in its decision zone"""
+        for road in self.roads:
+            veh = road.first_vehicle(self)
+            if veh != None and veh.veh_type == "stop":
+                veh = veh.lane_next
+            if veh != None and veh.in_decision_zone():
+                return True
+        return False
 
     def get_intentions(self):
         """Intersection management function
@@ -312,7 +552,13 @@ class Cross:
         For a vehicle, according to its direction and its priority
         check on the other roads if it can cross the intersection,
         verifying left, right and ahead the arriving vehicles
+
+        Nothing is done until a vehicle enters the decision zone : the engine
+        only evaluates the crosses with such a vehicle (see Engine.next_steps())
         """
+        if not self.has_vehicle_in_decision_zone():
+            return
+
         # Ensure that a vehicle has a unique fake-follower
         if len(self.roads) > 2:
             last1 = self.roads[0].last_vehicle(self)
@@ -423,13 +669,17 @@ class Cross:
 
                 if not veh.decision:
                     # close enough from the intersection
-                    if veh.d_to_cross() <= ((veh.v*veh.v)/(2*veh.b_max) + veh.v0*PRIORITY_GAP[veh.veh_type]):
-                        i = veh.destination_cross.roads.index(veh.road)
-                        j = veh.destination_cross.roads.index(veh.next_road)
+                    if veh.in_decision_zone():
+                        i = veh.movement.origin_index
+                        j = veh.movement.next_index
 
                         other = self.roads[(i-(j-i))%4].first_vehicle(self)
 
-                        if other != None:
+                        if other == None:
+                            # nobody on the priority road : go!
+                            veh.decision = True
+                            veh.change_leader(veh.next_road.last_vehicle(veh.destination_cross))
+                        else:
                             if other.time_to_cross() > veh.time_to_cross() + PRIORITY_GAP[veh.veh_type]:
                                 # the gap is big enough : go!
                                 veh.decision = True
@@ -480,55 +730,75 @@ class Cross:
                     else:
                         veh.find_leader()
 
+    def has_traffic_lights(self):
+        """Return True if the cross is regulated by traffic lights"""
+        return len(self.roads) > 2 and self.traffic_lights_enabled
+
+    def traffic_lights_cycle(self):
+        """Duration [s] of a complete cycle of the traffic lights"""
+        return self.traffic_lights[0][-1]+3
+
     def updateTrafficLights(self, t):
         """Check the time and update the traffic lights according to the progress of the cycle"""
-        if len(self.roads) > 2 and self.traffic_lights_enabled:
+        if self.has_traffic_lights():
             # if the cross should be regulated
             for i in range(len(self.traffic_lights[0])):
                 # for each column in the matrix check
-                if t%(self.traffic_lights[0][-1]+3) == self.traffic_lights[0][i]:
+                if t%self.traffic_lights_cycle() == self.traffic_lights[0][i]:
                     # if at a specific time on the cycle: update
-                    if self.traffic_lights[1][i] == 1:
-                        self.priority = 1
-                    elif self.traffic_lights[2][i] == 1:
-                        self.priority = 0
-                    else:
-                        self.priority = -1
+                    self.set_phase(i)
+
+    def set_phase(self, i):
+        """Switch the traffic lights to the phase of the column i of the traffic_lights matrix"""
+        if self.traffic_lights[1][i] == 1:
+            self.priority = 1
+        elif self.traffic_lights[2][i] == 1:
+            self.priority = 0
+        else:
+            self.priority = -1
 
-                    for road_index in range(len(self.roads)):
-                        # for each road on the cross
-                        if self.roads[road_index].cross1 == self:
-                            vehicle_list = self.roads[road_index].vehicle_list_21
-                        else:
-                            vehicle_list = self.roads[road_index].vehicle_list_12
-
-                        if self.traffic_lights[(road_index)%2+1][i] == 1: #GO
-                            if self.roads[road_index].stop1 in vehicle_list or self.roads[road_index].stop2 in vehicle_list :
-                                for veh in vehicle_list:
-                                    if veh.veh_type == "stop":
-                                        vehicle_list.remove(veh)
-                                        for follower in veh.followers:
-                                            follower.find_leader()
-                                            follower.decision = False
-
-                        # else STOP!
-                        elif len(vehicle_list) == 0:
-                            if self == self.roads[road_index].cross1:
-                                vehicle_list.append(self.roads[road_index].stop1)
-                            else:
-                                vehicle_list.append(self.roads[road_index].stop2)
+        for road_index in range(len(self.roads)):
+            # for each road on the cross
+            if self.roads[road_index].cross1 == self:
+                vehicle_list = self.roads[road_index].vehicle_list_21
+            else:
+                vehicle_list = self.roads[road_index].vehicle_list_12
+
+            if self.traffic_lights[(road_index)%2+1][i] == 1: #GO
+                if self.roads[road_index].stop1 in vehicle_list or self.roads[road_index].stop2 in vehicle_list :
+                    for veh in vehicle_list:
+                        if veh.veh_type == "stop":
+                            vehicle_list.remove(veh)
+                            for follower in veh.followers:
+                                if follower.lane is vehicle_list and follower.lane_prev != None:
+                                    # a vehicle that passed before the red light is still ahead
+                                    follower.change_leader(follower.lane_prev)
+                                else:
+                                    follower.find_leader()
+                                follower.decision = False
 
-                        elif vehicle_list[0].veh_type != "stop":
-                            for veh in vehicle_list:
-                                if veh.time_to_cross() > PRIORITY_GAP[veh.veh_type] or veh.v < 1.5:
-                                    veh.stop()
-                                    vehicle_list.insert(vehicle_list.index(veh), veh.leader)
-                                    break
+            # else STOP!
+            elif len(vehicle_list) == 0:
+                if self == self.roads[road_index].cross1:
+                    vehicle_list.append(self.roads[road_index].stop1)
+                else:
+                    vehicle_list.append(self.roads[road_index].stop2)
+
+            elif vehicle_list.first.veh_type != "stop":
+                for veh in vehicle_list:
+                    if veh.veh_type == "stop": # the lane is already stopped further
+                        break
+                    if veh.time_to_cross() > PRIORITY_GAP[veh.veh_type] or veh.v < 1.5:
+                        veh.stop()
+                        vehicle_list.insert_before(veh, veh.leader)
+                        break
 
 
 class GeneratorCross(Cross):
     """Generator cross, at the edges of the map, to add on the map or delete them"""
 
+    __slots__ = ("period", "next_period", "rand_period", "last_t", "nb_generated", "nb_absorbed", "destinations")
+
     def __init__(self, coords, period):
         """coords : (x,y) coordinates
         period [s] : time between two vehicle income"""
@@ -540,41 +810,83 @@ class GeneratorCross(Cross):
             raise TypeError("period is not int/float")
 
         self.coords = coords
+        self.id = None
+        self.rep = None
+        self.movements = None
+        self.exits = None
+        self.priority_axis = None
+        self.dispatch = None
+        self.routes = None
+        self.destinations = None # Cumulated probability of each destination generator (see routing.py), None for a random walk
+        self.traffic_lights_enabled = False
         self.period = period
         self.next_period = period
         self.roads = list()
         self.rand_period = None
         self.last_t = 0
+        self.nb_generated = 0 # Number of vehicles that entered the map here
+        self.nb_absorbed = 0 # Number of vehicles that left the map here
 
     def generate(self, t):
         """Generate vehicles on the map"""
-        road = self.roads[0]
-        vehicle_ahead = road.last_vehicle(self)
+        self.next_generation_time() # compute next period for the generation
+        # if it is time to generate
+        if (t - self.last_t) >= self.next_period :
+            return self.spawn(t)
 
+    def next_generation_time(self):
+        """Return the time [s] from which the next vehicle can be generated"""
         # Compute next period for the generation
         if self.rand_period  == None:
             self.rand_period = randint(-RAND_GAP, RAND_GAP)
             self.next_period = self.period + self.rand_period
+        return self.last_t + self.next_period
 
-        # if it is time to generate
-        if (t - self.last_t) >= self.next_period :
-            veh_type = "car" if random() < 0.9 else "truck" # decide wether we generate a car or a truck
-            if (vehicle_ahead == None or vehicle_ahead.x > (self.roads[0].speed_limit**2)/(2*Vehicle.VEH_B_MAX[veh_type]) + vehicle_ahead.s0 + (vehicle_ahead.length + Vehicle.VEH_LENGTH[veh_type])/2):
-                self.last_t = t
-
-                new_vehicle = Vehicle(road, self, vehicle_type = veh_type)
-                vehicles.append(new_vehicle)
-                new_vehicle.change_leader(vehicle_ahead)
-                new_vehicle.v = road.speed_limit
-                self.transfer_vehicle(new_vehicle, road)
-                self.rand_period = None
-                return new_vehicle
+    def spawn(self, t):
+        """Put a new vehicle on the road if there is enough space
+        Return the new vehicle, or None if the road is congested"""
+        road = self.roads[0]
+        vehicle_ahead = road.last_vehicle(self)
+
+        veh_type = "car" if random() < 0.9 else "truck" # decide wether we generate a car or a truck
+        if (vehicle_ahead == None or vehicle_ahead.x > (self.roads[0].speed_limit**2)/(2*Vehicle.VEH_B_MAX[veh_type]) + vehicle_ahead.s0 + (vehicle_ahead.length + Vehicle.VEH_LENGTH[veh_type])/2):
+            self.last_t = t
+
+            new_vehicle = Vehicle(road, self, vehicle_type = veh_type)
+            new_vehicle.generator = self
+            new_vehicle.entry_t = t
+            if self.destinations != None:
+                rand = 0
+                while rand == 0:
+                    rand = random()
+                new_vehicle.destination = bisect_left(self.destinations, rand)
+            vehicles.append(new_vehicle)
+            new_vehicle.change_leader(vehicle_ahead)
+            new_vehicle.v = road.speed_limit
+            self.transfer_vehicle(new_vehicle, road)
+            self.rand_period = None
+            self.nb_generated += 1
+            return new_vehicle
 
 class Vehicle:
     """Representation of a vehicle"""
 
-    VEH_LENGTH = {"car": 4, "truck": 10}
-    VEH_B_MAX = {"car": 10, "truck": 5}
+    __slots__ = ("id", "road", "origin_cross", "destination_cross", "next_road", "last_road", "leader", "followers",
+                 "x", "v", "v0", "last_a", "T", "s0", "a", "b", "b_max", "length", "veh_type",
+                 "decision", "slow_down", "angle", "direction", "movement", "slot", "lane", "lane_rank", "lane_prev", "lane_next",
+                 "generator", "entry_t", "free_time", "destination", "leadership_color", "rep", "brake_rep", "blinker_rep", "blinker_state")
+
+    # Constants of each type of vehicle ("stop" modelizes a stop line on a crossroad)
+    VEH_LENGTH = {"car": 4, "truck": 10, "stop": 4}
+    VEH_WIDTH = {"car": 2, "truck": 2.5, "stop": 2}
+    VEH_B_MAX = {"car": 10, "truck": 5, "stop": 10} # Maximum vehicle deceleration (in case of danger ahead)
+    VEH_A = {"truck": 1, "stop": 0} # Acceleration imposed by the type, the driver's one otherwise
+
+    delta = 4 # Acceleration exponent of the IDM
+
+    arrays = None # VehicleArrays shared by every vehicle when the vectorized engine is used
+    journeys = None # JourneyTimes counting the journeys of the vehicles leaving the map (see journeys.py)
+    ids = count() # Source of the vehicle numbers
 
     def __init__(self, road, origin_cross, T = 1, s0 = 2, a = 1.5, vehicle_type = "car", b = 1.5):
         """road : Road on which the car is summoned
@@ -596,9 +908,12 @@ class Vehicle:
             raise TypeError("Input a is not int/float")
         if type(vehicle_type) is not str:
             raise TypeError("Input vehicle_type is not str")
+        if vehicle_type not in Vehicle.VEH_LENGTH:
+            raise TypeError("Non existing type of vehicle, car or truck?")
         if type(b) not in (int,float):
             raise TypeError("Input b is not int/float")
 
+        self.id = next(Vehicle.ids) # Number of the vehicle, unique on the map
         self.road = road
         self.origin_cross = origin_cross
         self.destination_cross = None
@@ -606,13 +921,12 @@ class Vehicle:
         self.last_road = None
         self.leader = None
         self.followers = []
-        self.leadership_color = random_color()
+        self.leadership_color = None if vehicle_type == "stop" else random_color() # a stop never follows anyone
         self.x = 0 # Position of the vehicle on the road
         self.v = 0 # Speed of the vehicle
 
         self.T = T
         self.s0 = s0
-        self.delta = 4
         self.b = b
 
         self.decision = False
@@ -624,63 +938,48 @@ class Vehicle:
         self.last_a = 0
         self.blinker_rep = None
         self.direction = None
+        self.movement = None # Movement through the destination cross
         self.blinker_state = 0
+        self.slot = None # Index in Vehicle.arrays
+        self.lane = None # Lane of the road on which the vehicle is
+        self.lane_rank = None # Order of entry on the lane (see Lane.append())
+        self.lane_prev = None # Vehicle ahead on the lane
+        self.lane_next = None # Vehicle behind on the lane
+        self.generator = None # GeneratorCross where the vehicle entered the map
+        self.entry_t = None # [s] Time when it entered the map
+        self.free_time = 0 # [s] Time to drive the roads taken so far at their speed limit
+        self.destination = None # Number of the destination generator (see routing.py), None for a random walk
 
         self.veh_type = vehicle_type
-
-        if vehicle_type == "car": # It's a car
-            self.a = a # Acceleration
-            self.b_max = Vehicle.VEH_B_MAX[vehicle_type] # Maximum vehicle deceleration (in case of danger ahead)
-            self.length = Vehicle.VEH_LENGTH[vehicle_type]
-            self.width = 2
-        elif vehicle_type == "truck" : # It's a truck
-            self.a = 1
-            self.b_max = Vehicle.VEH_B_MAX[vehicle_type]
-            self.length = Vehicle.VEH_LENGTH[vehicle_type]
-            self.width = 2.5
-        elif vehicle_type == "stop": # Modelize a stop line on a crossroad
-            self.a=0
-            self.b_max = Vehicle.VEH_B_MAX["car"] # Maximum vehicle deceleration (in case of danger ahead)
-            self.length = Vehicle.VEH_LENGTH["car"]
-            self.width = 2
-        else:
-            raise TypeError("Non existing type of vehicle, car or truck?")
+        self.a = Vehicle.VEH_A.get(vehicle_type, a) # Acceleration
+        # Read on every step : copied from the tables
+        self.b_max = Vehicle.VEH_B_MAX[vehicle_type]
+        self.length = Vehicle.VEH_LENGTH[vehicle_type]
 
         self.v0 = road.speed_limit # v0 = desired speed (generally the speed limit)
 
-    def turn_speed(self):
-        """Give the optimal speed for taking the bend when changing of road
-        f(0) = 0, f(PI/2) = 15/50, f(PI) = 1"""
-        if self.next_road != None:
-            if self.destination_cross == self.road.cross1:
-                angle_road = self.road.angle
-            elif self.road.angle >= 0:
-                angle_road = self.road.angle - pi
-            else:
-                angle_road = pi + self.road.angle
-
-            if self.destination_cross == self.next_road.cross1:
-                angle_next_road = self.next_road.angle
-            elif self.next_road.angle >= 0:
-                angle_next_road = self.next_road.angle - pi
-            else:
-                angle_next_road = pi + self.next_road.angle
+    @property
+    def width(self):
+        return Vehicle.VEH_WIDTH[self.veh_type]
 
-            angle = abs(angle_road - angle_next_road)
-            if angle < 0.01:
-                angle = 3.1415
-            elif angle > pi:
-                 angle = 2*pi - angle
-            self.angle = angle
-            self.v0 = (0.08*angle*angle + 0.06*angle) * self.road.speed_limit
+    def turn_speed(self):
+        """Give the optimal speed for taking the bend when changing of road (see Movement)"""
+        if self.movement != None:
+            self.angle = self.movement.angle
+            self.v0 = self.movement.speed_factor * self.road.speed_limit
 
     def destroy(self):
         """Delete a vehicle from the map and give a new leader to the followers"""
         deleted_vehicles.append(self)
+        if Vehicle.journeys is not None and self.generator is not None:
+            Vehicle.journeys.arrive(self)
         for veh in self.followers:
             veh.leader = None
             veh.find_leader()
+            veh.sync()
         vehicles.remove(self)
+        if Vehicle.arrays is not None:
+            Vehicle.arrays.remove(self)
 
     def stop(self):
         """Give the correct stop leader according to the road and the direction"""
@@ -703,6 +1002,34 @@ class Vehicle:
         """Distance between the vehicle and the cross"""
         return self.road.length - self.x
 
+    def in_decision_zone(self):
+        """Return True if the vehicle is close enough from the cross to negotiate its crossing"""
+        return self.d_to_cross() <= ((self.v*self.v)/(2*self.b_max) + self.v0*PRIORITY_GAP[self.veh_type])
+
+    def is_free(self, horizon):
+        """Return True if the vehicle can keep its acceleration during horizon [s] :
+        speed close to v0, out of the turning and decision zones of the cross
+        and far enough from its leader for the IIDM interaction to stay negligible, even if the leader brakes"""
+        v, v0 = self.v, self.v0
+        if self.slow_down != 0 or abs(v - v0) > FREE_SPEED_GAP * v0:
+            return False
+        v_max = v + max(0, self.last_a) * horizon
+        reach = v_max * horizon # Longest distance travelled during horizon
+        braking = (v_max*v_max)/(2*self.b_max)
+        if self.d_to_cross() - reach <= braking + max(30, v0*PRIORITY_GAP[self.veh_type]):
+            return False
+        leader = self.leader
+        if leader != None:
+            if leader.road == self.road and leader.veh_type != "stop" and leader.destination_cross != self.destination_cross:
+                return False
+            # Smallest spacing and desired gap if the leader brakes as hard as possible during horizon
+            v_leader = max(0, leader.v - leader.b_max*horizon)
+            spacing = self.spacing_with_leader() - (v_max - v_leader)*horizon
+            gap = self.s0 + max(0, v_max*self.T + v_max*(v_max - v_leader)/(2*(self.a*self.b)**0.5))
+            if spacing <= 0 or gap > FREE_INTERACTION * spacing:
+                return False
+        return True
+
     def change_leader(self, vehicle):
         """Change the leader of a vehicle"""
         if not (isinstance(vehicle, Vehicle) or vehicle == None):
@@ -712,6 +1039,7 @@ class Vehicle:
         self.leader = vehicle
         if self.leader != None :
             self.leader.followers.append(self)
+        self.sync()
 
     def leave_leader(self):
         """Tell the leader that we don't follow it anymore"""
@@ -727,6 +1055,18 @@ class Vehicle:
             leader = self.next_road.last_vehicle(self.destination_cross)
             self.change_leader(leader)
 
+    def sync(self):
+        """Copy the state of the vehicle in Vehicle.arrays, if the vectorized engine is used
+        Must be called after each change of road, leader or desired speed"""
+        if Vehicle.arrays is not None:
+            Vehicle.arrays.write(self)
+
+    def fetch(self):
+        """Copy the position, speed and acceleration computed in Vehicle.arrays into the vehicle, if the vectorized
+        engine is used. Must be called before reading them out of the vehicle update (see Engine.fetch_vehicles())"""
+        if Vehicle.arrays is not None:
+            Vehicle.arrays.fetch(self)
+
     def spacing_with_leader(self):
         """Return the spacing between the car and its leader
         If there is no leader, the distance is 250"""
@@ -735,11 +1075,9 @@ class Vehicle:
         else:
             if self.leader.road == self.road:
                 if self.leader.veh_type != "stop":
-                    # "standard" leader
-                    if self.x < self.length: # too close of the end of the road
-                        return max(0.01, self.leader.x - self.x - (self.leader.length + self.length)/2)
-                    else:
-                        return self.leader.x - self.x - (self.leader.length + self.length)/2
+                    # "standard" leader, never behind : two vehicles merging on the road may enter it
+                    # in the wrong order, the follower then brakes until the leader is ahead
+                    return max(0.01, self.leader.x - self.x - (self.leader.length + self.length)/2)
                 else : # "stop" leader
                     return max(0.00001, self.leader.x - self.x - (self.leader.length + self.length)/2)
             elif self.leader.road == self.next_road:
@@ -0,0 +1,111 @@
+# coding = utf-8
+"""State of the map sent by the simulation process to the graphic interface (see worker.py),
+and vehicles shown on the canvas from such a state or from a recorded frame (see replay.py)
+
+A snapshot is a dict of plain values, copied from the simulation at a given time :
+the graphic interface never reads the simulated objects, which can change in the meantime.
+"""
+
+from simulation import *
+from functions import random_color
+
+# Optional columns of the vehicles, only shown in the information text
+DETAILS = ("v0", "decision", "next_road", "d_to_cross")
+
+
+def take_snapshot(engine, profile=False):
+    """Return the snapshot of the map simulated by engine
+    The "vehicles" are given by columns : Vehicle.id, Road.id, lane (True if going to road.cross2),
+    direction, type, x [m], v [m/s], last_a [m/s²], Vehicle.id of the leader (None without leader or behind a stop)
+    and the DETAILS
+    profile : add the summary of the profiler of the engine"""
+    ids, road_ids, lanes, directions, types, xs, vs, accelerations, leaders = [], [], [], [], [], [], [], [], []
+    desired_speeds, decisions, next_roads, distances = [], [], [], []
+    engine.fetch_vehicles()
+    for veh in vehicles:
+        road = veh.road
+        leader = veh.leader
+        ids.append(veh.id)
+        road_ids.append(road.id)
+        lanes.append(veh.destination_cross is road.cross2)
+        directions.append(veh.direction)
+        types.append(veh.veh_type)
+        xs.append(veh.x)
+        vs.append(veh.v)
+        accelerations.append(veh.last_a)
+        leaders.append(None if leader == None or leader.veh_type == "stop" else leader.id)
+        desired_speeds.append(veh.v0)
+        decisions.append(veh.decision)
+        next_roads.append(None if veh.next_road == None else veh.next_road.id)
+        distances.append(road.length - veh.x)
+
+    return {"t": engine.t,
+            "steps": engine.steps,
+            "average_speed": engine.average_speed,
+            "vehicles": {"id": ids, "road": road_ids, "lane": lanes, "direction": directions, "type": types,
+                         "x": xs, "v": vs, "last_a": accelerations, "leader": leaders,
+                         "v0": desired_speeds, "decision": decisions, "next_road": next_roads, "d_to_cross": distances},
+            "priority": [getattr(cross, "priority", -1) for cross in crosses],
+            "profile": engine.profiler.summary() if profile and engine.profiler != None else None}
+
+
+class ShownVehicle:
+    """Vehicle shown on the canvas, with the attributes read by gui.Map.draw_vehicle and gui.Map.draw_leadership"""
+    __slots__ = ("id", "road", "origin_cross", "veh_type", "length", "width", "x", "v", "last_a", "direction",
+                 "leader", "leadership_color", "rep", "brake_rep", "blinker_rep", "blinker_state") + DETAILS
+
+    def __init__(self, id, veh_type):
+        self.id = id
+        self.veh_type = veh_type
+        self.length = Vehicle.VEH_LENGTH[veh_type]
+        self.width = Vehicle.VEH_WIDTH[veh_type]
+        self.road = None
+        self.origin_cross = None
+        self.x, self.v, self.last_a = 0, 0, 0
+        self.direction = None
+        self.leader = None
+        self.leadership_color = random_color()
+        self.rep, self.brake_rep, self.blinker_rep = None, None, None
+        self.blinker_state = 0
+        for name in DETAILS:
+            setattr(self, name, None)
+
+
+class ShownMap:
+    """Vehicles and traffic lights of the last state shown"""
+
+    def __init__(self):
+        self.shown = dict() # {Vehicle.id: ShownVehicle} of the vehicles on the canvas
+        self.average_speed = 0 # [km/h] in the state shown
+
+    def load(self, columns, priorities):
+        """Update the shown vehicles with the columns of a snapshot (see take_snapshot(), DETAILS are optional)
+        and the traffic lights with the priority of each cross
+        Return the vehicles that left the map since the previous state shown"""
+        ids, road_ids, lanes, directions, types = columns["id"], columns["road"], columns["lane"], columns["direction"], columns["type"]
+        xs, vs, accelerations = columns["x"], columns["v"], columns["last_a"]
+        details = [(name, columns[name]) for name in DETAILS if name in columns]
+
+        previous = self.shown
+        self.shown = dict()
+        for k, id in enumerate(ids):
+            veh = previous.pop(id, None)
+            if veh == None:
+                veh = ShownVehicle(id, types[k])
+            road = roads[road_ids[k]]
+            veh.road = road
+            veh.origin_cross = road.cross1 if lanes[k] else road.cross2
+            veh.x, veh.v, veh.last_a = xs[k], vs[k], accelerations[k]
+            veh.direction = directions[k]
+            for name, values in details:
+                setattr(veh, name, values[k])
+            self.shown[id] = veh
+        for veh, leader in zip(self.shown.values(), columns["leader"]):
+            veh.leader = None if leader == None else self.shown.get(leader)
+
+        for cross, priority in zip(crosses, priorities):
+            if cross.traffic_lights_enabled:
+                cross.priority = priority
+
+        self.average_speed = sum(vs) / len(vs) * 3.6 if len(vs) > 0 else 0
+        return list(previous.values())
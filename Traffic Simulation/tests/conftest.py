@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the simulator are imported by name, and the maps are found from its directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def simulator_directory(monkeypatch):
+    monkeypatch.chdir(ROOT)
@@ -0,0 +1,26 @@
+import gzip
+import json
+
+import pytest
+
+from headless import run
+
+
+def read(filename):
+    with gzip.open(filename, "rt") as file:
+        return json.load(file)
+
+
+@pytest.mark.parametrize("mode", ["scalar", "vectorized"])
+def test_resume_is_identical_to_a_straight_run(tmp_path, mode):
+    """80 s straight, and 40 s saved then resumed for 40 s, give the same state"""
+    if mode == "vectorized":
+        pytest.importorskip("numpy")
+    straight, half, resumed = tmp_path / "straight.json.gz", tmp_path / "half.json.gz", tmp_path / "resumed.json.gz"
+    run("maps/map_data.txt", 80, seed=5, mode=mode, quiet=True, checkpoint=str(straight))
+    run("maps/map_data.txt", 40, seed=5, mode=mode, quiet=True, checkpoint=str(half))
+    run("maps/map_data.txt", 40, mode=mode, quiet=True, resume=str(half), checkpoint=str(resumed))
+
+    state = read(straight)
+    assert len(state["vehicles"]) > 0
+    assert read(resumed) == state
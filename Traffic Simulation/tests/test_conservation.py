@@ -0,0 +1,28 @@
+import pytest
+
+from simulation import generators, vehicles
+from headless import run
+
+
+@pytest.mark.parametrize("mode", ["scalar", "vectorized"])
+def test_vehicles_are_conserved(mode):
+    """Every vehicle generated is still on the map or left it"""
+    if mode == "vectorized":
+        pytest.importorskip("numpy")
+    engine, kpis = run("maps/map_data.txt", 150, period=3, seed=1, mode=mode, quiet=True)
+
+    assert kpis["exited_vehicles"] > 0
+    assert kpis["generated_vehicles"] == kpis["exited_vehicles"] + kpis["vehicles_on_map"]
+    assert kpis["vehicles_on_map"] == len(vehicles)
+    assert sum(gen.nb_generated for gen in generators) == kpis["generated_vehicles"]
+    assert sum(gen.nb_absorbed for gen in generators) == kpis["exited_vehicles"]
+
+
+def test_vehicles_are_conserved_across_regions():
+    """The vehicles handed over between the regions are neither lost nor duplicated"""
+    from partition import run_partitioned
+    cross_regions, kpis = run_partitioned("maps/map_data.txt", 150, period=3, seed=1, nb_regions=2)
+
+    assert len(set(cross_regions)) == 2
+    assert kpis["exited_vehicles"] > 0
+    assert kpis["generated_vehicles"] == kpis["exited_vehicles"] + kpis["vehicles_on_map"]
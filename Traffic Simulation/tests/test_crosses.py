@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+from simulation import crosses, vehicles
+from network import load_network
+from engine import Engine
+
+
+def simulate(mode, every_cross_awake):
+    """Positions and speeds of the vehicles after 120 s on the default map"""
+    random.seed(1)
+    load_network("maps/map_data.txt", period=3)
+    engine = Engine(0.01, mode)
+    if every_cross_awake:
+        for step in range(12000):
+            engine.awake_crosses = dict.fromkeys(crosses)
+            engine.next_steps(1)
+    else:
+        engine.next_steps(12000)
+    engine.fetch_vehicles()
+    return [(veh.id, veh.road.id, veh.x, veh.v) for veh in vehicles]
+
+
+@pytest.mark.parametrize("mode", ["scalar", "vectorized"])
+def test_sleeping_crosses_do_not_change_the_run(mode):
+    """Only evaluating the crosses with a vehicle in their decision zone gives the same run
+    as evaluating all of them on every step"""
+    if mode == "vectorized":
+        pytest.importorskip("numpy")
+    assert simulate(mode, False) == simulate(mode, True)
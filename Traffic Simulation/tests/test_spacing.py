@@ -0,0 +1,21 @@
+import random
+
+import pytest
+
+from simulation import vehicles
+from network import grid_network
+from engine import Engine
+
+
+@pytest.mark.parametrize("mode", ["scalar", "vectorized"])
+def test_vehicles_merging_in_the_wrong_order(mode):
+    """Two vehicles turning on the same lane may enter it in the wrong order : the follower
+    ahead of its leader brakes instead of getting a negative spacing"""
+    if mode == "vectorized":
+        pytest.importorskip("numpy")
+    random.seed(1)
+    grid_network(10, period=1)
+    engine = Engine(0.01, mode)
+    engine.next_steps(6000) # 60 s, the first merge in the wrong order happens at 52.27 s in vectorized mode
+
+    assert engine.generated == engine.exited + len(vehicles)
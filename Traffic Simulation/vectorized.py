@@ -0,0 +1,303 @@
+# coding = utf-8
+"""Struct-of-arrays vehicle state and batched IIDM integration (vectorized engine mode)"""
+
+from simulation import *
+import numpy as np
+
+SPACING_NO_LEADER = 250 # Same arbitrary constant as Vehicle.spacing_with_leader()
+
+
+def key(obj):
+    """Integer key identifying a road or a cross in the arrays (-1 for None)"""
+    return -1 if obj is None else id(obj)
+
+
+class VehicleArrays:
+    """Contiguous NumPy arrays holding the state of every vehicle on the map
+    Each Vehicle owns a slot (Vehicle.slot), the stop vehicles of the roads included.
+    Discrete events (new road, new leader, new desired speed...) are copied
+    with write(), continuous quantities (x, v, last_a) are computed here, and only
+    copied in the Vehicle objects when they are read (see fetch())"""
+
+    def __init__(self, capacity=1024):
+        self.capacity = 0
+        self.objects = [] # Vehicle of each slot (None if free)
+        self.free_slots = []
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        """Grow the arrays up to capacity slots"""
+        old = self.capacity
+        def grow(array, dtype, fill):
+            new = np.full(capacity, fill, dtype=dtype)
+            if array is not None:
+                new[:old] = array
+            return new
+        get = lambda name: getattr(self, name, None)
+        # Kinematics
+        self.x = grow(get("x"), np.float64, 0)
+        self.v = grow(get("v"), np.float64, 0)
+        self.last_a = grow(get("last_a"), np.float64, 0)
+        self.v0 = grow(get("v0"), np.float64, 1)
+        self.slow_down = grow(get("slow_down"), np.int64, 0)
+        # Driver and vehicle parameters
+        self.a = grow(get("a"), np.float64, 1)
+        self.b = grow(get("b"), np.float64, 1)
+        self.T = grow(get("T"), np.float64, 1)
+        self.s0 = grow(get("s0"), np.float64, 0)
+        self.b_max = grow(get("b_max"), np.float64, 1)
+        self.length = grow(get("length"), np.float64, 0)
+        self.priority_gap = grow(get("priority_gap"), np.float64, 0)
+        self.is_stop = grow(get("is_stop"), np.bool_, False)
+        self.active = grow(get("active"), np.bool_, False)
+        self.moving = grow(get("moving"), np.bool_, False) # Integrated here (not a stop nor a copy of another process' vehicle)
+        self.free = grow(get("free"), np.bool_, False) # Keeping its acceleration until the next classification
+        self.free_leader = grow(get("free_leader"), np.int64, -1) # Leader when classified free
+        self.synced = grow(get("synced"), np.bool_, True) # The Vehicle object holds the kinematics of the slot
+        # Position on the network
+        self.leader = grow(get("leader"), np.int64, -1)
+        self.road = grow(get("road"), np.int64, -1)
+        self.next_road = grow(get("next_road"), np.int64, -1)
+        self.destination_cross = grow(get("destination_cross"), np.int64, -1)
+        self.road_length = grow(get("road_length"), np.float64, 1)
+        self.speed_limit = grow(get("speed_limit"), np.float64, 1)
+
+        self.objects.extend([None] * (capacity - old))
+        self.free_slots.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def slot_of(self, veh):
+        """Return the slot of veh, giving it a new one if needed"""
+        if veh.slot is None:
+            if len(self.free_slots) == 0:
+                self.allocate(2 * self.capacity)
+            veh.slot = self.free_slots.pop()
+            self.objects[veh.slot] = veh
+            self.active[veh.slot] = True
+            self.free[veh.slot] = False
+            self.synced[veh.slot] = True
+        return veh.slot
+
+    def write(self, veh):
+        """Copy the state of veh in its slot
+        Its kinematics are only copied if they are up to date (see fetch()), the ones of the slot being kept otherwise"""
+        s = self.slot_of(veh)
+        if self.synced[s]:
+            self.x[s] = veh.x
+            self.v[s] = veh.v
+            self.last_a[s] = veh.last_a
+        self.v0[s] = veh.v0
+        self.slow_down[s] = veh.slow_down
+        self.a[s] = veh.a
+        self.b[s] = veh.b
+        self.T[s] = veh.T
+        self.s0[s] = veh.s0
+        self.b_max[s] = veh.b_max
+        self.length[s] = veh.length
+        self.priority_gap[s] = PRIORITY_GAP[veh.veh_type]
+        self.is_stop[s] = veh.veh_type == "stop"
+        self.moving[s] = veh in vehicles
+        if veh.leader is None:
+            self.leader[s] = -1
+        else:
+            if veh.leader.slot is None: # e.g. a stop vehicle never seen before
+                self.write(veh.leader)
+            self.leader[s] = veh.leader.slot
+        self.road[s] = key(veh.road)
+        self.next_road[s] = key(veh.next_road)
+        self.destination_cross[s] = key(veh.destination_cross)
+        self.road_length[s] = veh.road.length
+        self.speed_limit[s] = veh.road.speed_limit
+
+    def remove(self, veh):
+        """Free the slot of a vehicle that left the map"""
+        if veh.slot is not None:
+            self.active[veh.slot] = False
+            self.moving[veh.slot] = False
+            self.free[veh.slot] = False
+            self.synced[veh.slot] = True
+            self.leader[veh.slot] = -1
+            self.objects[veh.slot] = None
+            self.free_slots.append(veh.slot)
+            veh.slot = None
+
+    def spacing_and_leader_speed(self, idx):
+        """Vectorized Vehicle.spacing_with_leader() and Vehicle.speed_of_leader() for the slots idx"""
+        x, v, length = self.x[idx], self.v[idx], self.length[idx]
+        d_to_cross = self.road_length[idx] - x
+        leader = self.leader[idx]
+        has_leader = leader >= 0
+        l = np.where(has_leader, leader, 0)
+        xl, ll = self.x[l], self.length[l]
+        half_lengths = (ll + length) / 2
+        road_l = self.road[l]
+
+        same_road = has_leader & (road_l == self.road[idx])
+        next_road = has_leader & ~same_road & (road_l == self.next_road[idx])
+        fake = has_leader & ~same_road & ~next_road & (self.destination_cross[l] == self.destination_cross[idx])
+
+        spacing = np.full(len(idx), float(SPACING_NO_LEADER))
+        same = xl - x - half_lengths
+        # "standard" leader, never behind (see Vehicle.spacing_with_leader())
+        floor = np.where(self.is_stop[l], 0.00001, 0.01)
+        spacing = np.where(same_road, np.maximum(floor, same), spacing)
+        spacing = np.where(next_road, np.maximum(0.00001, d_to_cross + xl - half_lengths), spacing)
+        spacing = np.where(fake, np.maximum(0.00001, d_to_cross - (self.road_length[l] - xl) - half_lengths), spacing)
+
+        leader_speed = np.where(has_leader, self.v[l], v)
+        return spacing, leader_speed
+
+    def acceleration_IIDM(self, idx):
+        """Vectorized Vehicle.acceleration_IIDM() for the slots idx"""
+        v, v0, a, b, delta = self.v[idx], self.v0[idx], self.a[idx], self.b[idx], 4
+        spacing, leader_speed = self.spacing_and_leader_speed(idx)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            z = (self.s0[idx] + np.maximum(0, v*self.T[idx] + v*(v - leader_speed)/(2*np.sqrt(a*b)))) / spacing
+            under = v < v0
+            a_free = np.where(under, a * (1 - (v/v0)**delta),
+                     np.where(v == 0, 0, -b * (1 - (v0/v)**(a*delta/b))))
+            acc = np.where(under,
+                           np.where(z >= 1, a * (1 - z*z), a_free * (1 - z**(2*a/a_free))),
+                           np.where(z >= 1, a_free + a * (1 - z*z), a_free))
+        return np.maximum(-self.b_max[idx], acc)
+
+    def is_free(self, idx, horizon):
+        """Vectorized Vehicle.is_free() for the slots idx"""
+        v, v0 = self.v[idx], self.v0[idx]
+        v_max = v + np.maximum(0, self.last_a[idx]) * horizon
+        reach = v_max * horizon
+        braking = (v_max*v_max)/(2*self.b_max[idx])
+        free = (self.slow_down[idx] == 0) & (np.abs(v - v0) <= FREE_SPEED_GAP * v0)
+        free &= self.road_length[idx] - self.x[idx] - reach > braking + np.maximum(30, v0*self.priority_gap[idx])
+
+        leader = self.leader[idx]
+        has_leader = leader >= 0
+        l = np.where(has_leader, leader, 0)
+        elsewhere = ~self.is_stop[l] & (self.road[l] == self.road[idx]) & (self.destination_cross[l] != self.destination_cross[idx])
+        v_leader = np.maximum(0, self.v[l] - self.b_max[l]*horizon)
+        spacing = self.spacing_and_leader_speed(idx)[0] - (v_max - v_leader)*horizon
+        gap = self.s0[idx] + np.maximum(0, v_max*self.T[idx] + v_max*(v_max - v_leader)/(2*np.sqrt(self.a[idx]*self.b[idx])))
+        return free & ~(has_leader & (elsewhere | (spacing <= 0) | (gap > FREE_INTERACTION * spacing)))
+
+    def accelerations(self, idx, horizon=None):
+        """Accelerations of the slots idx for the next step (see integrate())
+        Return them with the number of accelerations computed"""
+        if horizon != None:
+            free = idx[self.is_free(idx, horizon)]
+            acc = self.acceleration_IIDM(idx)
+            self.free[:] = False
+            self.free[free] = True
+            self.free_leader[free] = self.leader[free]
+            computed = len(idx)
+        else:
+            kept = self.free[idx] & (self.leader[idx] == self.free_leader[idx]) & (self.slow_down[idx] == 0)
+            acc = self.last_a[idx]
+            if not np.all(kept):
+                acc[~kept] = self.acceleration_IIDM(idx[~kept])
+            computed = len(idx) - int(np.count_nonzero(kept))
+        if not np.all(np.isfinite(acc)):
+            s = idx[np.flatnonzero(~np.isfinite(acc))[0]]
+            veh = self.objects[s]
+            print("ERROR DURING THE SIMULATION, while working on {}, going from road {} to {}, spacing: {}"
+                .format(vehicles.index(veh), veh.road.id, None if veh.next_road == None else veh.next_road.id, veh.spacing_with_leader()))
+            raise ValueError("Non finite acceleration")
+        return acc, computed
+
+    def move(self, idx, acc, dt):
+        """Update the speed and position of the slots idx with their accelerations acc"""
+        v = self.v[idx]
+        self.x[idx] += v*dt + np.maximum(0, 0.5*acc*dt*dt)
+        self.v[idx] = np.maximum(0, v + acc*dt)
+        self.last_a[idx] = acc
+
+    def sync_objects(self, idx):
+        """Copy the kinematics of the slots idx into the Vehicle objects"""
+        objects = self.objects
+        for s, x, v, last_a in zip(idx.tolist(), self.x[idx].tolist(), self.v[idx].tolist(), self.last_a[idx].tolist()):
+            veh = objects[s]
+            veh.x = x
+            veh.v = v
+            veh.last_a = last_a
+        self.synced[idx] = True
+
+    def fetch(self, veh):
+        """Copy the kinematics of the slot of veh into it, if they changed since the last copy"""
+        s = veh.slot
+        if s is not None and not self.synced[s]:
+            veh.x = float(self.x[s])
+            veh.v = float(self.v[s])
+            veh.last_a = float(self.last_a[s])
+            self.synced[s] = True
+
+    def fetch_all(self):
+        """Copy the kinematics of every slot which changed since the last copy into its Vehicle"""
+        self.sync_objects(np.flatnonzero(~self.synced))
+
+    def integrate(self, dt, horizon=None):
+        """Compute the acceleration of every vehicle and update their speed and position
+        horizon [s] : classify the vehicles free for this duration (see is_free()), after computing
+        the acceleration of all of them. Otherwise the free vehicles whose leader did not change keep theirs
+        The Vehicle objects are not updated (see fetch())
+        Return the slots of the moving vehicles and the number of accelerations computed"""
+        idx = np.flatnonzero(self.active & self.moving)
+        acc, computed = self.accelerations(idx, horizon)
+        self.move(idx, acc, dt)
+        self.synced[idx] = False
+        return idx, computed
+
+    def advance(self, dt, horizons):
+        """Integrate the vehicles during len(horizons) steps, as integrate(dt, horizon) for each horizon
+        in turn, when none of them has a leader (see Engine.fast_forward())
+        A vehicle whose speed stops changing (at its desired speed, or below it by less than
+        the rounding) keeps its acceleration and moves on by the same step until the next classification
+        Return the number of accelerations computed"""
+        idx = np.flatnonzero(self.active & self.moving)
+        computed = 0
+        steady = idx[(self.v[idx] == self.v0[idx]) & (self.last_a[idx] == 0)]
+        step = self.v[steady]*dt + 0.0
+        others = np.setdiff1d(idx, steady)
+        for horizon in horizons:
+            if horizon != None: # same classification as integrate() for the next steps
+                acc, count = self.accelerations(idx, horizon)
+                computed += count
+                self.move(idx, acc, dt)
+                continue
+            self.x[steady] += step
+            if len(others) > 0:
+                v = self.v[others]
+                acc, count = self.accelerations(others)
+                computed += count
+                self.move(others, acc, dt)
+                done = self.v[others] == v
+                if np.any(done):
+                    steady = np.concatenate((steady, others[done]))
+                    step = np.concatenate((step, v[done]*dt + np.maximum(0, 0.5*acc[done]*dt*dt)))
+                    others = others[~done]
+        self.sync_objects(idx)
+        return computed
+
+    def leaving(self, idx):
+        """Slots (among idx) of the vehicles which may have reached the end of their road (see Road.outgoing_veh())"""
+        return idx[self.x[idx] >= self.road_length[idx] - self.length[idx]/2]
+
+    def turning(self, idx):
+        """Slots (among idx) of the vehicles close enough from the cross to adapt their speed to the bend"""
+        v = self.v[idx]
+        close = (self.road_length[idx] - self.x[idx]) <= (v*v)/(2*self.b_max[idx]) + 30
+        return idx[close & (self.slow_down[idx] == 0)].tolist()
+
+    def leader_going_elsewhere(self, idx):
+        """Slots (among idx) of the vehicles following a vehicle of the same road going to another cross"""
+        leader = self.leader[idx]
+        has_leader = leader >= 0
+        l = np.where(has_leader, leader, 0)
+        elsewhere = has_leader & ~self.is_stop[l] & (self.road[l] == self.road[idx]) & (self.destination_cross[l] != self.destination_cross[idx])
+        return idx[elsewhere].tolist()
+
+    def in_decision_zone(self, idx):
+        """Slots (among idx) of the vehicles close enough from the cross to negotiate their crossing
+        (vectorized Vehicle.in_decision_zone())"""
+        v = self.v[idx]
+        close = (self.road_length[idx] - self.x[idx]) <= (v*v)/(2*self.b_max[idx]) + self.v0[idx]*self.priority_gap[idx]
+        return idx[close].tolist()
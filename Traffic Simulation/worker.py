@@ -0,0 +1,126 @@
+# coding = utf-8
+"""Simulation run by a separate process for the graphic interface (see main.py)
+
+The process simulates at the speed asked by the interface (x1 : real time), or as fast as it can
+if it cannot keep up, and publishes a snapshot of the map (see snapshot.py) every SNAPSHOT_PERIOD seconds
+in a bounded queue : the interface only draws the latest one, and never waits for the simulation.
+It is driven by commands (play, speed, slow_down, stop) sent by the interface.
+"""
+
+from simulation import *
+from network import load_network
+from engine import Engine
+from profiler import Profiler
+from snapshot import take_snapshot
+from time import perf_counter, sleep
+from queue import Empty, Full
+import multiprocessing
+import traceback
+
+SNAPSHOT_PERIOD = 0.05 # [s] Wall time between two snapshots
+MAX_SNAPSHOTS = 2 # Snapshots waiting for the interface, the oldest ones are dropped if it is late
+PROFILE_PERIOD = 10 # Number of snapshots between two summaries of the profiler
+
+
+def simulate(map_filename, dt, period, commands, snapshots):
+    """Process simulating the map until the "stop" command
+    Put the snapshots in snapshots, or {"error": traceback} if the simulation failed"""
+    try:
+        load_network(map_filename, period=period)
+        engine = Engine(dt)
+        engine.profiler = Profiler()
+        play, speed = True, 1
+        late = 0 # Number of steps to do to catch up with the wall time
+        last = next_snapshot = perf_counter()
+        nb_snapshots = 0
+        while True:
+            while True:
+                try:
+                    command = commands.get_nowait()
+                except Empty:
+                    break
+                if command[0] == "stop":
+                    return
+                elif command[0] == "play":
+                    play = command[1]
+                elif command[0] == "speed":
+                    speed = command[1]
+                elif command[0] == "slow_down":
+                    for veh in vehicles:
+                        if veh.id == command[1]:
+                            veh.fetch()
+                            veh.v0 = veh.v/3
+                            veh.slow_down = int(round(10/dt))
+                            veh.sync()
+                            break
+
+            T = perf_counter()
+            if play:
+                # At most the steps of a snapshot period are caught up : if the simulation is too slow,
+                # it runs as fast as it can without accumulating delay
+                late = min(late + (T - last) * speed / dt, SNAPSHOT_PERIOD * speed / dt)
+            last = T
+            steps = int(late)
+            if steps > 0:
+                engine.next_steps(steps)
+                deleted_vehicles.clear() # the interface finds them missing from the snapshots
+                late -= steps
+
+            T = perf_counter()
+            if T >= next_snapshot:
+                nb_snapshots += 1
+                snapshot = take_snapshot(engine, profile=nb_snapshots % PROFILE_PERIOD == 0)
+                try:
+                    snapshots.put_nowait(snapshot)
+                except Full: # the interface is late : its oldest snapshot is replaced
+                    try:
+                        snapshots.get_nowait()
+                    except Empty:
+                        pass
+                    try:
+                        snapshots.put_nowait(snapshot)
+                    except Full:
+                        pass
+                next_snapshot = T + SNAPSHOT_PERIOD
+            if steps == 0:
+                sleep(min(dt / max(speed, 1e-3), next_snapshot - T) if play else SNAPSHOT_PERIOD / 5)
+    except BaseException:
+        snapshots.put({"error": traceback.format_exc()})
+
+
+class SimulationProcess:
+    """Simulation of a map run by a separate process (see simulate())"""
+
+    def __init__(self, map_filename, dt=0.01, period=6):
+        # A fresh interpreter : forking the interface would copy the state of Tk, which is not fork-safe
+        context = multiprocessing.get_context("spawn")
+        self.commands = context.Queue()
+        self.snapshots = context.Queue(maxsize=MAX_SNAPSHOTS)
+        self.process = context.Process(target=simulate, daemon=True,
+                                       args=(map_filename, dt, period, self.commands, self.snapshots))
+        self.process.start()
+        self.snapshot = None # Latest snapshot received
+
+    def send(self, *command):
+        """Send a command : ("play", bool), ("speed", factor of the real time), ("slow_down", Vehicle.id)"""
+        self.commands.put(command)
+
+    def latest(self):
+        """Return the latest snapshot published (None before the first one), the older ones being dropped"""
+        while True:
+            try:
+                self.snapshot = self.snapshots.get_nowait()
+            except Empty:
+                break
+            if "error" in self.snapshot:
+                raise RuntimeError("Error in the simulation process:\n{}".format(self.snapshot["error"]))
+        if self.process.exitcode not in (None, 0):
+            raise RuntimeError("The simulation process died")
+        return self.snapshot
+
+    def close(self):
+        """Stop the simulation process"""
+        self.send("stop")
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()